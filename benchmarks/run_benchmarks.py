@@ -0,0 +1,266 @@
+# Times the hot paths of the scrapers and the analysis tools on synthetic data at several sizes, writes the timings as JSON,
+# and compares them with a baseline run to catch regressions. These are benchmarks, not tests: they check how long things take,
+# not whether the results are right.
+#
+# Every benchmark runs in a scratch directory, the processed files are written there and read back through
+# WIND_TOOLS_PROCESSED_DIR, so data/processed is never touched.
+#
+# Usage example e.g.
+#
+#   python3.6 run_benchmarks.py
+#   python3.6 run_benchmarks.py --sizes small medium large --output before.json
+#   python3.6 run_benchmarks.py --baseline before.json --threshold 0.25
+
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import argparse, contextlib, json, os, platform, shutil, subprocess, sys, tempfile, time
+import os.path as path
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, path.dirname(path.abspath(__file__)))
+import synthetic_data
+import station_loader
+import text_file_data_scraper
+import csv_data_scraper
+import find_wind_peaks
+import join_dataframes
+import wind_surge_analysis
+import wind_analysis
+
+# The sizes the benchmarks run at: days of hourly data, and the number of stations in the archive
+SIZES = OrderedDict([
+	('small', {'days': 31, 'stations': 5}),
+	('medium', {'days': 365, 'stations': 10}),
+	('large', {'days': 3650, 'stations': 21}),
+])
+
+# The analysis tools timed from a cold start by the import benchmark, as a short batch job would start them
+STARTUP_MODULES = ['wind_analysis', 'find_wind_peaks', 'wind_surge_analysis', 'extreme_value_analysis']
+
+# Each benchmark has a setup function building its inputs in the scratch directory, returning the state and the number of items
+# processed per run, and a run function timed on that state
+
+def setup_text_read_file(size, workdir, rng):
+	filename = synthetic_data.generate_hly15_file(path.join(workdir, 'hly15.txt'), size['days'], rng)
+	return filename, len(synthetic_data.CLIMATE_IDS) * size['days'] * 2 * 24
+
+def run_text_read_file(filename):
+	text_file_data_scraper.read_file(filename)
+
+def setup_text_store_data(size, workdir, rng):
+	filename = synthetic_data.generate_hly15_file(path.join(workdir, 'hly15.txt'), size['days'], rng)
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		contents = text_file_data_scraper.read_file(filename)
+	os.makedirs(path.join(workdir, 'processed'), exist_ok = True)
+	return contents, len(contents)
+
+def run_text_store_data(contents):
+	text_file_data_scraper.store_data(contents)
+
+def setup_buoy_read_file(size, workdir, rng):
+	filename = synthetic_data.generate_buoy_csv(path.join(workdir, 'Halibut.csv'), size['days'] * 24, rng)
+	return filename, size['days'] * 24
+
+def run_buoy_read_file(filename):
+	csv_data_scraper.read_file(filename)
+
+def setup_load_files(size, workdir, rng):
+	filenames = synthetic_data.generate_station_archive(workdir, size['stations'], size['days'] * 24, rng)
+	return filenames, size['stations'] * size['days'] * 24
+
+def run_load_files(filenames):
+	station_loader.clear_cache()
+	station_loader.load_files(filenames)
+
+def setup_load_files_cached(size, workdir, rng):
+	filenames, items = setup_load_files(size, workdir, rng)
+	station_loader.load_files(filenames)
+	return filenames, items
+
+def run_load_files_cached(filenames):
+	station_loader.load_files(filenames)
+
+def setup_create_time_frame(size, workdir, rng):
+	filenames = synthetic_data.generate_station_archive(workdir, size['stations'], size['days'] * 24, rng)
+	dataframes = station_loader.load_files(filenames)
+	times = [time.strftime('%Y-%m-%d %H:%M') for time in pd.date_range('2000-01-01', periods = 24, freq = 'h')]
+	return (dataframes, times), size['stations'] * len(times)
+
+def run_create_time_frame(state):
+	dataframes, times = state
+	for time in times:
+		wind_analysis.create_time_frame(dataframes, time)
+
+def setup_generate_SWAN_input(size, workdir, rng):
+	filenames = synthetic_data.generate_station_archive(workdir, size['stations'], 24, rng)
+	dataframes = station_loader.load_files(filenames)
+	times = [time.strftime('%Y-%m-%d %H:%M') for time in pd.date_range('2000-01-01', periods = 24, freq = 'h')]
+	vector_data = [wind_analysis.create_time_frame(dataframes, time) for time in times]
+	points = wind_analysis.generate_grid_coords(wind_analysis.SWAN_GRID)
+	return (points, wind_analysis.generate_idw_weights(points), vector_data, times), len(points) * len(times)
+
+def run_generate_SWAN_input(state):
+	points, weights, vector_data, times = state
+	if(path.exists('swan_input_data')):
+		os.remove('swan_input_data')
+	for hour_data, time in zip(vector_data, times):
+		wind_analysis.generate_SWAN_input(points, hour_data, time, weights)
+
+def setup_find_wind_peaks(size, workdir, rng):
+	speeds, _ = synthetic_data.generate_wind(size['days'] * 24, rng)
+	return speeds, len(speeds)
+
+def run_find_wind_peaks(speeds):
+	find_wind_peaks.find_wind_peaks(speeds, 40, 72)
+
+# Returns a wind station and a sea level frame over the same hours, joined as wind_surge_analysis.py joins them
+def setup_surge_frames(size, workdir, rng):
+	filename = synthetic_data.generate_station_archive(workdir, 1, size['days'] * 24, rng)[0]
+	slev = synthetic_data.generate_slev_csv(path.join(workdir, 'slev.csv'), size['days'] * 24, rng)
+	return [(filename, station_loader.load_wind_frame(filename)), ('slev.csv', station_loader.load_slev_csv(path.basename(slev)))]
+
+def setup_surge_windows(size, workdir, rng):
+	frames = setup_surge_frames(size, workdir, rng)
+	return wind_surge_analysis.join_dataframes(frames), size['days'] * 24
+
+def run_surge_windows(df):
+	wind_surge_analysis.correlate_windspeed_slev(df, 43.2, 45, 1)
+
+def setup_peak_window_maxima(size, workdir, rng):
+	df, items = setup_surge_windows(size, workdir, rng)
+	return df, items
+
+def run_peak_window_maxima(df):
+	wind_surge_analysis.sweep_peak_window_maxima(df['Wind Spd (km/h)'], df['SLEV'], 43.2, 1, range(1, 73))
+
+def setup_wind_surge_join(size, workdir, rng):
+	return setup_surge_frames(size, workdir, rng), size['days'] * 24
+
+def run_wind_surge_join(frames):
+	wind_surge_analysis.join_dataframes([(filename, frame.copy()) for filename, frame in frames])
+
+def setup_station_join(size, workdir, rng):
+	filenames = synthetic_data.generate_station_archive(workdir, 2, size['days'] * 24, rng)
+	return station_loader.load_files(filenames), 2 * size['days'] * 24
+
+def run_station_join(frames):
+	join_dataframes.join_dataframes([(filename, frame.copy()) for filename, frame in frames])
+
+# Each module is imported in a fresh interpreter, so the time covers everything it loads before doing any work.
+# The size does not matter here
+def setup_startup(size, workdir, rng):
+	return STARTUP_MODULES, len(STARTUP_MODULES)
+
+def run_startup(modules):
+	for module in modules:
+		subprocess.check_call([sys.executable, '-c', 'import ' + module], cwd = root_dir + "/utils")
+
+# name: (setup, run)
+BENCHMARKS = OrderedDict([
+	('startup (import)', (setup_startup, run_startup)),
+	('text_file_data_scraper.read_file', (setup_text_read_file, run_text_read_file)),
+	('text_file_data_scraper.store_data', (setup_text_store_data, run_text_store_data)),
+	('csv_data_scraper.read_file', (setup_buoy_read_file, run_buoy_read_file)),
+	('station_loader.load_files', (setup_load_files, run_load_files)),
+	('station_loader.load_files (cached)', (setup_load_files_cached, run_load_files_cached)),
+	('wind_analysis.create_time_frame', (setup_create_time_frame, run_create_time_frame)),
+	('wind_analysis.generate_SWAN_input', (setup_generate_SWAN_input, run_generate_SWAN_input)),
+	('find_wind_peaks.find_wind_peaks', (setup_find_wind_peaks, run_find_wind_peaks)),
+	('wind_surge_analysis.correlate_windspeed_slev', (setup_surge_windows, run_surge_windows)),
+	('wind_surge_analysis.sweep_peak_window_maxima', (setup_peak_window_maxima, run_peak_window_maxima)),
+	('wind_surge_analysis.join_dataframes', (setup_wind_surge_join, run_wind_surge_join)),
+	('join_dataframes.join_dataframes', (setup_station_join, run_station_join)),
+])
+
+# Sets up and times one benchmark at one size in its own scratch directory. The tools print as they go,
+# so their output is discarded while they run. Returns the best and median time over the repeats
+def time_benchmark(name, size, repeats, seed):
+
+	setup, run = BENCHMARKS[name]
+	workdir = tempfile.mkdtemp(prefix = 'wind_tools_benchmark_')
+	cwd = os.getcwd()
+	os.environ['WIND_TOOLS_PROCESSED_DIR'] = workdir
+	station_loader.clear_cache()
+	try:
+		os.chdir(workdir)
+		with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+			state, items = setup(size, workdir, np.random.default_rng(seed))
+			timings = []
+			for repeat in range(repeats):
+				start = time.perf_counter()
+				run(state)
+				timings.append(time.perf_counter() - start)
+	finally:
+		os.chdir(cwd)
+		del os.environ['WIND_TOOLS_PROCESSED_DIR']
+		station_loader.clear_cache()
+		shutil.rmtree(workdir, ignore_errors = True)
+
+	best = min(timings)
+	return {'seconds': best, 'median_seconds': float(np.median(timings)), 'items': items, 'items_per_second': items / best if best > 0 else None}
+
+# Runs every selected benchmark at every size and returns the report
+def run_benchmarks(names, sizes, repeats, seed):
+
+	report = {
+		'created': pd.Timestamp.now().isoformat(),
+		'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__, 'machine': platform.machine(), 'system': platform.system()},
+		'repeats': repeats,
+		'sizes': OrderedDict((size, SIZES[size]) for size in sizes),
+		'results': OrderedDict(),
+	}
+	for name in names:
+		report['results'][name] = OrderedDict()
+		for size in sizes:
+			result = time_benchmark(name, SIZES[size], repeats, seed)
+			report['results'][name][size] = result
+			print("%-48s %-7s %10.4f s %14.0f items/s" % (name, size, result['seconds'], result['items_per_second'] or 0))
+	return report
+
+# Compares a report with a baseline report. Returns the (name, size, baseline seconds, seconds) of every benchmark
+# that got slower than the baseline by more than threshold, e.g. 0.25 for 25 %
+def find_regressions(report, baseline, threshold):
+
+	regressions = []
+	for name, sizes in report['results'].items():
+		for size, result in sizes.items():
+			previous = baseline.get('results', {}).get(name, {}).get(size)
+			if(previous is None or 'seconds' not in previous or 'seconds' not in result):
+				continue
+			if(result['seconds'] > previous['seconds'] * (1 + threshold)):
+				regressions.append((name, size, previous['seconds'], result['seconds']))
+	return regressions
+
+# The main function handles higher level program logic
+def main(argv):
+
+	parser = argparse.ArgumentParser(description = "Time the hot paths of the wind tools on synthetic data.")
+	parser.add_argument('--sizes', nargs = '+', choices = list(SIZES), default = ['small', 'medium'], help = "data sizes to run")
+	parser.add_argument('--only', nargs = '+', default = None, help = "run only the benchmarks whose names contain one of these strings")
+	parser.add_argument('--repeats', type = int, default = 3, help = "number of timed runs of each benchmark, the best one is kept")
+	parser.add_argument('--seed', type = int, default = 0, help = "seed of the synthetic data")
+	parser.add_argument('--output', default = path.join(path.dirname(path.abspath(__file__)), 'benchmark_results.json'), help = "where to write the JSON report")
+	parser.add_argument('--baseline', default = None, help = "JSON report of an earlier run to compare with")
+	parser.add_argument('--threshold', type = float, default = 0.25, help = "slowdown over the baseline counted as a regression, e.g. 0.25 for 25 %%")
+	args = parser.parse_args(argv[1:])
+
+	names = [name for name in BENCHMARKS if args.only is None or any(part in name for part in args.only)]
+	report = run_benchmarks(names, args.sizes, args.repeats, args.seed)
+	with open(args.output, 'w') as f:
+		json.dump(report, f, indent = 2)
+	print("\nWrote %s" % (args.output))
+
+	if(args.baseline):
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+		regressions = find_regressions(report, baseline, args.threshold)
+		for name, size, previous, current in regressions:
+			print("REGRESSION %-48s %-7s %.4f s -> %.4f s (%+.0f %%)" % (name, size, previous, current, (current / previous - 1) * 100))
+		if(regressions):
+			sys.exit(1)
+		print("No regressions over %.0f %% against %s" % (args.threshold * 100, args.baseline))
+	sys.exit(0)
+
+if __name__ == "__main__":
+	main(sys.argv)
@@ -0,0 +1,138 @@
+# Generators of realistic synthetic inputs for the benchmarks, written in the same layouts as the real sources:
+# HLY15 text files, Environment Canada monthly csv files, buoy csv files, sea level (SLEV) csv files
+# and archives of N processed hourly station files.
+#
+# Wind speeds follow a gamma distribution with a slow storm cycle, directions wander around the prevailing south easterlies,
+# and a share of the readings are missing or estimated so the parsers see the same sentinels and flags as in the real data.
+
+import numpy as np
+import pandas as pd
+import os, sys
+import os.path as path
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+sys.path.insert(0, root_dir + "/data")
+from station_loader import set_schema, SCHEMA_ENVIRONMENT_CANADA, SPEED_COLUMN, DIRECTION_COLUMN
+from text_file_data_scraper import get_station_names
+
+# The climate ids the text file scraper knows about, in the order it stores them
+CLIMATE_IDS = ['1020590', '1021330', '102BFHH', '1045100', '1106200', '1107010', '1017101', '1027403', '1108290', '101G100', '1108380',
+	'1108291', '1045101', '1043304', '1108447', '1108395', '1021830', '1108446', '1021332', '1022689', '1017099']
+
+# The columns of the Environment Canada hourly csv files, after the 15 lines of station information
+ENVIRONMENT_CANADA_COLUMNS = ['Date/Time', 'Year', 'Month', 'Day', 'Time', 'Temp (°C)', 'Temp Flag', 'Dew Point Temp (°C)',
+	'Dew Point Temp Flag', 'Rel Hum (%)', 'Rel Hum Flag', 'Wind Dir (10s deg)', 'Wind Dir Flag', 'Wind Spd (km/h)', 'Wind Spd Flag',
+	'Visibility (km)', 'Visibility Flag', 'Stn Press (kPa)', 'Stn Press Flag', 'Hmdx', 'Hmdx Flag', 'Wind Chill', 'Wind Chill Flag', 'Weather']
+
+# The header of the buoy csv files. Pandas renames the repeated columns WDIR.1, WSPD.1 etc. and the trailing comma gives 'Unnamed: 23'
+BUOY_HEADER = 'STN_ID,DATE,Q_FLAG,LATITUDE,LONGITUDE,DEPTH,VCAR,VTPK,VWH$,VCMX,VTP$,WDIR,WSPD,WSS$,GSPD,WDIR,WSPD,WSS$,GSPD,ATMS,ATMS,DRYT,SSTP,'
+
+# Returns hourly wind speeds (km/h) and directions (10s of degrees) for a number of hours
+def generate_wind(hours, rng):
+	storms = 1 + 0.8 * np.sin(np.arange(hours) * 2 * np.pi / (24 * 5) + rng.uniform(0, 2 * np.pi))
+	speeds = np.round(rng.gamma(2.0, 7.0, hours) * storms)
+	directions = np.round(np.mod(14 + np.cumsum(rng.normal(0, 0.6, hours)), 36)) + 1
+	return speeds, directions
+
+# Returns a mask of the readings that are missing, and a mask of the readings that are estimated
+def generate_flags(size, rng, missing = 0.03, estimated = 0.02):
+	draws = rng.random(size)
+	return draws < missing, (draws >= missing) & (draws < missing + estimated)
+
+# Returns the lines of an HLY15 text file: one line per (climate id, day, data type) holding 24 hourly values.
+# Each value is 6 digits followed by a flag, a space when valid, 'E' when estimated, and '-99999M' when missing
+def generate_hly15_lines(climate_ids, start, days, rng, data_types = ('076', '156')):
+
+	lines = []
+	for climate_id in climate_ids:
+		speeds, directions = generate_wind(days * 24, rng)
+		for day_index, day in enumerate(pd.date_range(start, periods = days, freq = 'D').strftime('%Y%m%d')):
+			for data_type in data_types:
+				values = (directions if data_type in ('156', '069') else speeds)[day_index * 24:(day_index + 1) * 24]
+				missing, estimated = generate_flags(24, rng)
+				tokens = ['-99999M' if is_missing else '%06d%s' % (value, 'E' if is_estimated else ' ')
+					for value, is_missing, is_estimated in zip(values.astype(int).tolist(), missing.tolist(), estimated.tolist())]
+				lines.append(climate_id + day + data_type + ''.join(tokens))
+	return lines
+
+# Writes an HLY15 text file covering every known climate id for a number of days
+def generate_hly15_file(filename, days, rng, start = '2000-01-01'):
+	with open(filename, 'w') as f:
+		f.write('\n'.join(generate_hly15_lines(CLIMATE_IDS, start, days, rng)) + '\n')
+	return filename
+
+# Writes one month of an Environment Canada hourly csv file as downloaded from the bulk data page
+def generate_environment_canada_csv(filename, station_name, year, month, rng):
+
+	times = pd.date_range('%d-%02d-01' % (year, month), pd.Timestamp('%d-%02d-01' % (year, month)) + pd.offsets.MonthEnd(1) + pd.Timedelta(hours = 23), freq = 'h')
+	speeds, directions = generate_wind(len(times), rng)
+	missing, _ = generate_flags(len(times), rng)
+	frame = pd.DataFrame({
+		'Date/Time': times.strftime('%Y-%m-%d %H:%M'), 'Year': times.year, 'Month': times.month, 'Day': times.day, 'Time': times.strftime('%H:%M'),
+		'Temp (°C)': np.round(rng.normal(10, 5, len(times)), 1), 'Temp Flag': '',
+		'Dew Point Temp (°C)': np.round(rng.normal(5, 4, len(times)), 1), 'Dew Point Temp Flag': '',
+		'Rel Hum (%)': rng.integers(40, 100, len(times)), 'Rel Hum Flag': '',
+		'Wind Dir (10s deg)': np.where(missing, np.nan, directions), 'Wind Dir Flag': np.where(missing, 'M', ''),
+		'Wind Spd (km/h)': np.where(missing, np.nan, speeds), 'Wind Spd Flag': np.where(missing, 'M', ''),
+		'Visibility (km)': 24.1, 'Visibility Flag': '', 'Stn Press (kPa)': np.round(rng.normal(101.3, 0.8, len(times)), 2), 'Stn Press Flag': '',
+		'Hmdx': np.nan, 'Hmdx Flag': '', 'Wind Chill': np.nan, 'Wind Chill Flag': '', 'Weather': np.where(missing, 'NA', 'Cloudy'),
+	}, columns = ENVIRONMENT_CANADA_COLUMNS)
+
+	information = ['"Station Name","%s"' % station_name, '"Province","BRITISH COLUMBIA"', '"Latitude","49.35"', '"Longitude","-124.16"',
+		'"Elevation","12.60"', '"Climate Identifier","1020590"', '"WMO Identifier","71769"', '"TC Identifier","WGB"', '""',
+		'"Legend"', '"E","Estimated"', '"M","Missing"', '"NA","Not Available"', '"**","Partner data that is not subject to review by the National Climate Archives"', '""']
+	with open(filename, 'w', encoding = 'utf-8') as f:
+		f.write('\n'.join(information) + '\n')
+		frame.to_csv(f, index = False, quoting = 1)
+	return filename
+
+# Writes a buoy csv file with a number of hourly readings, in the layout read by csv_data_scraper.py.
+# Wind speeds are in m/s and directions in degrees, as in the files from the buoys
+def generate_buoy_csv(filename, hours, rng, start = '2000-01-01'):
+
+	times = pd.date_range(start, periods = hours, freq = 'h')
+	speeds, directions = generate_wind(hours, rng)
+	missing, _ = generate_flags(hours, rng)
+	speeds = np.where(missing, np.nan, np.round(speeds / 3.6, 1))
+	directions = np.where(missing, np.nan, directions * 10)
+	columns = [np.full(hours, 'C46146'), times.strftime('%m/%d/%Y %H:%M'), np.full(hours, 1), np.full(hours, 49.34), np.full(hours, -123.72),
+		np.full(hours, 45), np.round(rng.gamma(2, 0.3, hours), 2), np.round(rng.gamma(4, 1, hours), 2), np.round(rng.gamma(2, 0.3, hours), 2),
+		np.round(rng.gamma(2, 0.5, hours), 2), np.round(rng.gamma(4, 1, hours), 2), directions, speeds, speeds, np.round(speeds * 1.3, 1),
+		directions, speeds, speeds, np.round(speeds * 1.3, 1), np.round(rng.normal(1013, 8, hours), 1), np.round(rng.normal(1013, 8, hours), 1),
+		np.round(rng.normal(10, 4, hours), 1), np.round(rng.normal(10, 2, hours), 1)]
+	frame = pd.DataFrame(dict(enumerate(columns)))
+	with open(filename, 'w') as f:
+		f.write(BUOY_HEADER + '\n')
+		# Every line ends with a comma like the header
+		frame.to_csv(f, header = False, index = False, lineterminator = ',\n')
+	return filename
+
+# Writes a sea level csv file with a number of hourly readings in metres, and no header, as read by station_loader.load_slev_csv()
+def generate_slev_csv(filename, hours, rng, start = '2000-01-01'):
+
+	times = pd.date_range(start, periods = hours, freq = 'h')
+	tide = 2.5 + 1.5 * np.sin(np.arange(hours) * 2 * np.pi / 12.42) + 0.6 * np.sin(np.arange(hours) * 2 * np.pi / 23.93)
+	surge = np.convolve(rng.gamma(1.0, 0.05, hours), np.ones(12) / 12, mode = 'same')
+	levels = np.round(tide + surge, 3)
+	missing, _ = generate_flags(hours, rng, missing = 0.01)
+	frame = pd.DataFrame({'time': times.strftime('%Y/%m/%d %H:%M'), 'level': np.where(missing, np.nan, levels), 'empty': ''})
+	frame.to_csv(filename, header = False, index = False)
+	return filename
+
+# Writes one hourly processed station file in the Environment Canada layout, named and keyed by its filename
+def generate_station_file(directory, filename, hours, rng, start = '2000-01-01'):
+
+	times = pd.date_range(start, periods = hours, freq = 'h', name = 'Date/Time')
+	speeds, directions = generate_wind(hours, rng)
+	missing, _ = generate_flags(hours, rng)
+	frame = pd.DataFrame({DIRECTION_COLUMN: np.where(missing, np.nan, directions), SPEED_COLUMN: np.where(missing, np.nan, speeds)}, index = times)
+	with pd.HDFStore(path.join(directory, filename), mode = 'w') as store:
+		store.append(filename, frame)
+		set_schema(store, filename, SCHEMA_ENVIRONMENT_CANADA)
+	return filename
+
+# Writes an archive of up to 21 processed station files named after real stations, and returns their filenames
+def generate_station_archive(directory, stations, hours, rng, start = '2000-01-01'):
+	filenames = [get_station_names(climate_id) for climate_id in CLIMATE_IDS[:stations]]
+	return [generate_station_file(directory, filename, hours, rng, start) for filename in filenames]
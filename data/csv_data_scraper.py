@@ -7,17 +7,32 @@
 
 from datetime import datetime, date
 import pandas as pd
-import sys, os, shutil
+import sys, os, shutil, logging
+
+# The shared profiling helpers live in utils
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+import profiling
+from station_loader import compact_frame, set_schema, SCHEMA_BUOY, STRING_MIN_ITEMSIZE
+
+logger = logging.getLogger(__name__)
 
 # Read the csv file and make the necessary formatting modification to it
 def read_file(filename):
 
 	# Set this option to see more columns when printing pandas df for debugging purposes
 	pd.set_option('display.expand_frame_repr', False)
+	with profiling.stage('read_file') as current:
+		df = read_buoy_csv(filename)
+		current.count(rows = len(df), bytes_read = profiling.file_size(filename))
+	logger.debug("%s", df)
+	return df
+
+# Reads the buoy csv file into a frame indexed by the hour, with the wind speed in km/h and the direction in 10s of degrees
+def read_buoy_csv(filename):
+
 	df = pd.read_csv(filename)
-	# Convert the format of the date to match the date format of all the other files
-	df['Date/Time'] = pd.to_datetime(df['DATE'], errors = 'coerce').dt.strftime('%Y-%m-%d %H:00')
-	df['Date/Time'] = pd.to_datetime(df['Date/Time']).dt.strftime('%Y-%m-%d %H:%M')
+	# Truncate the readings to the hour so the index lines up with the hourly index of all the other files
+	df['Date/Time'] = pd.to_datetime(df['DATE'], errors = 'coerce').dt.floor('h')
 	df = df.set_index('Date/Time')
 	del df['DATE'], df['VCAR'], df['VTPK'], df['VWH$'], df['VCMX'], df['GSPD'], df['WSPD'], df['DEPTH'], df['WDIR'], df['WSS$.1']
 	del df['GSPD.1'], df['DRYT'], df['ATMS'], df['ATMS.1'], df['SSTP'], df['Q_FLAG'], df['STN_ID'], df['LATITUDE'], df['LONGITUDE']
@@ -26,7 +41,6 @@ def read_file(filename):
 	#df['Wind Dir (10s deg)'] = df['Wind Dir (10s deg)'] - 180
 	df['Wind Dir (10s deg)'] = df['Wind Dir (10s deg)']/10
 	df['Wind Spd (km/h)'] = (df['Wind Spd (km/h)'] * (3.6)).round()
-	print(df)
 	return df
 
 # Store the .csv data in hdf5 format
@@ -39,14 +53,19 @@ def store_data(dataframe, filename):
 		filename = filename[:-4] + '_46131'
 	# Establish the path of the location where you want to store the files
 	relative_path = path + "/processed/" + filename
-	# Convert the frame to hdf5 format
-	dataframe.to_hdf(filename, filename, append = True)
-	# Move the file to its destination
-	shutil.move(path + "/" + filename, relative_path)
+	with profiling.stage('store_data') as current:
+		# Convert the frame to hdf5 format, recording its layout so utils/station_loader.py can read it without guessing
+		with pd.HDFStore(filename) as store:
+			store.append(filename, compact_frame(dataframe), min_itemsize = STRING_MIN_ITEMSIZE)
+			set_schema(store, filename, SCHEMA_BUOY)
+		# Move the file to its destination
+		shutil.move(path + "/" + filename, relative_path)
+		current.count(rows = len(dataframe), bytes_written = profiling.file_size(relative_path))
 
 # The main function takes care of the overall program logic
 def main(argv):
 
+	argv = profiling.setup(argv)
 	if(len(argv) < 2):
 		print("Please include the name of the .csv as the second argument.")
 		sys.exit(0)
@@ -5,7 +5,14 @@
 # 2 Concatenates the data into a multi-year Pandas data frame.
 
 from os import listdir
-import pandas as pd, numpy as np, csv, io, requests, os, sys, urllib, shutil
+import pandas as pd, numpy as np, csv, io, requests, os, sys, urllib, shutil, logging
+
+# The shared profiling helpers live in utils
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+import profiling
+from station_loader import compact_frame, decode_flag_columns, set_schema, SCHEMA_ENVIRONMENT_CANADA, STRING_MIN_ITEMSIZE
+
+logger = logging.getLogger(__name__)
 
 # Get the associated station name for a given station ID
 # I have also included approximate start and end dates for each data set
@@ -213,22 +220,14 @@ def get_station_data(station_id):
 # Check if the directory weather_station_data exists;
 # If it does not, then create it
 def check_directory(dir_name):
-	print("Checking if the directory %s exists." % (dir_name))
+	logger.info("Checking if the directory %s exists.", dir_name)
 	path = os.getcwd() +'/' + dir_name
 	if(os.path.exists(path)):
-		print("%s exists." % (dir_name))
+		logger.info("%s exists.", dir_name)
 	else:
-		print("Creating directory %s to store HDF5 files.")
+		logger.info("Creating directory %s to store HDF5 files.", dir_name)
 		os.makedirs(path)
 
-# A helper function to display progress bar while the frames are being read in
-def progress_bar(value, endvalue, bar_length=25):
-	percent = float(value) / endvalue
-	arrow = '-' * int(round(percent * bar_length)-1) + '>'
-	spaces = ' ' * (bar_length - len(arrow))
-	sys.stdout.write("\rPercent: [{0}] {1}%".format(arrow + spaces, int(round(percent * 100))))
-	sys.stdout.flush()
-
 # Returns the status of a given url request to check the connection
 def get_request_status(url):
 	try:
@@ -259,14 +258,14 @@ def get_weather_data(station_id):
 	path = os.getcwd()
 	relative_path = path + "/processed/" + filename
 	if(os.path.isfile(relative_path)):
-		print("\n%s exists in HDF5 format in /weather_station_data and can be read." % (filename))
+		logger.info("%s exists in HDF5 format in /weather_station_data and can be read.", filename)
 		df = pd.read_hdf(relative_path, key = filename, mode = 'r')
 		return df
 	else:
 		# If no HDF5 file is found in the current directory, make one
-		print("\nFile was not found in %s.\nProceeding to create it using data on the Governement of Canada website datasheets." % (relative_path))
-		print("\nPopulating meteorological data pandas frames for station %s.\n\nStation ID: %s\nStart Year: %s\nEnd Year: %s\n" % (station_name, station_id, start_year, end_year))
-		print("The total number of frames that will have to be created and concatenated is: %d\n" % (year_gap*12))
+		logger.info("File was not found in %s.\nProceeding to create it using data on the Governement of Canada website datasheets.", relative_path)
+		logger.info("Populating meteorological data pandas frames for station %s.\n\nStation ID: %s\nStart Year: %s\nEnd Year: %s", station_name, station_id, start_year, end_year)
+		logger.info("The total number of frames that will have to be created and concatenated is: %d", year_gap*12)
 
 		frames = []
 		# Generate the URLs for a given date range and station ID, and create dfs from the csvs found in them
@@ -277,33 +276,42 @@ def get_weather_data(station_id):
 
 				# Check the requests status of the url, if it is 200, then create a df
 				if(get_request_status(url) != 200):
-					print("Invalid request: %s\n%s" % (url, get_request_status(url)))
+					logger.warning("Invalid request: %s\n%s", url, get_request_status(url))
 					continue
 				else:
-					# Load it into a pandas frame, skip the first 15 rows of the input to avoid repetition of the column headers
-					df = pd.read_csv(url, error_bad_lines = False, skiprows = 15)
-					# Set the key of the df to be the Date/Time column
-					df = df.set_index("Date/Time")
+					with profiling.stage('download_month') as current:
+						# Load it into a pandas frame, skip the first 15 rows of the input to avoid repetition of the column headers
+						df = pd.read_csv(url, on_bad_lines = 'skip', skiprows = 15)
+						# Set the key of the df to be the Date/Time column, parsed to datetime64
+						df['Date/Time'] = pd.to_datetime(df['Date/Time'], format = '%Y-%m-%d %H:%M')
+						df = df.set_index("Date/Time")
+						current.count(rows = len(df))
 					frames.append(df)
 					#print("Sucessfully appended frame #%d to the list" % (frame_number))
 				if(year < end_year):
-					progress_bar(len(frames), (year_gap*12))
+					profiling.progress_bar(len(frames), (year_gap*12))
 
 		# Iterating through the list of dfs and concatenating them together
-		print("\n\nNow concatenating monthly frames into a single multi-year frame...\n")
-		df = frames.pop(0)
-		for frame in frames:
-			df = df.append(frame)
+		logger.info("Now concatenating monthly frames into a single multi-year frame...")
+		with profiling.stage('concatenate') as current:
+			df = pd.concat(frames)
+			current.count(rows = len(df))
 
-		# Store the df to HDF5 format to the current directory
-		df.to_hdf(filename, filename, append = True)
-		# Move the file to the appropriate folder
-		shutil.move(path + "/" + filename, relative_path)
-		print("Successfully downloaded the data for %s in single dataframe." % station_name)
+		with profiling.stage('store_data') as current:
+			# Store the df to HDF5 format to the current directory, recording its layout so utils/station_loader.py can read it without guessing.
+			# The measurements are stored as float32 next to the uint8 quality bits decoded from their flag columns
+			with pd.HDFStore(filename) as store:
+				store.append(filename, compact_frame(decode_flag_columns(df)), min_itemsize = STRING_MIN_ITEMSIZE)
+				set_schema(store, filename, SCHEMA_ENVIRONMENT_CANADA)
+			# Move the file to the appropriate folder
+			shutil.move(path + "/" + filename, relative_path)
+			current.count(rows = len(df), bytes_written = profiling.file_size(relative_path))
+		logger.info("Successfully downloaded the data for %s in single dataframe.", station_name)
 
 # The main function takes care of the overall program logic
 def main(argv):
 
+	argv = profiling.setup(argv)
 	if(len(argv) < 2):
 		print("Not enough arguments. Please include the station ID as the second argument.")
 		exit(0)
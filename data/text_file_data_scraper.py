@@ -1,5 +1,5 @@
 # A script to scrape wind readings from text files by Henri De Boever
-# Read the file in, insert the data pertaining to each climateID into an OrderedDict
+# Read the file in, decode the readings and flags of each climateID into a frame
 # Reformat it based on new parameters, then insert into a pandas dataframe
 
 
@@ -15,8 +15,31 @@
 
 import pandas as pd
 import numpy as np
-import sys, os, re, shutil
-from collections import OrderedDict
+import sys, os, shutil, logging
+
+# The shared profiling helpers live in utils
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+import profiling
+from station_loader import compact_frame, set_schema, SCHEMA_TEXT_FILE, STRING_MIN_ITEMSIZE, FLAG_QUALITY, QUALITY_MISSING, QUALITY_OTHER
+
+logger = logging.getLogger(__name__)
+
+# The fixed widths of an HLY15 line: the climate id, date and data type, then 24 hourly values of 6 characters each followed by a flag character
+HEADER_WIDTH = 18
+VALUE_WIDTH = 6
+FIELD_WIDTH = 7
+HOURS_PER_LINE = 24
+LINE_WIDTH = HEADER_WIDTH + HOURS_PER_LINE * FIELD_WIDTH
+
+# The value the HLY15 files write for a missing reading
+MISSING_VALUE = -99999
+
+# The quality bits of every flag character. A space, or the padding of a short line, is a valid reading
+FLAG_CHARACTER_QUALITY = np.full(256, QUALITY_OTHER, dtype = np.uint8)
+FLAG_CHARACTER_QUALITY[[ord(' '), 0]] = 0
+for flag, quality in FLAG_QUALITY.items():
+	if(len(flag) == 1):
+		FLAG_CHARACTER_QUALITY[ord(flag)] = quality
 
 # A helper function that associates the name of a measurment location with its climateID
 def get_station_names(climate_id):
@@ -64,26 +87,21 @@ def get_station_names(climate_id):
 	if climate_id == '1017099':
 		return ('Saturna_Capmon_CS_1017099')
 
-# Unpack the dictionary and store it into a pandas data frame
-def store_data(dict):
+# Store the parsed readings in HDF5 format, one file per station
+def store_data(readings):
+	with profiling.stage('store_data') as current:
+		bytes_written = write_station_frames(readings)
+		current.count(rows = len(readings), bytes_written = bytes_written)
 
-	# climate_ids contains a list of the ids encountered in the files
-	# Each ID is uniquely affiliated with one observation location
-	climate_ids = []
-	frames = []
-	# Get a list of climate ids from the dictionary using a dict comprehension
-	# Cast the set to list in order to do list comprehensions on it later
-	climate_ids = list({key[0] for key, value in dict.items() if key[0] not in climate_ids})
+# Splits the parsed readings by climate id and writes one HDF5 file per station. Returns the number of bytes written
+def write_station_frames(readings):
 
+	frames = []
 	# Set this option to see more columns when printing pandas dfs for testing purposes
 	pd.set_option('display.expand_frame_repr', False)
 
-	df = pd.DataFrame(list(dict.items()), columns = ['Key', 'Values'])
-	df['climate_id'], df['date/time'], df['Data Type'] = zip(*df.Key)
-	print(df.Values)
-	df['Data'] = df.Values
-	print(df['Key'], df['Values'])
-	del df['Key'], df['Values']
+	df = readings
+	logger.debug("%s", df)
 	# Populate each sub frame by selecting rows containing the correct climateID
 	df1 = df.loc[df['climate_id'] == '1020590']
 	df2 = df.loc[df['climate_id'] == '1021330']
@@ -131,113 +149,84 @@ def store_data(dict):
 
 	# Store each DF in HDF5 format in the directory /weather_station_data
 	path = os.getcwd()
+	bytes_written = 0
 	for frame in frames:
 		# Set the key of the frame to be the date and time
 		frame = frame.set_index("date/time")
-		# Cast the type of the wind data to float to handle NaNs
-		frame['Data'] = frame['Data'].astype(float)
+		# Store the wind data as float32 next to its uint8 quality, and the data types as categoricals
+		frame = compact_frame(frame)
 		# Get the climate_id of the current frame
 		curr_climate_id = frame['climate_id'].values[0]
-		print("Current Climate ID: %s" % curr_climate_id)
+		logger.info("Current Climate ID: %s", curr_climate_id)
 		#del frame['climate_id']
-		print(list(frame))
-		print(frame.index)
+		logger.debug("%s", list(frame))
+		logger.debug("%s", frame.index)
 		# Generate a filename
 		filename = get_station_names(curr_climate_id)
 		# Establish the path of the location where you want to store the files
 		relative_path = path + "/processed/" + filename
-		# Convert the frame to hdf5 format
-		frame.to_hdf(filename, filename, append = True)
+		# Convert the frame to hdf5 format, recording its layout so utils/station_loader.py can read it without guessing
+		with pd.HDFStore(filename) as store:
+			store.append(filename, frame, min_itemsize = STRING_MIN_ITEMSIZE)
+			set_schema(store, filename, SCHEMA_TEXT_FILE)
 		# Move the file to its destination
 		shutil.move(path + "/" + filename, relative_path)
+		bytes_written += profiling.file_size(relative_path)
+	return bytes_written
 
-# This function handles occurences of invalid measurements on the form '-99999M'
-# Input parameter is a list, output parameter is a list
-# It replaces occurences with the equivalent number of NaNs in the same order as the invalid data was stored
-def handle_invalid_data(line):
-	values = []
-	final_list = []
-	for measurement in line:
-		if('E' in measurement and '-99999M' in measurement):
-			# Skip cases where the 2 edge cases appear
-			continue
-		elif('-99999M' in measurement):
-			values = measurement.split('M')
-			values = [measurement for measurement in values if measurement != '']
-			values = [np.nan if measurement == '-99999' else measurement for measurement in values]
-			for value in values:
-				final_list.append(value)
-		elif('E' in measurement):
-			values = measurement.split('E')
-			values = [measurement for measurement in values if measurement != '']
-			for value in values:
-				final_list.append(value)
-		else:
-			final_list.append(measurement)
-	return final_list
-
-# A helper function that is called in read_file. Returns a list of attributes for each line in the input file
-# Looks at the first token in every line, and extablishes the climateID, date, and type for the data string
-# e.g.
-#   110838020130821156000007 -99999M-99999M000001 000006 000006 000011 000000...........
-#
-#   First 7 digits are the climateID, next 8 digits are the date, next 3 are the measurement type,
-#   then the next 6 digits are the first measurement (km/h). Subsequent measurments are seperated by spaces.
-def get_line_info(token):
-
-	climateID = token[0:7]
-	date = token[7:15]
-	hyphenated_date = date[:4] + '-' + date[4:6] + '-' + date[6:]
-	type = token[15:18]
-	first_measurement = token[18:]
-	return (climateID, hyphenated_date, type, first_measurement)
-
-# Reads a file and inserts relevant info into an Ordered Dict
+# Reads a file and decodes its readings into a frame
 def read_file(filename):
-
-	data = OrderedDict()
-	line_data = []
-	print("\nParsing %s for wind data:\n" % (filename))
-	with open(filename) as f:
-		for line in f:
-			line = line.split(' ')
-			id = get_line_info(line[0])[0]
-			date = get_line_info(line[0])[1]
-			type = get_line_info(line[0])[2]
-			first_measurement = get_line_info(line[0])[3]
-			line_data = line[1:]
-
-			# Add the first measurement to the list
-			line_data.insert(0, first_measurement)
-			# Get rid of the newline character found in the last entry of the list by doing a list.pop()
-			line_data.pop()
-			# Deal with invalid data values using list comprehensions and a helper function
-			line_data = handle_invalid_data(line_data)
-			# Replace empty data points with NaN
-			line_data = [np.nan if measurement == '' else measurement for measurement in line_data]
-			# Get rid of the leading zeroes in each of the wind speed measurments
-			line_data = [re.sub("^0+","", str(measurement)) if measurement != '000000' else '0' for measurement in line_data]
-			# If the line length is less than 24, pad it with NaNs at the end
-			while(len(line_data) < 24):
-				# If the total line length is somehow under 24, append nan values
-				line_data.append(np.nan)
-			while(len(line_data) > 24):
-				# Get rid of extra NaNs if the length is greater than 24
-				line_data.pop()
-			# Finally, insert the data into the dictionary and assign a time to the measurement based on order of appearance
-			counter = 0
-			for measurement in line_data:
-				time = str(counter).zfill(2)
-				date_time = date + " " + time + ":00"
-				data[(id, date_time, type)] = measurement
-				counter += 1
-
+	with profiling.stage('read_file') as current:
+		data = parse_file(filename)
+		current.count(rows = len(data), bytes_read = profiling.file_size(filename))
 	return data
 
+# Parses every line of an HLY15 text file into a frame with one row per (climate id, date/time, data type), e.g.
+#
+#   110838020130821156000007 -99999M-99999M000001 000006 000006 000011 000000...........
+#
+#   First 7 characters are the climateID, next 8 the date, next 3 the measurement type, then 24 hourly fields of a
+#   6 character value (km/h or 10s of degrees) and a flag, a space for a valid reading.
+#
+# The lines are cut into these fixed width fields as one character array and every value and flag is decoded at once.
+# The Data column holds the readings, NaN for the -99999 sentinel and unreadable values, and the Quality column the uint8 quality bits
+# of each reading from its flag (see station_loader.py). Short lines are padded with missing readings.
+# When a file repeats a (climate id, date/time, data type) the last reading is kept
+def parse_file(filename):
+
+	logger.info("Parsing %s for wind data:", filename)
+	with open(filename, 'rb') as f:
+		lines = [line for line in f.read().splitlines() if line.strip()]
+	characters = np.array(lines, dtype = 'S%d' % LINE_WIDTH).view(np.uint8).reshape(len(lines), LINE_WIDTH)
+
+	climate_ids = np.ascontiguousarray(characters[:, 0:7]).view('S7').ravel().astype(str)
+	dates = pd.to_datetime(np.ascontiguousarray(characters[:, 7:15]).view('S8').ravel().astype(str), format = '%Y%m%d')
+	data_types = np.ascontiguousarray(characters[:, 15:HEADER_WIDTH]).view('S3').ravel().astype(str)
+
+	fields = characters[:, HEADER_WIDTH:].reshape(len(lines), HOURS_PER_LINE, FIELD_WIDTH)
+	digits = fields[:, :, :VALUE_WIDTH].astype(np.int32) - ord('0')
+	negative = fields[:, :, 0] == ord('-')
+	digits[:, :, 0][negative] = 0
+	readable = ((digits >= 0) & (digits <= 9)).all(axis = 2)
+	values = digits.dot(10**np.arange(VALUE_WIDTH - 1, -1, -1))
+	values[negative] = -values[negative]
+	missing = ~readable | (values == MISSING_VALUE)
+	quality = FLAG_CHARACTER_QUALITY[fields[:, :, VALUE_WIDTH]] | np.where(missing, QUALITY_MISSING, 0).astype(np.uint8)
+
+	readings = pd.DataFrame({
+		'climate_id': np.repeat(climate_ids, HOURS_PER_LINE),
+		'date/time': np.repeat(dates, HOURS_PER_LINE) + np.tile(pd.to_timedelta(np.arange(HOURS_PER_LINE), unit = 'h'), len(lines)),
+		'Data Type': np.repeat(data_types, HOURS_PER_LINE),
+		'Data': np.where(missing, np.nan, values).ravel(),
+		'Quality': quality.ravel(),
+	})
+	return readings.drop_duplicates(['climate_id', 'date/time', 'Data Type'], keep = 'last').reset_index(drop = True)
+
 # The main function takes care of the overall program logic
 def main(argv):
 
-	file_contents = OrderedDict()
+	argv = profiling.setup(argv)
+	file_contents = None
 	if(len(argv) < 2):
 		print("Not enough arguments. Please include the name of a all_stations_data.txt as a second argument parameter.")
 		sys.exit(0)
@@ -0,0 +1,46 @@
+# Tests of the adaptive grid refinement of adaptive_grid.py
+
+import numpy as np
+import pandas as pd
+import os, sys
+import os.path as path
+import pytest
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+import adaptive_grid
+import interpolators
+import wind_analysis
+from archive_cube import build_cube, build_cube_header
+from station_loader import SPEED_COLUMN, DIRECTION_COLUMN
+
+# Returns the header and cube of random hourly readings for most of the known stations, some of them missing
+def random_cube(hours = 6, seed = 0):
+	rng = np.random.default_rng(seed)
+	times = pd.date_range('2000-12-14', periods = hours, freq = 'h', name = 'Date/Time')
+	dataframes = []
+	for name in wind_analysis.station_names[::2]:
+		frame = pd.DataFrame({SPEED_COLUMN: rng.integers(0, 60, hours).astype(float),
+			DIRECTION_COLUMN: rng.integers(1, 37, hours).astype(float)}, index = times)
+		dataframes.append((name.replace(' ', '_') + '_1000000', frame[rng.random(hours) > 0.3]))
+	times, stations, cube = build_cube(dataframes)
+	return build_cube_header(times, stations), cube
+
+# With a tolerance of 0 every cell whose corners differ is split down to the lattice, and the SWAN input is byte for byte
+# the one interpolated at every point of the SWAN grid
+@pytest.mark.parametrize('spec', ['idw', 'kriging:model=spherical,range=60'])
+def test_tolerance_zero_matches_the_full_grid(tmp_path, spec):
+	header, cube = random_cube()
+	adaptive = adaptive_grid.create_adaptive_grid(wind_analysis.SWAN_GRID, 2, 1, 0, spec)
+	output = str(tmp_path / 'adaptive')
+	hours = adaptive_grid.write_SWAN_input(adaptive, header, cube, '2000-12-14 00:00', '2000-12-14 05:00', output)
+
+	points = wind_analysis.generate_grid_coords(wind_analysis.SWAN_GRID)
+	interpolator = wind_analysis.generate_idw_weights(points) if spec == 'idw' else interpolators.create_interpolator(points, spec)
+	blocks = []
+	for time in pd.date_range('2000-12-14 00:00', '2000-12-14 05:00', freq = 'h').strftime('%Y-%m-%d %H:%M'):
+		vector_data = adaptive_grid.get_vector_data(header, cube, time)
+		blocks.append(wind_analysis.format_SWAN_block(points, *wind_analysis.interpolate_wind_components(interpolator, vector_data), time))
+	with open(output) as f:
+		assert f.read() == '\n'.join(blocks)
+	assert hours == 6 and adaptive['points_computed'] <= adaptive['points_total']
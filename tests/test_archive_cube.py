@@ -0,0 +1,93 @@
+# Tests of the archive cube of archive_cube.py
+
+import numpy as np
+import pandas as pd
+import os, sys
+import os.path as path
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+import wind_analysis
+from archive_cube import CUBE_VARIABLES, build_cube, export_cube, fill_gaps, open_cube, open_filled_flags, unpack_filled_flags, get_vector_data
+from station_loader import SPEED_COLUMN, DIRECTION_COLUMN
+
+# Returns (filename, frame) tuples of a few stations with random hourly readings. Some hours are missing, some have a single reading,
+# and the first station reports one hour twice
+def random_frames(hours = 48, seed = 0):
+	rng = np.random.default_rng(seed)
+	times = pd.date_range('2000-12-14', periods = hours, freq = 'h', name = 'Date/Time')
+	dataframes = []
+	for filename in ['Ballenas_Island_1020590', 'Entrance_Island_102BFHH', 'Point_Atkinson_1106200', 'Sand_Heads_1107010']:
+		frame = pd.DataFrame({SPEED_COLUMN: rng.integers(0, 60, hours).astype(float),
+			DIRECTION_COLUMN: rng.integers(1, 37, hours).astype(float)}, index = times)
+		frame.loc[rng.random(hours) < 0.1, DIRECTION_COLUMN] = np.nan
+		dataframes.append((filename, frame[rng.random(hours) > 0.2]))
+	first = dataframes[0][1]
+	dataframes[0] = (dataframes[0][0], pd.concat([first.iloc[:5], first.iloc[4:5] + 1, first.iloc[5:]]))
+	return dataframes
+
+# Every hour read from the memory mapped cube gives the readings wind_analysis.create_time_frame() picks from the frames
+def test_cube_matches_the_frames(tmp_path):
+	dataframes = random_frames()
+	export_cube(dataframes, str(tmp_path / 'stations.cube'))
+	header, cube = open_cube(str(tmp_path / 'stations.cube'))
+
+	for time in pd.date_range('2000-12-13 22:00', '2000-12-16 02:00', freq = 'h').strftime('%Y-%m-%d %H:%M'):
+		from_cube = get_vector_data(header, cube, time)
+		from_frames = wind_analysis.create_time_frame(dataframes, time)
+		assert [name for name, speed, direction in from_cube] == [name for name, speed, direction in from_frames]
+		assert np.array_equal(np.array([values[1:] for values in from_cube], dtype = float).reshape(-1, 2),
+			np.array([values[1:] for values in from_frames], dtype = float).reshape(-1, 2), equal_nan = True)
+
+# Fills the gaps of at most max_gap hours one gap at a time: speeds with pandas' linear interpolation inside the readings,
+# directions stepping the short way round the compass and left empty next to a calm
+def reference_fill_gaps(data, max_gap):
+	filled = np.array(data, dtype = float)
+	speed_index, direction_index = CUBE_VARIABLES.index(SPEED_COLUMN), CUBE_VARIABLES.index(DIRECTION_COLUMN)
+	for station_index in range(data.shape[1]):
+		speeds = pd.Series(filled[:, station_index, speed_index]).interpolate(limit_area = 'inside').to_numpy()
+		for column, values in [(speed_index, speeds), (direction_index, None)]:
+			series = filled[:, station_index, column].copy()
+			readings = np.flatnonzero(~np.isnan(series))
+			for before, after in zip(readings[:-1], readings[1:]):
+				if(after - before == 1 or after - before - 1 > max_gap):
+					continue
+				if(values is not None):
+					filled[before + 1:after, station_index, column] = values[before + 1:after]
+					continue
+				start, end = series[before], series[after]
+				if(start == 0 or end == 0):
+					continue
+				change = end - start
+				if(change >= 18):
+					change -= 36
+				elif(change < -18):
+					change += 36
+				for hour in range(before + 1, after):
+					direction = (start + (hour - before) / (after - before) * change) % 36
+					filled[hour, station_index, column] = 36 if direction == 0 else direction
+	return filled
+
+# Gap filling matches the reference on gaps across north, next to calms, longer than the maximum and at the ends of a record,
+# and the flags of the exported cube mark exactly the values that were filled in
+def test_gap_filling_matches_the_reference(tmp_path):
+	dataframes = random_frames(hours = 400, seed = 2)
+	for filename, frame in dataframes:
+		frame.loc[frame.index[::7], DIRECTION_COLUMN] = 0
+		frame.loc[frame.index[::11], DIRECTION_COLUMN] = 35
+		frame.loc[frame.index[1::11], DIRECTION_COLUMN] = 2
+	dataframes = [(filename, frame[np.random.default_rng(3).random(len(frame)) > 0.4]) for filename, frame in dataframes]
+	times, stations, data = build_cube(dataframes)
+
+	for max_gap in [1, 3, 6]:
+		filled, flags = fill_gaps(data, CUBE_VARIABLES, max_gap)
+		expected = reference_fill_gaps(data, max_gap)
+		assert np.array_equal(np.isnan(filled), np.isnan(expected))
+		assert np.allclose(filled, expected, equal_nan = True, atol = 1e-4)
+		assert np.array_equal(flags, np.isnan(data) & ~np.isnan(filled))
+
+	export_cube(dataframes, str(tmp_path / 'filled.cube'), 3)
+	header, cube = open_cube(str(tmp_path / 'filled.cube'))
+	filled, flags = fill_gaps(data, CUBE_VARIABLES, 3)
+	assert np.array_equal(np.asarray(cube), filled, equal_nan = True)
+	assert np.array_equal(unpack_filled_flags(header, open_filled_flags(str(tmp_path / 'filled.cube'), header)), flags)
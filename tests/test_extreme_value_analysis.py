@@ -0,0 +1,53 @@
+# Tests of the extreme value fits of extreme_value_analysis.py
+
+import numpy as np
+import pandas as pd
+import os, sys
+import os.path as path
+import pytest
+import scipy.stats
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+import extreme_value_analysis
+
+# The L-moments of every bootstrap sample, computed at once, are those scipy computes for each sample on its own
+@pytest.mark.skipif(not hasattr(scipy.stats, 'lmoment'), reason = "scipy.stats.lmoment needs scipy 1.15")
+def test_l_moments_match_scipy():
+	rng = np.random.default_rng(0)
+	samples = scipy.stats.genpareto.rvs(0.2, scale = 10, size = (50, 40), random_state = rng)
+	l1, l2, l3 = extreme_value_analysis.sample_l_moments(samples.copy())
+	expected = np.array([scipy.stats.lmoment(sample, order = [1, 2, 3], standardize = False) for sample in samples])
+	assert np.allclose(np.column_stack((l1, l2, l3)), expected)
+
+# Fitting every bootstrap sample at once gives the fit of each sample on its own, and the return levels of the fitted parameters
+# are the quantiles of the same distributions in scipy, whose shape c is -k for the GPD and k for the GEV
+def test_fits_match_single_fits_and_scipy_quantiles():
+	rng = np.random.default_rng(1)
+	return_periods = [2, 10, 100]
+	exceedances = scipy.stats.genpareto.rvs(0.1, scale = 8, size = 60, random_state = rng)
+	samples = extreme_value_analysis.resample(exceedances, 200, rng)
+
+	k, scale = extreme_value_analysis.fit_gpd(samples.copy())
+	single = [extreme_value_analysis.fit_gpd(sample[None, :].copy()) for sample in samples]
+	assert np.allclose(k, [fit[0][0] for fit in single]) and np.allclose(scale, [fit[1][0] for fit in single])
+	levels = extreme_value_analysis.gpd_return_levels(40, k, scale, 3.5, return_periods)
+	expected = 40 + scipy.stats.genpareto.ppf(1 - 1 / (3.5 * np.array(return_periods))[None, :], -k[:, None], scale = scale[:, None])
+	assert np.allclose(levels, expected)
+
+	maxima = scipy.stats.genextreme.rvs(-0.1, loc = 60, scale = 10, size = 30, random_state = rng)
+	samples = extreme_value_analysis.resample(maxima, 200, rng)
+	k, scale, location = extreme_value_analysis.fit_gev(samples.copy())
+	single = [extreme_value_analysis.fit_gev(sample[None, :].copy()) for sample in samples]
+	assert np.allclose(np.column_stack((k, scale, location)), [[value[0] for value in fit] for fit in single])
+	levels = extreme_value_analysis.gev_return_levels(k, scale, location, return_periods)
+	expected = scipy.stats.genextreme.ppf(1 - 1 / np.array(return_periods)[None, :], k[:, None], loc = location[:, None], scale = scale[:, None])
+	assert np.allclose(levels, expected)
+
+# On long records the fits recover the parameters of the scipy distributions the values were drawn from
+def test_fits_recover_scipy_parameters():
+	rng = np.random.default_rng(2)
+	k, scale = extreme_value_analysis.fit_gpd(scipy.stats.genpareto.rvs(0.1, scale = 8, size = (1, 200000), random_state = rng))
+	assert np.allclose([-k[0], scale[0]], [0.1, 8], rtol = 0.05, atol = 0.02)
+	k, scale, location = extreme_value_analysis.fit_gev(scipy.stats.genextreme.rvs(-0.1, loc = 60, scale = 10, size = (1, 200000), random_state = rng))
+	assert np.allclose([k[0], scale[0], location[0]], [-0.1, 10, 60], rtol = 0.05, atol = 0.02)
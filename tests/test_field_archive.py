@@ -0,0 +1,59 @@
+# Tests of the wind field archive of field_archive.py
+
+import numpy as np
+import pandas as pd
+import os, sys
+import os.path as path
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+import field_archive
+import wind_analysis
+from archive_cube import export_cube
+from station_loader import SPEED_COLUMN, DIRECTION_COLUMN
+
+# Exports a cube of a few stations with random hourly readings to the processed directory
+def write_cube(directory, hours = 30, seed = 0):
+	rng = np.random.default_rng(seed)
+	times = pd.date_range('2000-12-14', periods = hours, freq = 'h', name = 'Date/Time')
+	dataframes = [(filename, pd.DataFrame({SPEED_COLUMN: rng.integers(0, 60, hours).astype(float),
+		DIRECTION_COLUMN: rng.integers(1, 37, hours).astype(float)}, index = times))
+		for filename in ['Ballenas_Island_1020590', 'Entrance_Island_102BFHH', 'Point_Atkinson_1106200']]
+	export_cube(dataframes, str(directory / 'stations.cube'))
+
+# Returns the SWAN input of the hours computed by field_archive.py and closes the archive
+def query_swan(archive, start, end):
+	try:
+		return field_archive.query_swan(archive, start, end)
+	finally:
+		field_archive.close_field_archive(archive)
+
+# Hours already in the archive are read back without opening the stations, and give the SWAN input computed the first time
+def test_archived_hours_skip_the_stations(tmp_path, monkeypatch):
+	monkeypatch.setenv('WIND_TOOLS_PROCESSED_DIR', str(tmp_path))
+	write_cube(tmp_path)
+	archive_path = str(tmp_path / 'fields.h5')
+	computed = query_swan(field_archive.open_field_archive(['stations.cube'], archive_path = archive_path), '2000-12-14 02:00', '2000-12-14 05:00')
+
+	def fail(filenames):
+		raise AssertionError("the stations were opened")
+	monkeypatch.setattr(field_archive, 'open_stations', fail)
+	archive = field_archive.open_field_archive(['stations.cube'], archive_path = archive_path)
+	assert query_swan(archive, '2000-12-14 02:00', '2000-12-14 05:00') == computed
+
+# Fields of another engine or cutoff are kept in their own group and match the interpolation of wind_analysis.py
+def test_engines_are_archived_apart(tmp_path, monkeypatch):
+	monkeypatch.setenv('WIND_TOOLS_PROCESSED_DIR', str(tmp_path))
+	write_cube(tmp_path)
+	archive_path = str(tmp_path / 'fields.h5')
+	keys = []
+	for spec in ['idw', 'idw:cutoff=20', 'kriging:model=spherical,range=60']:
+		archive = field_archive.open_field_archive(['stations.cube'], archive_path = archive_path, spec = spec)
+		keys.append(archive['group']._v_name)
+		times, lats, lons, u, v, computed = field_archive.query_fields(archive, '2000-12-14 03:00', '2000-12-14 03:00')
+		x_components, y_components, covered = wind_analysis.interpolate_wind_components(archive['weights'],
+			field_archive.get_vector_data(archive['header'], archive['cube'], '2000-12-14 03:00'))
+		field_archive.close_field_archive(archive)
+		assert computed == 1
+		assert np.allclose(u[0].reshape(-1), np.where(covered, np.round(x_components, 2), np.nan), equal_nan = True)
+	assert len(set(keys)) == 3
@@ -0,0 +1,42 @@
+# Tests of the incremental peak index of find_wind_peaks.py
+
+import numpy as np
+import pandas as pd
+import os, sys
+import os.path as path
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+import find_wind_peaks
+from station_loader import SPEED_COLUMN
+
+# Returns a station frame of hourly wind speeds with a few storms over 40 km/h
+def make_station(hours, seed = 0):
+	rng = np.random.default_rng(seed)
+	speeds = np.round(rng.gamma(2.0, 7.0, hours) * (1 + 0.8 * np.sin(np.arange(hours) * 2 * np.pi / 120)))
+	return pd.DataFrame({SPEED_COLUMN: speeds}, index = pd.date_range('2000-01-01', periods = hours, freq = 'h', name = 'Date/Time'))
+
+# Returns the peak positions of a full search over the frame
+def get_full_peaks(df):
+	return find_wind_peaks.find_wind_peaks(find_wind_peaks.get_wind_speeds(df), 40, 72)
+
+# Hours appended to a station give the same peaks as a full search
+def test_appended_hours(tmp_path, monkeypatch):
+	monkeypatch.setenv('WIND_TOOLS_PROCESSED_DIR', str(tmp_path))
+	df = make_station(3000)
+	find_wind_peaks.update_peak_index('station', df.iloc[:2000], 40, 72)
+	index = find_wind_peaks.update_peak_index('station', df, 40, 72)
+	assert np.array_equal(find_wind_peaks.get_peak_positions(index), get_full_peaks(df))
+
+# A station corrected with the same times, in its resolved or its trailing hours, is not served from the stale index
+def test_rewritten_hours(tmp_path, monkeypatch):
+	monkeypatch.setenv('WIND_TOOLS_PROCESSED_DIR', str(tmp_path))
+	df = make_station(3000)
+	index = find_wind_peaks.update_peak_index('station', df, 40, 72)
+	assert index['resolved_until'] > 100
+	for position in [index['resolved_until'] // 2, len(df) - 10]:
+		corrected = df.copy()
+		corrected.iloc[position, 0] = 120
+		index = find_wind_peaks.update_peak_index('station', corrected, 40, 72)
+		assert np.array_equal(find_wind_peaks.get_peak_positions(index), get_full_peaks(corrected))
+		assert position in find_wind_peaks.get_peak_positions(index)
@@ -0,0 +1,65 @@
+# Tests of the hindcast queue of hindcast_queue.py
+
+import numpy as np
+import pandas as pd
+import os, subprocess, sys
+import os.path as path
+import pytest
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+import hindcast_queue
+import interpolators
+import swan_hindcast
+from archive_cube import export_cube
+from station_loader import SPEED_COLUMN, DIRECTION_COLUMN
+
+# Exports a cube of a few stations with random hourly readings, some of them missing, to the processed directory
+def write_cube(directory, hours = 30, seed = 0):
+	rng = np.random.default_rng(seed)
+	times = pd.date_range('2000-12-14', periods = hours, freq = 'h', name = 'Date/Time')
+	dataframes = []
+	for filename in ['Ballenas_Island_1020590', 'Entrance_Island_102BFHH', 'Point_Atkinson_1106200']:
+		frame = pd.DataFrame({SPEED_COLUMN: rng.integers(0, 60, hours).astype(float),
+			DIRECTION_COLUMN: rng.integers(1, 37, hours).astype(float)}, index = times)
+		dataframes.append((filename, frame[rng.random(hours) > 0.2]))
+	export_cube(dataframes, str(directory / 'stations.cube'))
+
+# Runs a command of hindcast_queue.py in its own process
+def start_command(*arguments):
+	return subprocess.Popen([sys.executable, root_dir + '/utils/hindcast_queue.py'] + list(arguments), cwd = root_dir,
+		stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+
+# Workers started as separate processes on one queue give the SWAN input of a single swan_hindcast.py run
+@pytest.mark.parametrize('interpolator', [None, 'kriging:model=spherical,range=60'])
+def test_workers_match_the_hindcast(tmp_path, monkeypatch, interpolator):
+	monkeypatch.setenv('WIND_TOOLS_PROCESSED_DIR', str(tmp_path) + '/')
+	write_cube(tmp_path)
+	queue = str(tmp_path / 'queue')
+	hindcast_queue.init_queue(queue, ['stations.cube'], '2000-12-14 00:00', '2000-12-15 05:00', 4, 'none', interpolator)
+	assert hindcast_queue.read_manifest(queue)['interpolator'] == (None if interpolator is None else interpolators.get_spec_name(*interpolators.parse_spec(interpolator)))
+
+	workers = [start_command('worker', queue) for worker in range(3)]
+	for worker in workers:
+		output, errors = worker.communicate(timeout = 300)
+		assert worker.returncode == 0, errors.decode()
+	assert hindcast_queue.get_queue_status(queue, 600)['finished'] == 8
+	written = hindcast_queue.finalize_queue(queue, str(tmp_path / 'queued'), False)
+
+	expected = swan_hindcast.run_hindcast(['stations.cube'], '2000-12-14 00:00', '2000-12-15 05:00', str(tmp_path / 'single'), 30, 'none', 1, False, interpolator)
+	with open(written[0]) as queued, open(expected[0]) as single:
+		assert queued.read() == single.read()
+
+# Workers and the finalizer refuse a queue whose station files changed after init
+def test_changed_sources_are_refused(tmp_path, monkeypatch):
+	monkeypatch.setenv('WIND_TOOLS_PROCESSED_DIR', str(tmp_path) + '/')
+	write_cube(tmp_path)
+	queue = str(tmp_path / 'queue')
+	hindcast_queue.init_queue(queue, ['stations.cube'], '2000-12-14 00:00', '2000-12-14 05:00', 4, 'none')
+	write_cube(tmp_path, seed = 1)
+	os.utime(str(tmp_path / 'stations.cube'), ns = (0, 0))
+
+	with pytest.raises(ValueError, match = 'stations.cube'):
+		hindcast_queue.run_worker(queue, 600, False)
+	with pytest.raises(ValueError, match = 'stations.cube'):
+		hindcast_queue.finalize_queue(queue, str(tmp_path / 'queued'), False)
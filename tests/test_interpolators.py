@@ -0,0 +1,47 @@
+# Tests of the interpolation engines of interpolators.py
+
+import numpy as np
+import os, sys
+import os.path as path
+import pytest
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+import interpolators
+import wind_analysis
+
+# Returns random station speeds and directions with every station reporting
+def random_readings(seed = 0):
+	rng = np.random.default_rng(seed)
+	count = len(wind_analysis.station_names)
+	return rng.integers(0, 60, count).astype(float), rng.integers(1, 37, count).astype(float), np.ones(count, dtype = bool)
+
+# A station that reports only one of its readings is left out of the RBF and kriging systems, as if it had not reported at all,
+# and the mask kept for it holds only the stations that were interpolated from
+@pytest.mark.parametrize('spec', ['rbf', 'kriging:model=spherical,range=60'])
+def test_missing_components_leave_the_station_out(spec):
+	points = wind_analysis.generate_grid_coords(wind_analysis.SWAN_GRID)
+	speeds, directions, reported = random_readings()
+	directions[3] = np.nan
+	absent = reported.copy()
+	absent[3] = False
+
+	interpolator = interpolators.create_interpolator(points, spec)
+	x_components, y_components, covered = wind_analysis.interpolate_station_winds(interpolator, speeds, directions, reported)
+	assert list(interpolator['cache']) == [absent.tobytes()]
+	expected = wind_analysis.interpolate_station_winds(interpolators.create_interpolator(points, spec), speeds, directions, absent)
+	assert np.array_equal(x_components, expected[0]) and np.array_equal(y_components, expected[1]) and np.array_equal(covered, expected[2])
+	assert np.isfinite(x_components).all()
+
+	rows = np.arange(0, len(points), 7)
+	sampled = wind_analysis.interpolate_station_winds(interpolator, speeds, directions, reported, rows)
+	assert np.allclose(sampled[0], expected[0][rows]) and np.array_equal(sampled[2], expected[2][rows])
+
+# IDW still counts a station with a missing reading towards the weight sum, as the plain weights of wind_analysis.py do
+def test_idw_keeps_missing_components():
+	points = wind_analysis.generate_grid_coords(wind_analysis.SWAN_GRID)
+	speeds, directions, reported = random_readings()
+	directions[3] = np.nan
+	engine = wind_analysis.interpolate_station_winds(interpolators.create_interpolator(points, 'idw'), speeds, directions, reported)
+	plain = wind_analysis.interpolate_station_winds(wind_analysis.generate_idw_weights(points), speeds, directions, reported)
+	assert np.allclose(engine[0], plain[0]) and np.array_equal(engine[2], plain[2])
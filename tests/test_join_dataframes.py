@@ -0,0 +1,89 @@
+# Tests of the streamed N-way join of join_dataframes.py
+
+import numpy as np
+import pytest
+import pandas as pd
+import os, sys
+import os.path as path
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+import join_dataframes
+import station_loader
+from station_loader import SPEED_COLUMN, DIRECTION_COLUMN, MEASUREMENT_DTYPE, SCHEMA_ENVIRONMENT_CANADA, compact_frame, set_schema
+
+# Returns a station frame of hours starting at start with the given weather, and wind readings counting up from first
+def make_station(start, weather, first = 0):
+	times = pd.date_range(start, periods = len(weather), freq = 'h', name = 'Date/Time')
+	return pd.DataFrame({SPEED_COLUMN: np.arange(first, first + len(weather), dtype = float),
+		DIRECTION_COLUMN: np.full(len(weather), 18.0), 'Weather': weather}, index = times)
+
+# Chunks with longer strings than the first one, and chunks where no source has a column, append to the same table
+def test_save_chunks_with_different_string_widths(tmp_path):
+
+	first = make_station('2000-01-01', ['Fog'] * 48)
+	second = make_station('2000-01-03', ['Moderate Rain Showers,Fog'] * 24 + ['Rain'] * 24, first = 48)
+	# A station without the weather column covering a day of its own
+	third = make_station('2000-01-06', ['Clear'] * 24, first = 96).drop(columns = 'Weather')
+	output = str(tmp_path / 'joined.h5')
+	sources = [(filename, join_dataframes.frame_source(frame)) for filename, frame in [('first', first), ('second', second), ('third', third)]]
+	chunks = join_dataframes.iterate_joined_chunks(sources, chunk_hours = 24)
+	rows = join_dataframes.save_file(chunks, output)
+
+	expected = pd.concat([first, second, third])
+	frame = pd.read_hdf(output)
+	assert rows == len(expected) == len(frame)
+	assert frame[SPEED_COLUMN].dtype == MEASUREMENT_DTYPE
+	assert list(frame['Weather'].fillna('')) == list(expected['Weather'].fillna(''))
+	assert np.array_equal(frame[SPEED_COLUMN].to_numpy(), expected[SPEED_COLUMN].to_numpy())
+	assert np.array_equal(frame.index, expected.index)
+
+# The readings of the sources given later, or named in the priority list, win for every hour and column
+def test_priority(tmp_path):
+
+	first = make_station('2000-01-01', ['Fog'] * 10)
+	second = make_station('2000-01-01 05:00', ['Rain'] * 10, first = 100)
+	second.loc[second.index[0], SPEED_COLUMN] = np.nan
+	joined = join_dataframes.join_dataframes([('first', first), ('second', second)])
+	assert list(joined[SPEED_COLUMN]) == [0, 1, 2, 3, 4, 5] + list(range(101, 110))
+	assert list(joined['Weather']) == ['Fog'] * 5 + ['Rain'] * 10
+
+	joined = join_dataframes.join_dataframes([('first', first), ('second', second)], priority = ['first'])
+	assert list(joined[SPEED_COLUMN]) == list(range(10)) + list(range(105, 110))
+	assert list(joined['Weather']) == ['Fog'] * 10 + ['Rain'] * 5
+
+# Writes frame to the processed directory as a station file the way the Environment Canada scraper does
+def write_station(directory, filename, frame):
+	with pd.HDFStore(str(directory / filename), mode = 'w') as store:
+		store.append(filename, compact_frame(frame), min_itemsize = station_loader.STRING_MIN_ITEMSIZE)
+		set_schema(store, filename, SCHEMA_ENVIRONMENT_CANADA)
+
+# Joining station and sea level files a slice at a time gives the join of the whole frames, without going through the frame cache,
+# and the joined station file loads like any other
+def test_streamed_files(tmp_path, monkeypatch):
+
+	monkeypatch.setenv('WIND_TOOLS_PROCESSED_DIR', str(tmp_path))
+	first = make_station('2000-01-01', ['Fog'] * 200)
+	second = make_station('2000-01-05', ['Rain'] * 200, first = 1000).sample(frac = 1, random_state = 0)
+	write_station(tmp_path, 'First_1', first)
+	write_station(tmp_path, 'Second_2', second)
+	times = pd.date_range('1999-12-31 20:00', periods = 300, freq = 'h')
+	pd.DataFrame({'time': times.strftime('%Y/%m/%d %H:%M'), 'SLEV': np.arange(300) / 100, 'N/A': ''}).to_csv(tmp_path / 'Gauge.csv', header = False, index = False)
+
+	slices = []
+	read_wind_frame = join_dataframes.read_wind_frame
+	monkeypatch.setattr(join_dataframes, 'read_wind_frame', lambda *args: slices.append(args[3]) or read_wind_frame(*args))
+	station_loader.clear_cache()
+	output = str(tmp_path / 'Joined.h5')
+	with pytest.raises(SystemExit):
+		join_dataframes.main(['join_dataframes.py', 'First_1', 'Second_2', 'Gauge.csv', '--priority', 'First_1', '--output', output, '--chunk-hours', '24'])
+
+	assert station_loader.get_cache_info()['frames'] == 0
+	assert len(slices) > 2 and None not in slices
+	dataframes = station_loader.load_files(['First_1', 'Second_2', 'Gauge.csv'])
+	expected = join_dataframes.join_dataframes(dataframes, priority = ['First_1'])
+	joined = station_loader.load_files(['Joined.h5'])[0][1]
+	assert np.array_equal(joined.index, expected.index)
+	for column in [SPEED_COLUMN, DIRECTION_COLUMN]:
+		assert np.array_equal(joined[column].to_numpy(), expected[column].to_numpy(), equal_nan = True)
+	assert np.allclose(pd.read_hdf(output)['SLEV'], expected['SLEV'], equal_nan = True)
@@ -0,0 +1,53 @@
+# Tests of the compact frames the scrapers append to the station files
+
+import numpy as np
+import pytest
+import pandas as pd
+import os, sys
+import os.path as path
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+from station_loader import compact_frame, STRING_MIN_ITEMSIZE, MEASUREMENT_DTYPE
+
+# Returns a text file style frame of hours starting at start, with a flag column holding flags
+def make_chunk(start, flags, weather):
+	times = pd.date_range(start, periods = len(flags), freq = 'h', name = 'date/time')
+	return pd.DataFrame({'climate_id': '1020590', 'Data Type': ['076', '156'] * (len(flags) // 2), 'Data': np.arange(len(flags), dtype = float),
+		'Wind Spd Flag': flags, 'Weather': weather}, index = times)
+
+# Chunks whose flags and text columns hold different values append to the same table and read back unchanged
+def test_append_chunks_with_different_flags(tmp_path):
+
+	first = make_chunk('2000-01-01', ['', 'M', '', 'M'], ['Cloudy'] * 4)
+	second = make_chunk('2000-01-01 04:00', ['E', 'E', None, 'NA'], ['Rain', 'Moderate Rain Showers,Fog', 'Fog', 'Snow'])
+	filename = str(tmp_path / 'Ballenas_Island_1020590')
+	with pd.HDFStore(filename, mode = 'w') as store:
+		store.append('Ballenas_Island_1020590', compact_frame(first), min_itemsize = STRING_MIN_ITEMSIZE)
+		store.append('Ballenas_Island_1020590', compact_frame(second), min_itemsize = STRING_MIN_ITEMSIZE)
+		frame = store.select('Ballenas_Island_1020590')
+
+	expected = pd.concat([first, second])
+	assert len(frame) == 8
+	assert frame['Data'].dtype == MEASUREMENT_DTYPE
+	assert list(frame['climate_id']) == list(expected['climate_id'])
+	assert list(frame['Data Type'].astype(str)) == list(expected['Data Type'])
+	assert list(frame['Wind Spd Flag'].fillna('')) == list(expected['Wind Spd Flag'].fillna(''))
+	assert list(frame['Weather']) == list(expected['Weather'])
+	assert np.array_equal(frame['Data'].to_numpy(), expected['Data'].to_numpy())
+
+# The categoricals have the same categories whatever the values of the frame
+def test_categories_are_fixed():
+	first = compact_frame(make_chunk('2000-01-01', [''] * 2, ['Cloudy'] * 2))
+	second = compact_frame(make_chunk('2000-01-01', [''] * 4, ['Cloudy'] * 4).assign(**{'Data Type': '210'}))
+	assert list(first['Data Type'].cat.categories) == list(second['Data Type'].cat.categories)
+
+# A station the scrapers have not seen before is stored like any other, an unknown data type is named in the error
+def test_new_station(tmp_path):
+	chunk = make_chunk('2000-01-01', [''] * 2, ['Cloudy'] * 2).assign(climate_id = '1046115')
+	filename = str(tmp_path / 'New_Station_1046115')
+	with pd.HDFStore(filename, mode = 'w') as store:
+		store.append('New_Station_1046115', compact_frame(chunk), min_itemsize = STRING_MIN_ITEMSIZE)
+		assert list(store.select('New_Station_1046115')['climate_id']) == ['1046115'] * 2
+	with pytest.raises(ValueError, match = '1234'):
+		compact_frame(chunk.assign(**{'Data Type': '1234'}))
@@ -0,0 +1,62 @@
+# Tests of the chunked SWAN hindcast of swan_hindcast.py
+
+import numpy as np
+import pandas as pd
+import os, sys
+import os.path as path
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+import swan_hindcast
+import wind_analysis
+from archive_cube import export_cube, open_cube, get_vector_data
+from station_loader import SPEED_COLUMN, DIRECTION_COLUMN
+
+# Exports a cube of a few stations with random hourly readings, some of them missing, to the processed directory
+def write_cube(directory, start, hours, seed = 0):
+	rng = np.random.default_rng(seed)
+	times = pd.date_range(start, periods = hours, freq = 'h', name = 'Date/Time')
+	dataframes = []
+	for filename in ['Ballenas_Island_1020590', 'Entrance_Island_102BFHH', 'Point_Atkinson_1106200']:
+		frame = pd.DataFrame({SPEED_COLUMN: rng.integers(0, 60, hours).astype(float),
+			DIRECTION_COLUMN: rng.integers(1, 37, hours).astype(float)}, index = times)
+		dataframes.append((filename, frame[rng.random(hours) > 0.2]))
+	export_cube(dataframes, str(directory / 'stations.cube'))
+
+# Returns the text of the SWAN input wind_analysis.generate_SWAN_input() appends for every hour from start to end
+def append_every_hour(directory, start, end):
+	header, cube = open_cube(str(directory / 'stations.cube'))
+	points = wind_analysis.generate_grid_coords(wind_analysis.SWAN_GRID)
+	weights = wind_analysis.generate_idw_weights(points)
+	for time in pd.date_range(start, end, freq = 'h').strftime(swan_hindcast.TIME_FORMAT):
+		wind_analysis.generate_SWAN_input(points, get_vector_data(header, cube, time), time, weights)
+	with open('swan_input_data') as f:
+		return f.read()
+
+# The chunks formatted by worker processes and merged in time order, split by month or not, give the SWAN input of appending
+# every hour in turn. A run resumed from the checkpoint after losing a chunk gives the same output again
+def test_chunks_match_appending_every_hour(tmp_path, monkeypatch):
+	monkeypatch.setenv('WIND_TOOLS_PROCESSED_DIR', str(tmp_path) + '/')
+	monkeypatch.chdir(tmp_path)
+	write_cube(tmp_path, '2000-11-30 12:00', 30)
+	expected = append_every_hour(tmp_path, '2000-11-30 14:00', '2000-12-01 17:00')
+
+	output = str(tmp_path / 'hindcast')
+	written = swan_hindcast.run_hindcast(['stations.cube'], '2000-11-30 14:00', '2000-12-01 17:00', output, 5, 'none', 2, True)
+	with open(written[0]) as f:
+		assert f.read() == expected
+
+	chunk_paths = sorted(name for name in os.listdir(swan_hindcast.get_checkpoint_directory(output)) if name.endswith('.swan'))
+	os.remove(path.join(swan_hindcast.get_checkpoint_directory(output), chunk_paths[2]))
+	written = swan_hindcast.run_hindcast(['stations.cube'], '2000-11-30 14:00', '2000-12-01 17:00', output, 5, 'none', 2, False)
+	with open(written[0]) as f:
+		assert f.read() == expected
+	assert not path.exists(swan_hindcast.get_checkpoint_directory(output))
+
+	written = swan_hindcast.run_hindcast(['stations.cube'], '2000-11-30 14:00', '2000-12-01 17:00', output, 5, 'month', 2, False)
+	assert [path.basename(filename) for filename in written] == ['hindcast_200011', 'hindcast_200012']
+	months = []
+	for filename in written:
+		with open(filename) as f:
+			months.append(f.read())
+	assert '\n'.join(months) == expected
@@ -0,0 +1,55 @@
+# Tests of the fixed width HLY15 decoding of text_file_data_scraper.py
+
+import numpy as np
+import pandas as pd
+import os, sys
+import os.path as path
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+sys.path.insert(0, root_dir + "/data")
+from text_file_data_scraper import parse_file
+from station_loader import QUALITY_MISSING, QUALITY_ESTIMATED
+
+# A line with a valid reading, a missing one, an estimated one followed straight away by a missing one, then valid readings,
+# a short line of 3 readings, and a key given twice of which the last line counts
+LINES = [
+	'102059020000101076' + '000007 ' + '-99999M' + '000001E' + '-99999M' + '000005 ' * 20,
+	'102059020000101156' + '000036 ' + '000001 ' + '000002E',
+	'102059020000102076' + '000003 ' * 24,
+	'102059020000102076' + '000004 ' * 24,
+]
+
+# Returns the Data and Quality of every hour of a (date, data type) of the parsed readings
+def get_day(readings, date, data_type):
+	rows = readings[(readings['date/time'].dt.strftime('%Y-%m-%d') == date) & (readings['Data Type'] == data_type)]
+	assert list(rows['date/time'].dt.hour) == list(range(24))
+	return rows['Data'].to_numpy(), rows['Quality'].to_numpy()
+
+def test_parse_file(tmp_path):
+
+	filename = str(tmp_path / 'hly15.txt')
+	with open(filename, 'w') as f:
+		f.write('\n'.join(LINES) + '\n')
+	readings = parse_file(filename)
+	assert len(readings) == 3 * 24
+	assert set(readings['climate_id']) == {'1020590'}
+
+	# Every hour keeps its place, the estimated reading and the missing one after it included
+	data, quality = get_day(readings, '2000-01-01', '076')
+	assert np.array_equal(data[:5], [7, np.nan, 1, np.nan, 5], equal_nan = True)
+	assert np.all(data[4:] == 5)
+	assert list(quality[:5]) == [0, QUALITY_MISSING, QUALITY_ESTIMATED, QUALITY_MISSING, 0]
+	assert np.all(quality[4:] == 0)
+
+	# The hours after the end of a short line are missing
+	data, quality = get_day(readings, '2000-01-01', '156')
+	assert list(data[:3]) == [36, 1, 2]
+	assert list(quality[:3]) == [0, 0, QUALITY_ESTIMATED]
+	assert np.all(np.isnan(data[3:]))
+	assert np.all(quality[3:] == QUALITY_MISSING)
+
+	# The last line of a repeated key wins
+	data, quality = get_day(readings, '2000-01-02', '076')
+	assert np.all(data == 4)
+	assert np.all(quality == 0)
@@ -0,0 +1,66 @@
+# Tests of the point and track interpolation of track_interpolation.py against the interpolation of the SWAN grid
+
+import numpy as np
+import pandas as pd
+import os, sys
+import os.path as path
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+import track_interpolation
+import wind_analysis
+import interpolators
+from archive_cube import build_cube, build_cube_header, get_vector_data
+from station_loader import SPEED_COLUMN, DIRECTION_COLUMN
+
+STATIONS = ['Ballenas_Island_1020590', 'Entrance_Island_102BFHH', 'Point_Atkinson_1106200', 'Merry_Island_Lightstation_1045100']
+
+# Returns the header and cube of a few stations with random hourly readings, one of them missing a few hours
+def make_cube(hours = 48, seed = 0):
+	rng = np.random.default_rng(seed)
+	times = pd.date_range('2000-12-14', periods = hours, freq = 'h', name = 'Date/Time')
+	dataframes = []
+	for filename in STATIONS:
+		frame = pd.DataFrame({SPEED_COLUMN: rng.integers(0, 60, hours).astype(float), DIRECTION_COLUMN: rng.integers(1, 37, hours).astype(float)}, index = times)
+		dataframes.append((filename, frame))
+	dataframes[1] = (STATIONS[1], dataframes[1][1].drop(times[5:9]))
+	times, stations, cube = build_cube(dataframes)
+	return build_cube_header(times, stations), cube
+
+# Returns random samples around the stations
+def make_samples(count, seed = 1):
+	rng = np.random.default_rng(seed)
+	return rng.uniform(48.9, 49.6, count), rng.uniform(-124.4, -123.1, count)
+
+# Returns the components of the SWAN grid interpolation at the points for the readings of the cube at time
+def get_grid_components(header, cube, lats, lons, time, weights):
+	return wind_analysis.interpolate_wind_components(weights, get_vector_data(header, cube, time))
+
+# A time half way between two hours maps to the later one, whether it is given for every sample or one time per sample
+def test_time_paths_round_alike():
+	header, cube = make_cube()
+	lats, lons = make_samples(50)
+	time = pd.Timestamp('2000-12-14 00:30')
+	single = track_interpolation.interpolate_samples(header, cube, lats, lons, time)
+	per_sample = track_interpolation.interpolate_samples(header, cube, lats, lons, pd.DatetimeIndex([time] * len(lats)))
+	assert list(track_interpolation.get_hour_positions(header, [time])) == [1]
+	for single_values, sample_values in zip(single, per_sample):
+		assert np.array_equal(single_values, sample_values)
+
+	expected = get_grid_components(header, cube, lats, lons, '2000-12-14 01:00', wind_analysis.generate_idw_weights(np.column_stack((lats, lons))))
+	for values, expected_values in zip(single, expected):
+		assert np.allclose(values, expected_values)
+
+# Samples at many hours, including the hours a station is missing, get the interpolation of the SWAN grid at their nearest hour
+def test_samples_match_the_grid():
+	header, cube = make_cube()
+	lats, lons = make_samples(400)
+	rng = np.random.default_rng(2)
+	times = pd.Timestamp('2000-12-14') + pd.to_timedelta(rng.integers(0, 47 * 60, len(lats)), unit = 'min')
+	for spec in ['idw', 'kriging:model=spherical,range=60']:
+		x_components, y_components, covered = track_interpolation.interpolate_samples(header, cube, lats, lons, times, spec)
+		for index, time in enumerate(times):
+			interpolator = interpolators.create_interpolator(np.array([[lats[index], lons[index]]]), spec)
+			expected = get_grid_components(header, cube, lats[index:index + 1], lons[index:index + 1], (time + pd.Timedelta(minutes = 30)).floor('h'), interpolator)
+			assert np.allclose([x_components[index], y_components[index]], [expected[0][0], expected[1][0]])
+			assert covered[index] == expected[2][0]
@@ -0,0 +1,60 @@
+# Tests of the wind interpolation of wind_analysis.py
+
+import numpy as np
+import os, sys, math
+import os.path as path
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+import wind_analysis
+
+# Returns vector data of every known station with random readings, some stations left out and some directions missing
+def random_vector_data(seed = 0):
+	rng = np.random.default_rng(seed)
+	vector_data = []
+	for name in wind_analysis.station_names:
+		if(rng.random() < 0.2):
+			continue
+		direction = float(rng.integers(1, 37)) if rng.random() > 0.1 else float('nan')
+		vector_data.append((name.replace(' ', '_') + '_1000000', float(rng.integers(0, 60)), direction))
+	return vector_data
+
+# Interpolates the X and Y components one grid point at a time, converting the reading of every station within the cutoff.
+# Every reporting station counts towards the weight sum, a missing reading adds nothing to the weighted sums
+def interpolate_point_by_point(points, vector_data):
+	readings = dict((name, (speed, direction)) for name, speed, direction in reversed(wind_analysis.get_data_from_vector(vector_data)))
+	x_components, y_components, covered = [], [], []
+	for lat, lon in points:
+		x_sum, y_sum, weight_sum = 0.0, 0.0, 0.0
+		for index, name in enumerate(wind_analysis.station_names):
+			if(name not in readings):
+				continue
+			distance = wind_analysis.generate_distance_matrix([(lat, lon)])[0, index]
+			if(distance > 40):
+				continue
+			weight = 1 / distance**2
+			speed, direction = readings[name]
+			weight_sum += weight
+			if(not math.isnan(speed) and not math.isnan(direction)):
+				x_sum += weight * 0.539957 * speed * math.cos(math.radians(-direction * 10) - math.pi/2)
+				y_sum += weight * 0.539957 * speed * math.sin(math.radians(-direction * 10) - math.pi/2)
+		covered.append(weight_sum > 0)
+		x_components.append(x_sum / weight_sum if weight_sum > 0 else 0)
+		y_components.append(y_sum / weight_sum if weight_sum > 0 else 0)
+	return np.array(x_components), np.array(y_components), np.array(covered)
+
+# The components interpolated for the whole grid at once match the loop over the grid points
+def test_components_match_point_by_point():
+	points = wind_analysis.generate_grid_coords(wind_analysis.SWAN_GRID)[::5]
+	vector_data = random_vector_data()
+	x_components, y_components, covered = wind_analysis.interpolate_wind_components(wind_analysis.generate_idw_weights(points), vector_data)
+	expected = interpolate_point_by_point(points, vector_data)
+	assert np.array_equal(covered, expected[2])
+	assert np.allclose(x_components, expected[0]) and np.allclose(y_components, expected[1])
+
+# Two equal winds either side of north average to a wind from the north, and the speeds and directions convert back
+def test_directions_either_side_of_north():
+	x_components, y_components = wind_analysis.get_wind_components(np.array([20.0, 20.0]), np.array([35.0, 1.0]))
+	speeds, directions = wind_analysis.get_speeds_and_directions(x_components.mean(), y_components.mean())
+	assert np.isclose(np.cos(np.deg2rad(directions * 10)), 1) and speeds < 20
+	assert np.allclose(wind_analysis.get_speeds_and_directions(x_components, y_components), [[20, 20], [35, 1]])
@@ -0,0 +1,61 @@
+# Tests of the wind field query service of wind_service.py
+
+import numpy as np
+import pandas as pd
+import json, os, sys, threading
+import os.path as path
+from urllib.request import urlopen
+from urllib.error import HTTPError
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+import wind_service
+import field_archive
+from archive_cube import export_cube
+from station_loader import SPEED_COLUMN, DIRECTION_COLUMN
+
+# Exports a cube of a few stations with random hourly readings to the processed directory
+def write_cube(directory, hours = 12, seed = 0):
+	rng = np.random.default_rng(seed)
+	times = pd.date_range('2000-12-14', periods = hours, freq = 'h', name = 'Date/Time')
+	dataframes = [(filename, pd.DataFrame({SPEED_COLUMN: rng.integers(0, 60, hours).astype(float),
+		DIRECTION_COLUMN: rng.integers(1, 37, hours).astype(float)}, index = times))
+		for filename in ['Ballenas_Island_1020590', 'Entrance_Island_102BFHH', 'Point_Atkinson_1106200']]
+	export_cube(dataframes, str(directory / 'stations.cube'))
+
+# /field gives the same numbers with and without the archive
+def test_field_with_and_without_the_archive(tmp_path, monkeypatch):
+	monkeypatch.setenv('WIND_TOOLS_PROCESSED_DIR', str(tmp_path))
+	write_cube(tmp_path)
+	times = ['2000-12-14 02:00', '2000-12-14 03:00']
+	wind_service.load_state(['stations.cube'], 24)
+	computed = wind_service.query_field(times)
+	wind_service.load_state(['stations.cube'], 24, str(tmp_path / 'fields.h5'))
+	try:
+		archived = wind_service.query_field(times)
+	finally:
+		field_archive.close_field_archive(wind_service.warm_state['archive'])
+	assert computed == archived
+	assert any(value != 0 for value in computed['hours'][0]['wind_x'])
+
+# A request failing with anything other than a ValueError still gets a JSON reply
+def test_unexpected_errors_get_a_reply(tmp_path, monkeypatch):
+	monkeypatch.setenv('WIND_TOOLS_PROCESSED_DIR', str(tmp_path))
+	write_cube(tmp_path)
+	wind_service.load_state(['stations.cube'], 24)
+
+	def fail(times):
+		raise KeyError('u')
+	monkeypatch.setitem(wind_service.QUERIES, '/field', fail)
+	server = wind_service.ThreadingHTTPServer(('127.0.0.1', 0), wind_service.WindRequestHandler)
+	thread = threading.Thread(target = server.serve_forever, daemon = True)
+	thread.start()
+	try:
+		urlopen('http://127.0.0.1:%d/field?time=2000-12-14%%2002:00' % (server.server_address[1]), timeout = 10)
+		assert False, "the request did not fail"
+	except HTTPError as error:
+		assert error.code == 500
+		assert 'KeyError' in json.loads(error.read().decode('utf-8'))['error']
+	finally:
+		server.shutdown()
+		server.server_close()
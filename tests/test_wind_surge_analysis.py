@@ -0,0 +1,159 @@
+# Tests of the peak, window and correlation functions of wind_surge_analysis.py
+
+import numpy as np
+import pandas as pd
+import os, sys
+import os.path as path
+
+root_dir = path.abspath(path.join(__file__ ,"../.."))
+sys.path.insert(0, root_dir + "/utils")
+import wind_surge_analysis
+import station_loader
+from station_loader import SPEED_COLUMN, DIRECTION_COLUMN, SCHEMA_ENVIRONMENT_CANADA, compact_frame, set_schema
+
+# The threshold window search of the original script, stepping forward and backward from every index
+def baseline_indices_of_window_above_threshold(index_list, values, threshold):
+
+	windows = []
+	for index in index_list:
+		window = []
+		index2 = index
+		while values[index2] > threshold:
+			window.append(index2)
+			index2 += 1
+		index2 = index - 1
+		while values[index2] > threshold:
+			window.append(index2)
+			index2 -= 1
+		windows.append(window)
+	return windows
+
+# The window maximum of the original script, one (value, date, index) tuple per window
+def baseline_find_max_per_window(index_window_list, values, dates):
+
+	second_series_peaks = []
+	for window in index_window_list:
+		curr_values = []
+		for index in window:
+			curr_values.append((values[index], dates[index], index))
+		second_series_peaks.append(max(curr_values, key = lambda x:x[0]))
+	return second_series_peaks
+
+# The windows found from the runs above threshold hold the same samples and give the same maxima as the original loops,
+# for peaks above threshold away from the ends of the series, where the original search wraps around
+def test_windows_match_the_baseline():
+	rng = np.random.default_rng(0)
+	values = rng.random(2000) * 100
+	values[[0, -1]] = 0
+	other = rng.random(2000)
+	dates = pd.date_range('2000-01-01', periods = 2000, freq = 'h')
+	threshold = 60
+	index_list = rng.choice(np.flatnonzero(values > threshold), 300)
+
+	starts, ends = wind_surge_analysis.indices_of_window_above_threshold(index_list, values, threshold)
+	windows = baseline_indices_of_window_above_threshold(index_list, values, threshold)
+	assert [set(range(start, end)) for start, end in zip(starts, ends)] == [set(window) for window in windows]
+
+	window_max, window_dates, window_index = wind_surge_analysis.find_max_per_window(starts, ends, other, dates)
+	expected = baseline_find_max_per_window(windows, other, dates)
+	assert list(window_max) == [value for value, date, index in expected]
+	assert list(window_dates) == [date for value, date, index in expected]
+	assert list(window_index) == [index for value, date, index in expected]
+
+# Returns the peaks of series1 and the maximum of series2 within +/- window_hours of each, one peak at a time
+def naive_peak_window_maxima(series1, series2, height, distance, window_hours):
+	from scipy.signal import find_peaks
+	series1 = series1.sort_index()
+	peak_indices, _ = find_peaks(series1.fillna(0).to_numpy(dtype = float), height = height, distance = distance)
+	times, peaks, maxima = [], [], []
+	for index in peak_indices:
+		time = series1.index[index]
+		window = series2[(series2.index >= time - pd.Timedelta(hours = window_hours)) & (series2.index <= time + pd.Timedelta(hours = window_hours))].dropna()
+		if(len(window) == 0):
+			continue
+		times.append(time)
+		peaks.append(series1.iloc[index])
+		maxima.append(window.max())
+	return np.array(times, dtype = 'datetime64[ns]'), np.array(peaks), np.array(maxima)
+
+# The sparse table maxima match a loop over the peaks, with series2 on other hours than series1, unsorted and with gaps and NaNs
+def test_window_maxima_match_a_loop():
+	rng = np.random.default_rng(1)
+	series1 = pd.Series(rng.random(3000) * 80, index = pd.date_range('2000-01-01', periods = 3000, freq = 'h'))
+	times2 = pd.date_range('1999-12-31 18:30', periods = 3000, freq = 'h')[rng.random(3000) > 0.3]
+	series2 = pd.Series(rng.random(len(times2)) * 200, index = times2)
+	series2[rng.random(len(series2)) < 0.2] = np.nan
+	series2 = series2.sample(frac = 1, random_state = 0)
+
+	swept = wind_surge_analysis.sweep_peak_window_maxima(series1, series2, 50, 6, [1, 3, 12, 48])
+	for window_hours in [1, 3, 12, 48]:
+		times, peaks, maxima = wind_surge_analysis.peak_window_maxima(series1, series2, 50, 6, window_hours)
+		expected = naive_peak_window_maxima(series1, series2, 50, 6, window_hours)
+		assert np.array_equal(times.astype('datetime64[ns]'), expected[0])
+		assert np.array_equal(peaks, expected[1]) and np.array_equal(maxima, expected[2])
+		assert all(np.array_equal(swept[window_hours][index], (times, peaks, maxima)[index]) for index in range(3))
+
+# Writes a station file of random hourly wind readings and a sea level csv file of random levels to the processed directory
+def write_pair(directory, wind_filename, gauge_filename, seed):
+	rng = np.random.default_rng(seed)
+	times = pd.date_range('2000-01-01', periods = 1000, freq = 'h', name = 'Date/Time')
+	frame = pd.DataFrame({SPEED_COLUMN: rng.integers(0, 80, 1000).astype(float), DIRECTION_COLUMN: rng.integers(1, 37, 1000).astype(float)}, index = times)
+	with pd.HDFStore(str(directory / wind_filename), mode = 'w') as store:
+		store.append(wind_filename, compact_frame(frame[rng.random(1000) > 0.1]), min_itemsize = station_loader.STRING_MIN_ITEMSIZE)
+		set_schema(store, wind_filename, SCHEMA_ENVIRONMENT_CANADA)
+	gauge_times = pd.date_range('2000-01-03', periods = 1000, freq = 'h')
+	pd.DataFrame({'time': gauge_times.strftime('%Y/%m/%d %H:%M'), 'SLEV': rng.random(1000).round(3), 'N/A': ''}).to_csv(directory / gauge_filename, header = False, index = False)
+
+# The batch summary of every pair and threshold combination, computed in worker processes, matches the peaks and the fit
+# of each pair joined and correlated on its own as the interactive mode does. A pair that cannot be loaded is skipped
+def test_batch_matches_single_pairs(tmp_path, monkeypatch):
+	monkeypatch.setenv('WIND_TOOLS_PROCESSED_DIR', str(tmp_path))
+	monkeypatch.setattr(wind_surge_analysis, 'get_results_directory', lambda: str(tmp_path) + '/')
+	write_pair(tmp_path, 'First_1', 'First.csv', 0)
+	write_pair(tmp_path, 'Second_2', 'Second.csv', 1)
+
+	summary = wind_surge_analysis.run_batch(['First_1', 'Second_2'], ['First.csv', 'Second.csv', 'Missing.csv'], [30, 60], [40, 80], [1, 6],
+		'summary.csv', 2, False)
+	assert pd.read_csv(tmp_path / 'summary.csv').shape == summary.shape == (2 * 2 * 8, 12)
+	assert (summary['windows'] > 0).all() and summary['correlation'].notna().all()
+	for row in summary.itertuples():
+		df = wind_surge_analysis.join_dataframes(station_loader.load_files([row.wind_station, row.tide_gauge]))
+		results = wind_surge_analysis.correlate_windspeed_slev(df, row.wind_threshold, row.tide_threshold, row.time_frame)
+		slope, intercept, correlation = wind_surge_analysis.fit_windspeed_slev(results['window_max'], results['peak_wind_speeds'])
+		assert (row.hours, row.wind_peaks, row.surge_peaks) == (len(df), len(results['peak_wind_speeds']), len(results['peak_slevs']))
+		assert row.windows == np.count_nonzero(~np.isnan(results['window_max']))
+		assert np.allclose([row.slope, row.intercept, row.correlation], [slope, intercept, correlation], equal_nan = True)
+
+# Returns the Pearson correlation of x[t] and y[t + lag] and the number of valid pairs for every lag, one lag at a time
+def direct_cross_correlation(x, y, max_lag, min_pairs = 3):
+	correlations, pairs = [], []
+	for lag in range(-max_lag, max_lag + 1):
+		overlap = max(len(x) - abs(lag), 0)
+		a = x[max(0, -lag):max(0, -lag) + overlap]
+		b = y[max(0, lag):max(0, lag) + overlap]
+		valid = ~np.isnan(a) & ~np.isnan(b)
+		pairs.append(valid.sum())
+		if(valid.sum() < min_pairs or np.std(a[valid]) == 0 or np.std(b[valid]) == 0):
+			correlations.append(np.nan)
+		else:
+			correlations.append(np.corrcoef(a[valid], b[valid])[0, 1])
+	return np.arange(-max_lag, max_lag + 1), np.array(correlations), np.array(pairs)
+
+# The FFT cross-correlation matches the correlation of the valid pairs computed lag by lag, for series with gaps,
+# a wind series that only reports near the end and lags longer than the overlap of the readings
+def test_cross_correlation_matches_direct_lags():
+	rng = np.random.default_rng(3)
+	wind = rng.random(600) * 60
+	surge = np.roll(wind, 7) * 2 + rng.normal(0, 5, 600) + 300
+	wind[rng.random(600) < 0.2] = np.nan
+	surge[rng.random(600) < 0.3] = np.nan
+	sparse = np.full(600, np.nan)
+	sparse[-20:] = wind[-20:]
+
+	for x, y, max_lag in [(wind, surge, 72), (sparse, surge, 30), (wind[:40], surge[:40], 45)]:
+		lags, correlations, pairs = wind_surge_analysis.lagged_cross_correlation(x, y, max_lag)
+		expected = direct_cross_correlation(x, y, max_lag)
+		assert np.array_equal(lags, expected[0]) and np.array_equal(pairs, expected[2])
+		assert np.allclose(correlations, expected[1], equal_nan = True, atol = 1e-9)
+	lags, correlations, pairs = wind_surge_analysis.lagged_cross_correlation(wind, surge, 72)
+	assert lags[np.nanargmax(correlations)] == 7
@@ -0,0 +1,261 @@
+# Interpolates the wind field on an adaptively refined grid and resamples it to the regular SWAN grid.
+#
+# The field is computed on a lattice that is the SWAN grid, or a grid --fine times finer. Rather than interpolating every lattice point,
+# the points every 2**levels lattice steps are interpolated first. Each cell of that coarse grid is then split in four, interpolating
+# the new points, only when the wind components across its corners differ by more than the tolerance, a reporting station lies in it,
+# or the edge of the cutoff runs through it. The other cells are filled in bilinearly from their corners. The split cells are checked
+# the same way at the next level, down to the lattice. Open water away from the stations and from any gradient so costs a few points,
+# while the field is worked out point by point near headlands, channels and stations.
+#
+# With --fine the lattice is finer than the SWAN grid and each SWAN point takes the mean of the covered lattice points around it.
+# Any engine of interpolators.py can be used, its weights are worked out once for each set of reporting stations.
+#
+# Usage example e.g.
+#
+#   python3.6 adaptive_grid.py --start "2000-12-14 21:00" --end "2000-12-15 15:00" strait_of_georgia.cube
+#   python3.6 adaptive_grid.py --start "2000-12-14 21:00" --end "2000-12-15 15:00" --fine 4 --levels 4 --tolerance 0.5 --output swan_input_fine strait_of_georgia.cube
+
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import argparse, logging, sys
+import os.path as path
+import profiling
+import interpolators
+import wind_analysis
+from archive_cube import open_stations, get_vector_data
+
+logger = logging.getLogger(__name__)
+
+# Sets up the adaptive interpolation of the SWAN grid. The lattice is fine times finer than the grid, a power of 2, and is padded
+# past the grid so that its cells split evenly down from the coarse grid of one point every 2**levels lattice steps.
+# tolerance is the largest difference in knots of the X or Y component across a cell that is filled in without splitting it
+def create_adaptive_grid(grid = wind_analysis.SWAN_GRID, levels = 2, fine = 1, tolerance = 1.0, spec = 'idw'):
+
+	grid_lats = np.arange(grid['start_lat'], grid['end_lat'], grid['resolution'])
+	grid_lons = np.arange(grid['start_lon'], grid['end_lon'], grid['resolution'])
+	step = 2**levels
+	spacing = grid['resolution'] / fine
+	rows = -(-((len(grid_lats) - 1) * fine) // step) * step + 1
+	columns = -(-((len(grid_lons) - 1) * fine) // step) * step + 1
+	lattice_lats = grid['start_lat'] + spacing * np.arange(rows)
+	lattice_lons = grid['start_lon'] + spacing * np.arange(columns)
+
+	# Half the diagonal of a cell in kilometres at each step, largest at the southern edge
+	half_diagonals = {}
+	size = step
+	while(size > 1):
+		half_diagonals[size] = wind_analysis.great_circle_distance(lattice_lats[0], lattice_lons[0], lattice_lats[0] + size * spacing, lattice_lons[0] + size * spacing) / 2000
+		size //= 2
+	return {
+		# The interpolator is only used for its engine, the lattice points are weighed as they are needed
+		'interpolator': interpolators.create_interpolator(np.empty((0, 2)), spec),
+		'lattice_lats': lattice_lats,
+		'lattice_lons': lattice_lons,
+		'shape': (rows, columns),
+		'grid_shape': (len(grid_lats), len(grid_lons)),
+		'grid_points': [(lat, lon) for lat in grid_lats for lon in grid_lons],
+		'step': step,
+		'fine': fine,
+		'tolerance': tolerance,
+		'half_diagonals': half_diagonals,
+		'station_rows': (np.asarray(wind_analysis.lats) - grid['start_lat']) / spacing,
+		'station_columns': (np.asarray(wind_analysis.lons) - grid['start_lon']) / spacing,
+		'mask_cells': OrderedDict(),
+		'points_computed': 0,
+		'points_total': 0,
+	}
+
+# Returns a (cells x cells) mask of the cells of size step holding at least one of the reporting stations
+def get_station_cells(adaptive, reported, step, cell_shape):
+	cells = np.zeros(cell_shape, dtype = bool)
+	rows = np.floor(adaptive['station_rows'][reported] / step).astype(int)
+	columns = np.floor(adaptive['station_columns'][reported] / step).astype(int)
+	inside = (rows >= 0) & (rows < cell_shape[0]) & (columns >= 0) & (columns < cell_shape[1])
+	cells[rows[inside], columns[inside]] = True
+	return cells
+
+# Returns the (points x reporting stations) distances in kilometres from the lattice points at rows and columns
+def get_lattice_distances(adaptive, rows, columns, reported):
+	station_lats = np.asarray(wind_analysis.lats)[reported][np.newaxis, :]
+	station_lons = np.asarray(wind_analysis.lons)[reported][np.newaxis, :]
+	point_lats = adaptive['lattice_lats'][rows][:, np.newaxis]
+	point_lons = adaptive['lattice_lons'][columns][:, np.newaxis]
+	return wind_analysis.great_circle_distance(station_lats, station_lons, point_lats, point_lons) / 1000
+
+# Returns a mask of the cells of size step whose centre is within half a cell diagonal of the cutoff distance from a reporting station,
+# so the edge of the covered area may run through them
+def get_cutoff_cells(adaptive, reported, step, cell_shape):
+	interpolator = adaptive['interpolator']
+	rows, columns = np.meshgrid(np.arange(cell_shape[0]) * step + step // 2, np.arange(cell_shape[1]) * step + step // 2, indexing = 'ij')
+	distances = get_lattice_distances(adaptive, rows.reshape(-1), columns.reshape(-1), reported)
+	near_edge = np.abs(distances - interpolator['options']['cutoff']) <= adaptive['half_diagonals'][step]
+	return near_edge.any(axis = 1).reshape(cell_shape)
+
+# Returns the cells of each step that are always split for the reporting stations, those holding a station or crossed by the
+# edge of the cutoff. They only depend on which stations reported, so they are kept for each mask as the weights are
+def get_mask_cells(adaptive, reported):
+
+	key = reported.tobytes()
+	cache = adaptive['mask_cells']
+	if(key in cache):
+		cache.move_to_end(key)
+		return cache[key]
+	cells = {}
+	for step in adaptive['half_diagonals']:
+		cell_shape = ((adaptive['shape'][0] - 1) // step, (adaptive['shape'][1] - 1) // step)
+		cells[step] = get_station_cells(adaptive, reported, step, cell_shape) | get_cutoff_cells(adaptive, reported, step, cell_shape)
+	cache[key] = cells
+	if(len(cache) > interpolators.MAX_CACHED_MASKS):
+		cache.popitem(last = False)
+	return cells
+
+# Fills in the points half a step from the points of step that are not interpolated: the midpoints of the edges
+# from their ends and the centres of the cells from their corners, which repeated down to the lattice is bilinear interpolation.
+# A filled point is covered when every point it is filled from is
+def fill_midpoints(values, covered, known, step):
+
+	half = step // 2
+	lower, upper, middle, every = slice(None, -1, step), slice(step, None, step), slice(half, None, step), slice(None, None, step)
+	for targets, ends in (((middle, every), [(lower, every), (upper, every)]), ((every, middle), [(every, lower), (every, upper)]),
+		((middle, middle), [(lower, lower), (upper, lower), (lower, upper), (upper, upper)])):
+		unknown = ~known[targets]
+		np.copyto(values[targets], sum(values[end] for end in ends) / len(ends), where = unknown[:, :, np.newaxis])
+		np.copyto(covered[targets], np.logical_and.reduce([covered[end] for end in ends]), where = unknown)
+		known[targets] = True
+
+# Interpolates the X and Y components of the readings in vector_data on the adaptive lattice.
+# Returns the components in knots and the covered mask as (rows x columns) lattice arrays
+def interpolate_lattice(adaptive, vector_data):
+
+	speeds, directions, reported = wind_analysis.get_station_arrays(vector_data)
+	station_x_components, station_y_components = wind_analysis.get_wind_components(speeds[reported], directions[reported])
+	station_values, reported = interpolators.get_available_stations(adaptive['interpolator'],
+		np.column_stack((station_x_components, station_y_components)), reported)
+	cutoff = adaptive['interpolator']['options']['cutoff']
+	mask_cells = get_mask_cells(adaptive, reported)
+
+	shape = adaptive['shape']
+	values = np.zeros(shape + (2,))
+	covered = np.zeros(shape, dtype = bool)
+	known = np.zeros(shape, dtype = bool)
+
+	# Interpolates the lattice points at rows and columns that are not known yet
+	def compute(rows, columns):
+		unknown = ~known[rows, columns]
+		rows, columns = rows[unknown], columns[unknown]
+		known[rows, columns] = True
+		adaptive['points_computed'] += len(rows)
+		if(len(rows) == 0 or not reported.any()):
+			return
+		distances = get_lattice_distances(adaptive, rows, columns, reported)
+		point_covered = (distances <= cutoff).any(axis = 1)
+		weights, weight_sums = interpolators.get_point_weights(adaptive['interpolator'], reported, distances)
+		values[rows, columns] = wind_analysis.apply_station_weights(weights, weight_sums, point_covered, station_values)
+		covered[rows, columns] = point_covered
+
+	step = adaptive['step']
+	coarse_rows, coarse_columns = np.meshgrid(np.arange(0, shape[0], step), np.arange(0, shape[1], step), indexing = 'ij')
+	compute(coarse_rows.reshape(-1), coarse_columns.reshape(-1))
+	active = np.ones(((shape[0] - 1) // step, (shape[1] - 1) // step), dtype = bool)
+
+	while(step > 1):
+		corners = values[::step, ::step]
+		corner_covered = covered[::step, ::step]
+		stacked = np.stack((corners[:-1, :-1], corners[1:, :-1], corners[:-1, 1:], corners[1:, 1:]))
+		stacked_covered = np.stack((corner_covered[:-1, :-1], corner_covered[1:, :-1], corner_covered[:-1, 1:], corner_covered[1:, 1:]))
+		spread = (stacked.max(axis = 0) - stacked.min(axis = 0)).max(axis = -1)
+		mixed = stacked_covered.any(axis = 0) != stacked_covered.all(axis = 0)
+		split = active & ((spread > adaptive['tolerance']) | mixed | mask_cells[step])
+
+		# Interpolate the midpoints of the edges and the centre of every split cell, fill in the rest
+		half = step // 2
+		cell_rows, cell_columns = np.nonzero(split)
+		for row_offset, column_offset in ((half, 0), (0, half), (half, half), (step, half), (half, step)):
+			compute(cell_rows * step + row_offset, cell_columns * step + column_offset)
+		fill_midpoints(values, covered, known, step)
+
+		active = split.repeat(2, axis = 0).repeat(2, axis = 1)
+		step = half
+
+	adaptive['points_total'] += shape[0] * shape[1]
+	return values[:, :, 0], values[:, :, 1], covered
+
+# Resamples lattice arrays to the SWAN grid. Each grid point takes the mean of the covered lattice points within half a grid step,
+# and is covered when the lattice point on it is. Returns the components and mask flattened in the order of the grid points
+def resample_to_grid(adaptive, x_lattice, y_lattice, covered):
+
+	fine = adaptive['fine']
+	grid_rows, grid_columns = adaptive['grid_shape']
+	if(fine == 1):
+		x_components, y_components, grid_covered = x_lattice[:grid_rows, :grid_columns], y_lattice[:grid_rows, :grid_columns], covered[:grid_rows, :grid_columns]
+		return x_components.reshape(-1), y_components.reshape(-1), grid_covered.reshape(-1)
+
+	# Sums over windows from a summed area table of each array
+	def window_sums(array):
+		table = np.zeros((array.shape[0] + 1, array.shape[1] + 1))
+		table[1:, 1:] = array.cumsum(axis = 0).cumsum(axis = 1)
+		centre_rows, centre_columns = np.arange(grid_rows) * fine, np.arange(grid_columns) * fine
+		top = np.clip(centre_rows - fine // 2, 0, array.shape[0])[:, np.newaxis]
+		bottom = np.clip(centre_rows + fine // 2 + 1, 0, array.shape[0])[:, np.newaxis]
+		left = np.clip(centre_columns - fine // 2, 0, array.shape[1])[np.newaxis, :]
+		right = np.clip(centre_columns + fine // 2 + 1, 0, array.shape[1])[np.newaxis, :]
+		return table[bottom, right] - table[top, right] - table[bottom, left] + table[top, left]
+
+	counts = window_sums(covered.astype(float))
+	grid_covered = covered[::fine, ::fine][:grid_rows, :grid_columns]
+	with np.errstate(invalid = 'ignore', divide = 'ignore'):
+		x_components = np.where(grid_covered, window_sums(np.where(covered, x_lattice, 0)) / counts, 0)
+		y_components = np.where(grid_covered, window_sums(np.where(covered, y_lattice, 0)) / counts, 0)
+	return x_components.reshape(-1), y_components.reshape(-1), grid_covered.reshape(-1)
+
+# Interpolates the readings in vector_data adaptively and returns the X and Y components in knots and the covered mask
+# on the SWAN grid, in the order of the grid points, as wind_analysis.interpolate_wind_components() does
+def interpolate_adaptive(adaptive, vector_data):
+	return resample_to_grid(adaptive, *interpolate_lattice(adaptive, vector_data))
+
+# Writes the SWAN input of every hour between start and end inclusive to output. Returns the number of hours written
+def write_SWAN_input(adaptive, header, cube, start, end, output):
+
+	times = pd.date_range(start, end, freq = 'h').strftime('%Y-%m-%d %H:%M')
+	with open(output, 'w') as f, profiling.stage('interpolate_adaptive') as current:
+		for index, time in enumerate(times):
+			x_components, y_components, covered = interpolate_adaptive(adaptive, get_vector_data(header, cube, time))
+			if(index > 0):
+				f.write('\n')
+			f.write(wind_analysis.format_SWAN_block(adaptive['grid_points'], x_components, y_components, covered, time))
+			profiling.progress_bar(index + 1, len(times))
+		current.count(points = len(adaptive['grid_points']) * len(times), bytes_written = f.tell())
+	return len(times)
+
+# The main function handles higher level program logic
+def main(argv):
+
+	argv = profiling.setup(argv)
+	parser = argparse.ArgumentParser(description = "Write the SWAN wind input interpolated on an adaptively refined grid.")
+	parser.add_argument('filenames', nargs = '+', help = "a .cube file or processed wind station files in data/processed")
+	parser.add_argument('--start', required = True, help = "first hour, YYYY-MM-DD hh:mm")
+	parser.add_argument('--end', required = True, help = "last hour (inclusive), YYYY-MM-DD hh:mm")
+	parser.add_argument('--levels', type = int, default = 2, help = "the coarse grid has a point every 2**levels lattice steps")
+	parser.add_argument('--fine', type = int, default = 1, help = "how many times finer than the SWAN grid the lattice is, a power of 2")
+	parser.add_argument('--tolerance', type = float, default = 1.0, help = "largest difference in knots across a cell that is filled in without splitting it")
+	parser.add_argument('--interpolator', default = 'idw', help = "interpolation engine and options, see interpolators.py")
+	parser.add_argument('--output', default = None, help = "path of the SWAN file, defaults to results/swan_input_adaptive")
+	args = parser.parse_args(argv[1:])
+
+	if(args.levels < 0 or args.fine < 1 or args.fine & (args.fine - 1)):
+		parser.error("--levels must not be negative and --fine must be a power of 2")
+	try:
+		adaptive = create_adaptive_grid(wind_analysis.SWAN_GRID, args.levels, args.fine, args.tolerance, args.interpolator)
+	except ValueError as error:
+		parser.error(str(error))
+	output = path.abspath(args.output) if args.output else path.abspath(path.join(__file__ ,"../..")) + "/results/swan_input_adaptive"
+
+	header, cube = open_stations(args.filenames)
+	hours = write_SWAN_input(adaptive, header, cube, args.start, args.end, output)
+	logger.info("Interpolated %d of %d lattice points (%.1f%%) over %d hours. Wrote %s", adaptive['points_computed'], adaptive['points_total'],
+		100.0 * adaptive['points_computed'] / max(adaptive['points_total'], 1), hours, output)
+	sys.exit(0)
+
+if __name__ == "__main__":
+	main(sys.argv)
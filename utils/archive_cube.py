@@ -0,0 +1,259 @@
+# Exports the processed station archive as a memory mappable (hours x stations x variables) binary cube,
+# and opens it again with np.memmap so any hour or range of hours can be sliced without copying.
+# Several analysis processes on the same machine then share the page cache instead of each one
+# decompressing every HDF5 file into its own memory.
+#
+# File layout:
+#   8 bytes   magic string b'WINDCUBE'
+#   4 bytes   little endian length of the JSON header
+#   n bytes   JSON header (time origin, number of hours, station order, variables, dtype, data offset)
+#   padding   zero bytes up to data_offset, which is aligned to 64 bytes
+#   data      float32 values in C order with shape (hours, stations, variables), NaN where there is no reading
+#   flags     only in cubes exported with gap filling, at flags_offset: one row of bits per hour, a bit per (station, variable)
+#             in C order set where the value was filled in, packed with np.packbits and padded to whole bytes per hour
+#
+# Gap filling fills short gaps of each station along time, once over the whole archive, so that the set of stations
+# the interpolation uses does not change from hour to hour when a station misses an hour or two. Speeds are interpolated
+# linearly and directions the short way round the compass. Gaps longer than the maximum and the ends of a record are left empty.
+
+import numpy as np
+import pandas as pd
+import json, logging, struct, sys
+import profiling
+from station_loader import load_files, get_processed_directory, SPEED_COLUMN, DIRECTION_COLUMN, WIND_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+CUBE_MAGIC = b'WINDCUBE'
+CUBE_ALIGNMENT = 64
+CUBE_VARIABLES = WIND_COLUMNS
+# Longest gap in hours filled when gap filling is asked for without a length
+DEFAULT_MAX_GAP = 3
+
+# Builds the in memory cube from a list of (filename, frame) tuples as returned by the load_files functions.
+# Returns the hourly DatetimeIndex, the station order and a float32 array of shape (hours, stations, variables)
+def build_cube(dataframes):
+
+	start = min(frame.index.min() for filename, frame in dataframes).floor('h')
+	end = max(frame.index.max() for filename, frame in dataframes)
+	times = pd.date_range(start, end, freq = 'h')
+	stations = [filename for filename, frame in dataframes]
+	data = np.full((len(times), len(stations), len(CUBE_VARIABLES)), np.nan, dtype = np.float32)
+
+	for station_index, (filename, frame) in enumerate(dataframes):
+		# The first reading wins when a station reports the same hour twice
+		frame = frame[~frame.index.duplicated(keep = 'first')]
+		positions = times.get_indexer(frame.index)
+		on_the_hour = positions >= 0
+		for variable_index, variable in enumerate(CUBE_VARIABLES):
+			values = frame[variable].to_numpy(dtype = np.float32, na_value = np.nan)
+			data[positions[on_the_hour], station_index, variable_index] = values[on_the_hour]
+	return times, stations, data
+
+# Returns the header describing a cube over the hourly times and stations returned by build_cube()
+def build_cube_header(times, stations):
+	return {
+		'time_origin': times[0].isoformat(),
+		'time_step_hours': 1,
+		'hours': len(times),
+		'stations': stations,
+		'variables': CUBE_VARIABLES,
+		'dtype': '<f4',
+	}
+
+# Returns the hour positions of the previous and of the next reading of every value of series, an array of shape (hours, series).
+# The previous position is -1 before the first reading and the next one is the number of hours after the last
+def get_reading_positions(series):
+
+	hours = np.arange(len(series))[:, np.newaxis]
+	valid = ~np.isnan(series)
+	previous = np.maximum.accumulate(np.where(valid, hours, -1), axis = 0)
+	following = np.minimum.accumulate(np.where(valid, hours, len(series))[::-1], axis = 0)[::-1]
+	return previous, following
+
+# Fills the gaps of at most max_gap hours between two readings of every station in data, an array of shape (hours, stations, variables).
+# The direction is interpolated the short way round, 36 being north. A calm reading of 0 has no direction to interpolate from,
+# so direction gaps next to a calm are left empty. Returns the filled data and a boolean array of the values that were filled
+def fill_gaps(data, variables, max_gap = DEFAULT_MAX_GAP):
+
+	filled = np.array(data, dtype = np.float32)
+	flags = np.zeros(filled.shape, dtype = bool)
+	direction_index = variables.index(DIRECTION_COLUMN) if DIRECTION_COLUMN in variables else None
+	# One station at a time keeps the position arrays to the length of the record
+	for station_index in range(filled.shape[1]):
+		series = filled[:, station_index, :].astype(float)
+		previous, following = get_reading_positions(series)
+		gap = np.isnan(series) & (previous >= 0) & (following < len(series)) & (following - previous - 1 <= max_gap)
+		hours, columns = np.nonzero(gap)
+		start, end = series[previous[gap], columns], series[following[gap], columns]
+		fraction = (hours - previous[gap]) / (following[gap] - previous[gap])
+		values = start + fraction * (end - start)
+		if(direction_index is not None):
+			direction = columns == direction_index
+			change = np.mod(end[direction] - start[direction] + 18, 36) - 18
+			values[direction] = np.mod(start[direction] + fraction[direction] * change, 36)
+			values[direction] = np.where(values[direction] == 0, 36, values[direction])
+			keep = ~(direction & ((start == 0) | (end == 0)))
+			hours, columns, values = hours[keep], columns[keep], values[keep]
+		filled[hours, station_index, columns] = values
+		flags[hours, station_index, columns] = True
+	return filled, flags
+
+# Returns the (hours, bytes) packed rows of the filled flags, one row of whole bytes per hour so any hour unpacks on its own
+def pack_filled_flags(flags):
+	return np.packbits(flags.reshape(len(flags), -1), axis = 1)
+
+# Writes the cube built from the dataframes to filename, and returns the header that was written.
+# With max_gap the gaps of up to that many hours are filled in first and the filled flags are written after the data
+def export_cube(dataframes, filename, max_gap = None):
+
+	logger.info("Exporting %d stations to the archive cube %s ...", len(dataframes), filename)
+	with profiling.stage('build_cube') as current:
+		times, stations, data = build_cube(dataframes)
+		current.count(rows = len(times), points = data.size)
+	header = build_cube_header(times, stations)
+	packed_flags = None
+	if(max_gap is not None):
+		with profiling.stage('fill_gaps') as current:
+			data, flags = fill_gaps(data, CUBE_VARIABLES, max_gap)
+			packed_flags = pack_filled_flags(flags)
+			current.count(rows = len(times), points = data.size)
+		logger.info("Filled %d of %d missing values in gaps of up to %d hours", flags.sum(), flags.sum() + np.isnan(data).sum(), max_gap)
+		header['filled_max_gap'] = max_gap
+		header['flags_bytes_per_hour'] = packed_flags.shape[1]
+	# The data offset is part of the header, so size the header with placeholder offsets first
+	header['data_offset'] = 0
+	if(packed_flags is not None):
+		header['flags_offset'] = 0
+	header_length = len(json.dumps(header).encode('utf-8')) + 64
+	header['data_offset'] = -(-(len(CUBE_MAGIC) + 4 + header_length) // CUBE_ALIGNMENT) * CUBE_ALIGNMENT
+	if(packed_flags is not None):
+		data_end = header['data_offset'] + data.size * np.dtype(header['dtype']).itemsize
+		header['flags_offset'] = -(-data_end // CUBE_ALIGNMENT) * CUBE_ALIGNMENT
+	header_bytes = json.dumps(header).encode('utf-8')
+
+	with profiling.stage('write_cube') as current:
+		with open(filename, 'wb') as f:
+			f.write(CUBE_MAGIC)
+			f.write(struct.pack('<I', len(header_bytes)))
+			f.write(header_bytes)
+			f.write(b'\0' * (header['data_offset'] - f.tell()))
+			f.write(np.ascontiguousarray(data, dtype = header['dtype']).tobytes())
+			if(packed_flags is not None):
+				f.write(b'\0' * (header['flags_offset'] - f.tell()))
+				f.write(packed_flags.tobytes())
+		current.count(rows = len(times), bytes_written = profiling.file_size(filename))
+	logger.info("Done")
+	return header
+
+# Reads the JSON header of a cube file without touching the data
+def read_cube_header(filename):
+
+	with open(filename, 'rb') as f:
+		if(f.read(len(CUBE_MAGIC)) != CUBE_MAGIC):
+			raise ValueError("%s is not a wind archive cube." % (filename))
+		header_length = struct.unpack('<I', f.read(4))[0]
+		return json.loads(f.read(header_length).decode('utf-8'))
+
+# Opens a cube read only. Returns the header and a np.memmap of shape (hours, stations, variables)
+# Slicing the memmap returns views into the page cache, nothing is read until the values are used
+def open_cube(filename):
+
+	header = read_cube_header(filename)
+	shape = (header['hours'], len(header['stations']), len(header['variables']))
+	data = np.memmap(filename, dtype = header['dtype'], mode = 'r', offset = header['data_offset'], shape = shape)
+	return header, data
+
+# Returns the path of the cube in the processed directory when filenames is a single .cube file, and None when it is a list of processed station files
+def get_cube_path(filenames):
+	if(len(filenames) == 1 and filenames[0].endswith('.cube')):
+		return get_processed_directory() + filenames[0]
+	return None
+
+# Returns the cube header and data of the stations. filenames is either a single .cube file, which is memory mapped,
+# or a list of processed station files, which are loaded and built into a cube in memory
+def open_stations(filenames):
+	cube_path = get_cube_path(filenames)
+	if(cube_path is not None):
+		return open_cube(cube_path)
+	times, stations, cube = build_cube(load_files(filenames))
+	return build_cube_header(times, stations), cube
+
+# Opens the filled flags of a cube exported with gap filling read only, as a np.memmap of shape (hours, bytes per hour).
+# Returns None for a cube without gap filling
+def open_filled_flags(filename, header):
+	if('flags_offset' not in header):
+		return None
+	return np.memmap(filename, dtype = np.uint8, mode = 'r', offset = header['flags_offset'], shape = (header['hours'], header['flags_bytes_per_hour']))
+
+# Unpacks the filled flags of the hours in packed_flags[start:end] to a boolean array of shape (hours, stations, variables)
+def unpack_filled_flags(header, packed_flags, start = 0, end = None):
+	shape = (len(header['stations']), len(header['variables']))
+	rows = np.unpackbits(packed_flags[start:end], axis = 1, count = shape[0] * shape[1])
+	return rows.reshape((-1,) + shape).astype(bool)
+
+# Returns the hourly DatetimeIndex covered by the cube
+def get_cube_times(header):
+	return pd.date_range(header['time_origin'], periods = header['hours'], freq = '%dh' % header['time_step_hours'])
+
+# Converts a time (string, datetime or Timestamp) to its hour position in the cube
+def get_cube_position(header, time):
+	offset = pd.Timestamp(time) - pd.Timestamp(header['time_origin'])
+	return int(offset // pd.Timedelta(hours = header['time_step_hours']))
+
+# Returns a view of the cube between start_time and end_time inclusive, clipped to the range covered by the cube
+def slice_cube(header, data, start_time, end_time):
+	start = max(get_cube_position(header, start_time), 0)
+	end = min(get_cube_position(header, end_time) + 1, header['hours'])
+	return data[start:max(start, end)]
+
+# Returns the station readings for a single time in the same (filename, wind_speed, wind_direction) format
+# as wind_analysis.create_time_frame(). Stations without any reading for that hour are left out.
+def get_vector_data(header, data, time):
+
+	position = get_cube_position(header, time)
+	if(position < 0 or position >= header['hours']):
+		return []
+	speed_index = header['variables'].index(SPEED_COLUMN)
+	direction_index = header['variables'].index(DIRECTION_COLUMN)
+	hour = data[position]
+	vector_data = []
+	for station_index, filename in enumerate(header['stations']):
+		wind_speed = float(hour[station_index, speed_index])
+		wind_direction = float(hour[station_index, direction_index])
+		if(np.isnan(wind_speed) and np.isnan(wind_direction)):
+			continue
+		vector_data.append((filename, wind_speed, wind_direction))
+	return vector_data
+
+# Removes a --fill-gaps or --fill-gaps=<hours> argument from argv. Returns the longest gap to fill, None when the argument
+# is not given, and the remaining arguments
+def get_fill_gaps_argument(argv):
+	max_gap = None
+	remaining = []
+	for argument in argv:
+		if(argument == '--fill-gaps'):
+			max_gap = DEFAULT_MAX_GAP
+		elif(argument.startswith('--fill-gaps=')):
+			max_gap = int(argument[len('--fill-gaps='):])
+		else:
+			remaining.append(argument)
+	return max_gap, remaining
+
+# The main function handles higher level program logic
+def main(argv):
+
+	argv = profiling.setup(argv)
+	max_gap, argv = get_fill_gaps_argument(argv)
+	if(len(argv) < 3):
+		print("Please include the name of the cube to create followed by the station files to export.")
+		print("Files should contain station data in hdf5 format: Station_Name_123456 where the number is the climate or station ID.")
+		print("Add --fill-gaps or --fill-gaps=<hours> to fill gaps of up to %d hours, or of the hours given." % (DEFAULT_MAX_GAP))
+		sys.exit(0)
+	else:
+		dataframes = load_files(argv[2:])
+		export_cube(dataframes, get_processed_directory() + argv[1], max_gap)
+		sys.exit(0)
+
+if __name__ == "__main__":
+	main(sys.argv)
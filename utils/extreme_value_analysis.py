@@ -0,0 +1,197 @@
+# Extreme value analysis of the wind speed peaks found by find_wind_peaks.py, for design wind estimates.
+# Fits a generalized Pareto distribution (GPD) to the peaks over threshold and a generalized extreme value
+# distribution (GEV) to the annual maxima of the peaks, both with L-moments, and computes the return levels
+# with bootstrap confidence intervals. Every bootstrap sample of a station is resampled and fitted at once as a
+# single (samples x peaks) array instead of one fit at a time.
+#
+# Stations are analysed in parallel in a process pool. The results of each station are cached next to the station
+# file in data/processed, one JSON file per (threshold, separation) e.g. Ballenas_Island_1020590.eva_40_72.json,
+# and reused for as long as the station file is unchanged and the same return periods and bootstrap settings are asked for.
+#
+# Usage example e.g.
+#
+#   python3.6 extreme_value_analysis.py Ballenas_Island_1020590 Comox_A_1021830 Halibut_Bank_Buoy_46146
+#   python3.6 extreme_value_analysis.py --threshold 40 --separation 72 --return-periods 10 50 100 --bootstraps 2000 Sisters_Island_6813
+
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+import argparse, json, logging, os, sys
+import os.path as path
+import profiling
+from station_loader import get_processed_directory, SPEED_COLUMN
+from find_wind_peaks import load_hdf5, update_peak_index
+
+logger = logging.getLogger(__name__)
+
+HOURS_PER_YEAR = 24 * 365.25
+EULER_GAMMA = 0.5772156649015329
+# Below this absolute shape parameter the exponential (GPD) and Gumbel (GEV) limits are used
+SHAPE_TOLERANCE = 1e-6
+
+# Returns the first three sample L-moments of every row of samples, an array of shape (samples x values).
+# Each row is sorted in place, l1 is the mean, l2 the L-scale and l3 the third L-moment
+def sample_l_moments(samples):
+
+	samples.sort(axis = 1)
+	n = samples.shape[1]
+	ranks = np.arange(n, dtype = float)
+	b0 = samples.mean(axis = 1)
+	b1 = (samples * (ranks / max(n - 1, 1))).mean(axis = 1)
+	b2 = (samples * (ranks * (ranks - 1) / max((n - 1) * (n - 2), 1))).mean(axis = 1)
+	return b0, 2 * b1 - b0, 6 * b2 - 6 * b1 + b0
+
+# Fits a GPD to the exceedances over threshold in every row of samples.
+# Returns the shape k and the scale in Hosking's parameterization, where k > 0 has an upper bound
+def fit_gpd(samples):
+	l1, l2, _ = sample_l_moments(samples)
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		k = l1 / l2 - 2
+	return k, (1 + k) * l1
+
+# Returns the GPD return levels of shape (samples x return periods), for a threshold crossed rate times a year on average
+def gpd_return_levels(threshold, k, scale, rate, return_periods):
+
+	k, scale = k[:, None], scale[:, None]
+	crossings = rate * np.asarray(return_periods, dtype = float)[None, :]
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		levels = threshold + scale / k * (1 - crossings ** -k)
+	return np.where(np.abs(k) < SHAPE_TOLERANCE, threshold + scale * np.log(crossings), levels)
+
+# Fits a GEV to every row of samples with Hosking's approximation of the shape from the L-skewness.
+# Returns the shape k, the scale and the location
+def fit_gev(samples):
+
+	from scipy.special import gamma
+	l1, l2, l3 = sample_l_moments(samples)
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		c = 2 / (3 + l3 / l2) - np.log(2) / np.log(3)
+		k = 7.8590 * c + 2.9554 * c ** 2
+		scale = l2 * k / ((1 - 2 ** -k) * gamma(1 + k))
+		location = l1 - scale * (1 - gamma(1 + k)) / k
+	gumbel = np.abs(k) < SHAPE_TOLERANCE
+	scale = np.where(gumbel, l2 / np.log(2), scale)
+	location = np.where(gumbel, l1 - EULER_GAMMA * scale, location)
+	return k, scale, location
+
+# Returns the GEV return levels of shape (samples x return periods) for annual maxima
+def gev_return_levels(k, scale, location, return_periods):
+
+	k, scale, location = k[:, None], scale[:, None], location[:, None]
+	reduced = -np.log(1 - 1 / np.asarray(return_periods, dtype = float))[None, :]
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		levels = location + scale / k * (1 - reduced ** k)
+	return np.where(np.abs(k) < SHAPE_TOLERANCE, location - scale * np.log(reduced), levels)
+
+# Draws every bootstrap resample of values at once, returns an array of shape (bootstraps x values)
+def resample(values, bootstraps, rng):
+	return values[rng.integers(0, len(values), size = (bootstraps, len(values)))]
+
+# Returns the lower and upper percentile bounds over the bootstrap samples of each return level, ignoring failed fits
+def confidence_bounds(levels, confidence):
+	tail = (1 - confidence) / 2 * 100
+	with np.errstate(invalid = 'ignore'):
+		return np.nanpercentile(levels, tail, axis = 0), np.nanpercentile(levels, 100 - tail, axis = 0)
+
+# Fits both models to the peaks of one station and returns one result per model with its parameters,
+# return levels and bootstrap confidence intervals. Models with too few values to fit are left out
+def analyse_peaks(peak_values, peak_times, record_years, threshold, return_periods, bootstraps, confidence, seed):
+
+	rng = np.random.default_rng(seed)
+	results = []
+
+	exceedances = np.asarray(peak_values, dtype = float) - threshold
+	if(len(exceedances) >= 3 and record_years > 0):
+		rate = len(exceedances) / record_years
+		k, scale = fit_gpd(exceedances[None, :].copy())
+		levels = gpd_return_levels(threshold, k, scale, rate, return_periods)[0]
+		sample_k, sample_scale = fit_gpd(resample(exceedances, bootstraps, rng))
+		lower, upper = confidence_bounds(gpd_return_levels(threshold, sample_k, sample_scale, rate, return_periods), confidence)
+		results.append({'model': 'GPD', 'values': len(exceedances), 'shape': float(k[0]), 'scale': float(scale[0]),
+			'location': float(threshold), 'rate': rate, 'levels': levels.tolist(), 'lower': lower.tolist(), 'upper': upper.tolist()})
+
+	annual_maxima = pd.Series(peak_values, index = pd.DatetimeIndex(peak_times)).groupby(lambda time: time.year).max().to_numpy(dtype = float)
+	if(len(annual_maxima) >= 3):
+		k, scale, location = fit_gev(annual_maxima[None, :].copy())
+		levels = gev_return_levels(k, scale, location, return_periods)[0]
+		sample_k, sample_scale, sample_location = fit_gev(resample(annual_maxima, bootstraps, rng))
+		lower, upper = confidence_bounds(gev_return_levels(sample_k, sample_scale, sample_location, return_periods), confidence)
+		results.append({'model': 'GEV', 'values': len(annual_maxima), 'shape': float(k[0]), 'scale': float(scale[0]),
+			'location': float(location[0]), 'rate': 1.0, 'levels': levels.tolist(), 'lower': lower.tolist(), 'upper': upper.tolist()})
+	return results
+
+# Returns the path of the cached results of a station for a threshold and separation
+def get_results_cache_path(filename, threshold, separation):
+	return get_processed_directory() + "%s.eva_%g_%g.json" % (filename, threshold, separation)
+
+# Pool worker, returns the cached results of a station when the station file and settings are unchanged,
+# otherwise brings its peak index up to date, fits the models and caches the results
+def analyse_station(task):
+
+	filename, threshold, separation, return_periods, bootstraps, confidence, seed = task
+	settings = {'return_periods': return_periods, 'bootstraps': bootstraps, 'confidence': confidence, 'seed': seed,
+		'modified': os.stat(get_processed_directory() + filename).st_mtime_ns}
+	cache_path = get_results_cache_path(filename, threshold, separation)
+	if(path.isfile(cache_path)):
+		with open(cache_path) as f:
+			cached = json.load(f)
+		if(cached['settings'] == settings):
+			return filename, cached['results']
+
+	df = load_hdf5(filename)
+	index = update_peak_index(filename, df, threshold, separation)
+	peaks = index['resolved_peaks'] + index['provisional_peaks']
+	record_years = df[SPEED_COLUMN].count() / HOURS_PER_YEAR
+	results = analyse_peaks([peak[2] for peak in peaks], [peak[1] for peak in peaks], record_years,
+		threshold, return_periods, bootstraps, confidence, seed)
+
+	with open(cache_path + '.tmp', 'w') as f:
+		json.dump({'settings': settings, 'results': results}, f)
+	os.replace(cache_path + '.tmp', cache_path)
+	return filename, results
+
+# Analyses every station in a process pool and returns the summary table, one row per station, model and return period
+def analyse_stations(filenames, threshold, separation, return_periods, bootstraps, confidence, seed, processes):
+
+	logger.info("Fitting extreme value models to %d stations ...", len(filenames))
+	tasks = [(filename, threshold, separation, return_periods, bootstraps, confidence, seed) for filename in filenames]
+	rows = []
+	with profiling.stage('analyse_stations') as current, Pool(processes) as pool:
+		for index, (filename, results) in enumerate(pool.imap_unordered(analyse_station, tasks)):
+			current.count(rows = 1)
+			for result in results:
+				for period, level, lower, upper in zip(return_periods, result['levels'], result['lower'], result['upper']):
+					rows.append({'station': filename, 'model': result['model'], 'return_period': period, 'level': level,
+						'lower': lower, 'upper': upper, 'values': result['values'], 'shape': result['shape'],
+						'scale': result['scale'], 'location': result['location'], 'rate': result['rate']})
+			profiling.progress_bar(index + 1, len(tasks))
+	logger.info("Done")
+
+	columns = ['station', 'model', 'return_period', 'level', 'lower', 'upper', 'values', 'shape', 'scale', 'location', 'rate']
+	return pd.DataFrame(rows, columns = columns).sort_values(['station', 'model', 'return_period']).reset_index(drop = True)
+
+# The main function handles higher level program logic
+def main(argv):
+
+	argv = profiling.setup(argv)
+	parser = argparse.ArgumentParser(description = "Fit GPD and GEV models to the wind speed peaks of each station and compute return levels.")
+	parser.add_argument('filenames', nargs = '+', help = "processed wind station files in data/processed")
+	parser.add_argument('--threshold', type = float, default = 40, help = "peak threshold (km/h)")
+	parser.add_argument('--separation', type = float, default = 72, help = "minimum hours between peaks")
+	parser.add_argument('--return-periods', nargs = '+', type = float, default = [2, 5, 10, 25, 50, 100], help = "return periods (years)")
+	parser.add_argument('--bootstraps', type = int, default = 1000, help = "number of bootstrap samples")
+	parser.add_argument('--confidence', type = float, default = 0.95, help = "width of the confidence intervals")
+	parser.add_argument('--seed', type = int, default = 0, help = "seed of the bootstrap resampling")
+	parser.add_argument('--processes', type = int, default = None, help = "number of worker processes, defaults to the number of CPUs")
+	parser.add_argument('--output', default = 'extreme_values.csv', help = "name of the summary table written to the results folder")
+	args = parser.parse_args(argv[1:])
+
+	summary = analyse_stations(args.filenames, args.threshold, args.separation, args.return_periods,
+		args.bootstraps, args.confidence, args.seed, args.processes)
+	root_dir = path.abspath(path.join(__file__ ,"../.."))
+	summary.to_csv(root_dir + "/results/" + args.output, index = False)
+	print(summary.to_string(index = False))
+	sys.exit(0)
+
+if __name__ == "__main__":
+	main(sys.argv)
@@ -0,0 +1,233 @@
+# An archive of the interpolated wind fields, so a map, a SWAN run or a point extraction over hours that were already
+# interpolated reads the fields back instead of computing the interpolation again.
+#
+# The fields are kept in an HDF5 file (data/processed/wind_fields.h5 by default) written with PyTables, one group per
+# (grid, input data version, interpolation method). A group holds the WIND_X and WIND_Y components in knots as float32 arrays u and v
+# of shape (hours x lats x lons) over every hour of the station data, stored in compressed chunks of a day of hours by up to
+# 64 x 64 grid points, and a flag per hour telling whether it has been computed. Chunks of hours never asked for take no space.
+# Points without any station within the cutoff are NaN. The components are stored rounded to the 0.01 knot precision
+# of the SWAN input, so SWAN text written from the archive is the same as when it is computed.
+#
+# The input data version is a hash of the station files (or cube) and their modification times, so fields computed
+# from older data are never served once the data is updated. The interpolation method is the spec of the engine of interpolators.py
+# with every option spelled out, cutoff included, so fields of another engine or cutoff are kept apart.
+#
+# The stations are only loaded, and the interpolation weights only computed, when a query asks for hours that are not in the archive,
+# so requests the archive already answers cost the reads of their chunks.
+#
+# Usage example e.g.
+#
+#   python3.6 field_archive.py --start "2000-12-14 21:00" --end "2000-12-15 15:00" strait_of_georgia.cube
+#   python3.6 field_archive.py --start "2000-12-14 21:00" --end "2000-12-15 15:00" --lats 49 49.5 --lons -124 -123 --csv fields.csv Ballenas_Island_1020590 Comox_A_1021830
+#   python3.6 field_archive.py --start "2000-12-14 21:00" --end "2000-12-15 15:00" --swan swan_input_data strait_of_georgia.cube
+#   python3.6 field_archive.py --start "2000-12-14 21:00" --end "2000-12-15 15:00" --interpolator kriging:model=spherical,range=60 strait_of_georgia.cube
+
+import numpy as np
+import pandas as pd
+import tables
+import argparse, hashlib, json, logging, os, sys, threading
+import profiling
+import wind_analysis
+import interpolators
+from archive_cube import open_stations, get_vector_data, get_cube_position, get_cube_times
+from station_loader import get_processed_directory
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the layout of a group changes, older groups are not read
+FIELD_ARCHIVE_VERSION = 1
+FIELD_CHUNK_HOURS = 24
+FIELD_FILTERS = tables.Filters(complevel = 5, complib = 'zlib', shuffle = True)
+
+# Returns the latitudes and longitudes of the rows and columns of the grid
+def get_grid_axes(grid):
+	return np.arange(grid['start_lat'], grid['end_lat'], grid['resolution']), np.arange(grid['start_lon'], grid['end_lon'], grid['resolution'])
+
+# Returns the version of the input data: a hash of the names, sizes and modification times of the station files or cube
+def get_data_version(filenames):
+	sources = []
+	for filename in filenames:
+		stat = os.stat(get_processed_directory() + filename)
+		sources.append([filename, stat.st_size, stat.st_mtime_ns])
+	return hashlib.sha1(json.dumps(sources).encode('utf-8')).hexdigest()[:16]
+
+# Returns the name of the group holding the fields of a grid, input data version and interpolation method
+def get_fields_key(grid, data_version, method):
+	description = json.dumps({'grid': grid, 'data_version': data_version, 'method': method}, sort_keys = True)
+	return 'fields_' + hashlib.sha1(description.encode('utf-8')).hexdigest()[:16]
+
+# Opens the archive of the fields computed by the interpolation engine of spec, see interpolators.py.
+# filenames is either a single .cube file or a list of processed station files. The stations are only opened here when the archive
+# has no fields for them yet, as the group of the fields is sized to their hours, and otherwise by the first query that computes fields.
+# Returns the state every other function takes: the open file, the group of the fields and the hours it covers
+def open_field_archive(filenames, grid = wind_analysis.SWAN_GRID, archive_path = None, spec = 'idw'):
+
+	method = interpolators.get_spec_name(*interpolators.parse_spec(spec))
+	lats, lons = get_grid_axes(grid)
+	data_version = get_data_version(filenames)
+	key = get_fields_key(grid, data_version, method)
+	archive = {'filenames': filenames, 'spec': spec, 'header': None, 'cube': None, 'weights': None, 'grid': grid,
+		'points': wind_analysis.generate_grid_coords(grid), 'lats': lats, 'lons': lons, 'lock': threading.Lock()}
+
+	h5file = tables.open_file(archive_path or get_processed_directory() + 'wind_fields.h5', mode = 'a')
+	if('/' + key not in h5file):
+		load_archive_stations(archive)
+		create_fields_group(h5file, key, grid, data_version, method, archive['header'], len(lats), len(lons))
+	group = h5file.get_node('/' + key)
+	# The hours of the group are all a query needs to find its fields
+	span = {'time_origin': str(group._v_attrs['time_origin']), 'time_step_hours': 1, 'hours': int(group._v_attrs['hours'])}
+	return dict(archive, file = h5file, group = group, span = span)
+
+# Opens the stations of the archive and creates the interpolator of its grid, unless that was done already. Returns the archive
+def load_archive_stations(archive):
+	if(archive['cube'] is None):
+		archive['header'], archive['cube'] = open_stations(archive['filenames'])
+		archive['weights'] = interpolators.create_interpolator(archive['points'], archive['spec'])
+	return archive
+
+# Creates the group of the fields of a grid, input data version and interpolation method, covering every hour of the stations
+def create_fields_group(h5file, key, grid, data_version, method, header, lat_count, lon_count):
+
+	group = h5file.create_group('/', key)
+	for name, value in (('version', FIELD_ARCHIVE_VERSION), ('grid', json.dumps(grid)), ('data_version', data_version),
+		('method', method), ('time_origin', header['time_origin']), ('hours', header['hours'])):
+		group._v_attrs[name] = value
+	hours = max(header['hours'], 1)
+	chunkshape = (min(FIELD_CHUNK_HOURS, hours), min(lat_count, 64), min(lon_count, 64))
+	for name in ('u', 'v'):
+		h5file.create_carray(group, name, tables.Float32Atom(dflt = np.nan), shape = (hours, lat_count, lon_count),
+			filters = FIELD_FILTERS, chunkshape = chunkshape)
+	h5file.create_carray(group, 'computed', tables.BoolAtom(), shape = (hours,), filters = FIELD_FILTERS)
+	return group
+
+# Closes the archive file
+def close_field_archive(archive):
+	archive['file'].close()
+
+# Interpolates the fields of every time and returns the WIND_X and WIND_Y components as float32 arrays of shape (times x lats x lons),
+# rounded to 0.01 knots and NaN where no station is within the cutoff
+def compute_fields(archive, times):
+
+	shape = (len(times), len(archive['lats']), len(archive['lons']))
+	u, v = np.full(shape, np.nan, dtype = np.float32), np.full(shape, np.nan, dtype = np.float32)
+	for index, time in enumerate(times):
+		vector_data = get_vector_data(archive['header'], archive['cube'], time)
+		x_components, y_components, covered = wind_analysis.interpolate_wind_components(archive['weights'], vector_data)
+		u[index] = np.where(covered, np.round(x_components, 2), np.nan).reshape(shape[1:])
+		v[index] = np.where(covered, np.round(y_components, 2), np.nan).reshape(shape[1:])
+	return u, v
+
+# Returns the (start, end) of every run of consecutive positions, end exclusive
+def get_runs(positions):
+	if(len(positions) == 0):
+		return []
+	breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+	return [(int(run[0]), int(run[-1]) + 1) for run in np.split(positions, breaks)]
+
+# Computes and stores the fields of the hours between start and end (inclusive) that are not in the archive yet.
+# Returns the number of hours computed
+def fill_fields(archive, start, end):
+
+	group = archive['group']
+	hours = archive['span']['hours']
+	first = max(get_cube_position(archive['span'], start), 0)
+	last = min(get_cube_position(archive['span'], end) + 1, hours)
+	if(last <= first):
+		return 0
+	missing = np.flatnonzero(~group.computed[first:last]) + first
+	if(len(missing) == 0):
+		return 0
+	load_archive_stations(archive)
+	cube_times = get_cube_times(archive['span'])
+	with profiling.stage('compute_fields') as current:
+		for run_start, run_end in get_runs(missing):
+			u, v = compute_fields(archive, cube_times[run_start:run_end].strftime('%Y-%m-%d %H:%M'))
+			group.u[run_start:run_end] = u
+			group.v[run_start:run_end] = v
+			group.computed[run_start:run_end] = True
+			current.count(rows = run_end - run_start, points = u.size)
+	archive['file'].flush()
+	return len(missing)
+
+# Returns the index slice of the values of axis between low and high inclusive, the whole axis when bounds is None
+def get_axis_slice(axis, bounds):
+	if(bounds is None):
+		return slice(0, len(axis))
+	low, high = min(bounds), max(bounds)
+	tolerance = 1e-9
+	return slice(int(np.searchsorted(axis, low - tolerance, side = 'left')), int(np.searchsorted(axis, high + tolerance, side = 'right')))
+
+# Returns the fields of every hour between start and end inclusive, within the latitude and longitude bounds (low, high) when given.
+# Hours already in the archive are read from it, the others are computed and stored first. Hours outside the station data have no stations,
+# so they are NaN everywhere. Returns the times, the latitudes, the longitudes, u and v of shape (times x lats x lons) and the hours computed
+def query_fields(archive, start, end, lat_bounds = None, lon_bounds = None):
+
+	with archive['lock']:
+		computed = fill_fields(archive, start, end)
+		times = pd.date_range(pd.Timestamp(start), pd.Timestamp(end), freq = 'h')
+		lat_slice, lon_slice = get_axis_slice(archive['lats'], lat_bounds), get_axis_slice(archive['lons'], lon_bounds)
+		lats, lons = archive['lats'][lat_slice], archive['lons'][lon_slice]
+		u = np.full((len(times), len(lats), len(lons)), np.nan, dtype = np.float32)
+		v = np.full((len(times), len(lats), len(lons)), np.nan, dtype = np.float32)
+		# The hours are consecutive, so the part of them covered by the station data is a single slice of the archive
+		group = archive['group']
+		offset = get_cube_position(archive['span'], times[0]) if len(times) else 0
+		first, last = max(offset, 0), min(offset + len(times), archive['span']['hours'])
+		if(last > first):
+			with profiling.stage('read_fields') as current:
+				u[first - offset:last - offset] = group.u[first:last, lat_slice, lon_slice]
+				v[first - offset:last - offset] = group.v[first:last, lat_slice, lon_slice]
+				current.count(rows = last - first, points = 2 * (last - first) * len(lats) * len(lons))
+	return times, lats, lons, u, v, computed
+
+# Returns the SWAN input text of every hour between start and end inclusive on the whole grid,
+# in the same format wind_analysis.generate_SWAN_input() appends to swan_input_data
+def query_swan(archive, start, end):
+
+	times, lats, lons, u, v, computed = query_fields(archive, start, end)
+	blocks = []
+	for index, time in enumerate(times.strftime('%Y-%m-%d %H:%M')):
+		x_components, y_components = u[index].reshape(-1).astype(float), v[index].reshape(-1).astype(float)
+		covered = ~np.isnan(x_components)
+		blocks.append(wind_analysis.format_SWAN_block(archive['points'], np.nan_to_num(x_components), np.nan_to_num(y_components), covered, time))
+	return '\n'.join(blocks)
+
+# The main function handles higher level program logic
+def main(argv):
+
+	argv = profiling.setup(argv)
+	parser = argparse.ArgumentParser(description = "Compute, archive and extract interpolated wind fields.")
+	parser.add_argument('filenames', nargs = '+', help = "a .cube file or processed wind station files in data/processed")
+	parser.add_argument('--start', required = True, help = "first hour, YYYY-MM-DD hh:mm")
+	parser.add_argument('--end', required = True, help = "last hour (inclusive), YYYY-MM-DD hh:mm")
+	parser.add_argument('--lats', nargs = 2, type = float, default = None, help = "lowest and highest latitude to extract")
+	parser.add_argument('--lons', nargs = 2, type = float, default = None, help = "lowest and highest longitude to extract")
+	parser.add_argument('--archive', default = None, help = "path of the archive, defaults to data/processed/wind_fields.h5")
+	parser.add_argument('--csv', default = None, help = "write the extracted fields to this csv file, one row per hour and grid point")
+	parser.add_argument('--swan', default = None, help = "write the SWAN input of the whole grid to this file")
+	parser.add_argument('--interpolator', default = 'idw', help = "interpolation engine and options, e.g. kriging:model=spherical,range=60 (see interpolators.py)")
+	args = parser.parse_args(argv[1:])
+	try:
+		interpolators.parse_spec(args.interpolator)
+	except ValueError as error:
+		parser.error(str(error))
+
+	archive = open_field_archive(args.filenames, wind_analysis.SWAN_GRID, args.archive, args.interpolator)
+	try:
+		times, lats, lons, u, v, computed = query_fields(archive, args.start, args.end, args.lats, args.lons)
+		logger.info("%d hours of %d x %d points, %d computed and %d read from the archive", len(times), len(lats), len(lons), computed, len(times) - computed)
+		if(args.swan):
+			with open(args.swan, 'w') as f:
+				f.write(query_swan(archive, args.start, args.end))
+			logger.info("Wrote %s", args.swan)
+		if(args.csv):
+			grid_times, grid_lats, grid_lons = np.meshgrid(times, lats, lons, indexing = 'ij')
+			pd.DataFrame({'time': grid_times.ravel(), 'lat': grid_lats.ravel(), 'lon': grid_lons.ravel(),
+				'wind_x': u.ravel(), 'wind_y': v.ravel()}).to_csv(args.csv, index = False)
+			logger.info("Wrote %s", args.csv)
+	finally:
+		close_field_archive(archive)
+	sys.exit(0)
+
+if __name__ == "__main__":
+	main(sys.argv)
@@ -2,63 +2,184 @@
 # on a desired day time_frame.
 # For exclusive use by Cascadia Coast Research.
 # Written by Henri De Boever 2018/06/05
+#
+# The peaks of each station are kept in a peak index stored alongside the station file in data/processed,
+# one JSON file per (threshold, time_frame) e.g. Ballenas_Island_1020590.peaks_40_72.json.
+# It holds the peaks that can no longer change, the position up to which the history is resolved, and the provisional
+# peaks of the trailing region. When new hours are appended only the trailing region is searched again,
+# and the stored peaks are identical to a full rerun over the whole history.
+#
+# find_peaks from scipy.signal is imported by find_candidates() and matplotlib by plot_windspeed(),
+# so they are only loaded when a search or a plot actually runs.
 
 
-import matplotlib.pyplot as plt
-from scipy.signal import find_peaks
-import datetime as dt
 import numpy as np
 import pandas as pd
-import sys ,os, shutil
+import json, math, hashlib
+import sys ,os, shutil, logging
 import os.path as path
+import profiling
+from station_loader import load_wind_frame, get_processed_directory, SPEED_COLUMN
 
-# Loads an HDF5 file into memory. Looks into the weather_station_data folder for the file
-# that matches the user input. The key of the HDF5 files containing weather data is the filename
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the layout of the peak index changes, older indexes are rebuilt
+PEAK_INDEX_VERSION = 2
+
+# Loads the wind speeds of a station into memory through the shared, cached station loader.
+# The key of the HDF5 files containing weather data is the filename
 def load_hdf5(filename):
-	root_dir = path.abspath(path.join(__file__ ,"../.."))
-	relative_path = root_dir + "/data/processed/" + filename
-	return pd.read_hdf(relative_path, filename)
+	return load_wind_frame(filename, [SPEED_COLUMN])
+
+# Returns the wind speeds of a frame as a float array, NaNs are replaced with zeros otherwise find_peaks will not work
+def get_wind_speeds(df):
+	return df[SPEED_COLUMN].fillna(0).to_numpy(dtype = float)
+
+# Returns the positions of the local maxima over height, and the position of the last sample of the plateau each one sits on.
+# offset is added to both so positions found in a tail of the series refer to the whole series
+def find_candidates(values, height, offset = 0):
+	from scipy.signal import find_peaks
+	positions, properties = find_peaks(values, height = height, plateau_size = 1)
+	return positions + offset, properties['right_edges'] + offset
+
+# Keeps the highest candidates that are at least distance samples apart, the same rule as the distance option of find_peaks.
+# Equal heights are settled in favour of the earliest candidate, so a tail searched again always settles ties the same way
+def select_by_distance(positions, values, distance):
+
+	distance = math.ceil(distance)
+	keep = np.ones(len(positions), dtype = bool)
+	for candidate in np.lexsort((positions, -values[positions])):
+		if(not keep[candidate]):
+			continue
+		lo = np.searchsorted(positions, positions[candidate] - distance, side = 'right')
+		hi = np.searchsorted(positions, positions[candidate] + distance, side = 'left')
+		keep[lo:candidate] = False
+		keep[candidate + 1:hi] = False
+	return positions[keep]
+
+# Finds the peaks over height that are at least distance samples apart over the whole series
+def find_wind_peaks(values, height, distance):
+	positions, _ = find_candidates(values, height)
+	return select_by_distance(positions, values, distance)
+
+# Returns the number of candidates whose selection can no longer change when hours are appended, and the position the
+# next search has to start from. Appended hours can only create candidates from the start of the plateau the series ends on,
+# so candidates are settled up to the last gap of at least distance samples, counting that plateau start as a candidate
+def get_resolved_cut(values, positions, right_edges, distance):
+
+	changes = np.flatnonzero(np.diff(values) != 0)
+	trailing_start = changes[-1] + 1 if len(changes) else 0
+	sequence = np.append(positions, trailing_start)
+	gaps = np.flatnonzero(np.diff(sequence) >= math.ceil(distance))
+	if(len(gaps) == 0):
+		return 0, None
+	# The search restarts right after the plateau of the last settled candidate, which always starts a new plateau
+	last = gaps[-1]
+	return last + 1, int(right_edges[last]) + 1
+
+# Returns the path of the peak index of a station for a threshold and time frame
+def get_peak_index_path(filename, threshold, time_frame):
+	return get_processed_directory() + "%s.peaks_%g_%g.json" % (filename, threshold, time_frame)
+
+# Returns the peaks at positions as [position, time, wind speed] entries, so the index can be read without loading the station
+def describe_peaks(positions, values, times):
+	return [[int(position), times[position].isoformat(), float(values[position])] for position in positions]
+
+# Returns a hash of the times and wind speeds of the first hours of a station. Stored with the index for the hours it has resolved,
+# so a station file whose resolved hours were rescraped or corrected, even with the same times, is searched again from the start
+def get_history_hash(values, times, hours):
+	digest = hashlib.sha1(np.ascontiguousarray(values[:hours], dtype = float).tobytes())
+	digest.update(np.ascontiguousarray(times[:hours].as_unit('ns').asi8).tobytes())
+	return digest.hexdigest()
+
+# Returns the peak index found by searching values from position resolved_until onwards,
+# keeping the peaks already resolved before it
+def search_peak_index(values, times, threshold, time_frame, resolved_until, resolved_peaks):
+
+	start = max(resolved_until - 1, 0)
+	positions, right_edges = find_candidates(values[start:], threshold, start)
+	peaks = select_by_distance(positions, values, time_frame)
+	count, cut = get_resolved_cut(values, positions, right_edges, time_frame)
+	if(count > 0):
+		settled = peaks[peaks <= positions[count - 1]]
+		resolved_peaks = resolved_peaks + describe_peaks(settled, values, times)
+		resolved_until = cut
+		peaks = peaks[peaks > positions[count - 1]]
+	return {
+		'version': PEAK_INDEX_VERSION,
+		'threshold': threshold,
+		'time_frame': time_frame,
+		'hours': len(values),
+		'history_hash': get_history_hash(values, times, len(values)),
+		'last_time': times[-1].isoformat() if len(times) else None,
+		'resolved_until': resolved_until,
+		'resolved_hash': get_history_hash(values, times, resolved_until),
+		'resolved_peaks': resolved_peaks,
+		'provisional_peaks': describe_peaks(peaks, values, times),
+	}
+
+# Returns True when a stored index was built from the same parameters, the hours it covered are still the first hours of the station
+# and the hours it resolved still hold the same times and wind speeds, i.e. the station was only appended to since
+def is_index_current(index, values, times, threshold, time_frame):
+	if(index.get('version') != PEAK_INDEX_VERSION or index['threshold'] != threshold or index['time_frame'] != time_frame):
+		return False
+	if(index['hours'] == 0 or index['hours'] > len(times)):
+		return False
+	if(times[index['hours'] - 1].isoformat() != index['last_time']):
+		return False
+	return get_history_hash(values, times, index['resolved_until']) == index['resolved_hash']
+
+# Reads the stored peak index of a station, or None when there is none
+def read_peak_index(filename, threshold, time_frame):
+	index_path = get_peak_index_path(filename, threshold, time_frame)
+	if(not path.isfile(index_path)):
+		return None
+	with open(index_path) as f:
+		return json.load(f)
+
+# Brings the peak index of a station up to date with the frame and stores it. Only the hours after the resolved part of the
+# index are searched again, the whole history is searched when there is no index or the resolved hours of the station file were rewritten
+def update_peak_index(filename, df, threshold, time_frame):
+
+	values = get_wind_speeds(df)
+	times = df.index
+	index = read_peak_index(filename, threshold, time_frame)
+	with profiling.stage('update_peak_index') as current:
+		if(index is not None and is_index_current(index, values, times, threshold, time_frame)):
+			# Nothing was appended or changed, corrected trailing hours are searched again from the resolved part
+			if(index['hours'] == len(values) and index['history_hash'] == get_history_hash(values, times, len(values))):
+				return index
+			current.count(rows = len(values) - max(index['resolved_until'] - 1, 0))
+			index = search_peak_index(values, times, threshold, time_frame, index['resolved_until'], index['resolved_peaks'])
+		else:
+			current.count(rows = len(values))
+			index = search_peak_index(values, times, threshold, time_frame, 0, [])
+
+	index_path = get_peak_index_path(filename, threshold, time_frame)
+	with open(index_path + '.tmp', 'w') as f:
+		json.dump(index, f)
+	os.replace(index_path + '.tmp', index_path)
+	return index
+
+# Returns the positions of every peak in the index, resolved and provisional
+def get_peak_positions(index):
+	return np.array([peak[0] for peak in index['resolved_peaks'] + index['provisional_peaks']], dtype = int)
 
 # Generate a plot of windspeed over time. Threshold is the minimum windspeed that qualifies,
-# and the time_frame is the time over which the peaks are calculated. This function invokes the use of find_peaks from scipy.signal
+# and the time_frame is the time over which the peaks are calculated
 def plot_windspeed(df, filename, threshold, time_frame):
 
-	print("\nGenerating the windspeed over time plot for %s" % (filename))
-	dates = []
-	#Convert all the string objects in Date/Time index to datetime objects
-	for string in df.index:
-		string = dt.datetime.strptime(string, '%Y-%m-%d %H:%M')
-		dates.append(string)
-	df.index = dates
-	try:
-		df = df.loc[df['Data Type'] == '070']
-	except KeyError as e:
-		print(e)
+	import matplotlib.pyplot as plt
+	logger.info("Generating the windspeed over time plot for %s", filename)
 	if(len(df) == 0):
-		print("The dataframe is empty. Nothing to show here.")
+		logger.warning("The dataframe is empty. Nothing to show here.")
 		sys.exit(0)
-	try:
-		df.rename(columns = {'Data':'Wind Spd (km/h)'}, inplace = True)
-	except KeyError as e:
-		print(e)
-	#print(df)
-
-	# Replace NaNs with zeros otherwise find-peaks will not work
-	wind_speeds = df['Wind Spd (km/h)'].tolist()
-	dates = df.index.tolist()
-	for n, i in enumerate(wind_speeds):
-		if np.isnan(i):
-			wind_speeds[n] = 0
-
-	peak_indices, _  = find_peaks(wind_speeds, height = threshold, distance = time_frame)
-	peak_wind_speeds = []
-	peak_wind_dates = []
-	#print(peak_indices)
-	#print(wind_speeds)
-	for index in peak_indices:
-		# print(dates[index], wind_speeds[index], index)
-		peak_wind_speeds.append(wind_speeds[index])
-		peak_wind_dates.append(dates[index])
+
+	# The peaks come from the stored peak index, which only searches the hours added since it was last updated
+	wind_speeds = get_wind_speeds(df)
+	peak_indices = get_peak_positions(update_peak_index(filename, df, threshold, time_frame))
+	peak_wind_speeds = wind_speeds[peak_indices]
+	peak_wind_dates = df.index[peak_indices]
 	print('The number of peaks over threshold is :%s' % str(len(peak_wind_speeds)))
 	plt.scatter(peak_wind_dates, peak_wind_speeds, color = 'r')
 	plt.plot(df.index, df['Wind Spd (km/h)'])
@@ -68,8 +189,15 @@ def plot_windspeed(df, filename, threshold, time_frame):
 # The main function handles higher level program logic
 def main(argv):
 
+	argv = profiling.setup(argv)
 	if(len(argv) < 2):
 		print("Please include the filename as a program argument.\nThe file should contain station data in hdf5 format: Station_Name_123456 where the number is the climate or station ID.")
+		print("Use --update followed by station files to bring their peak indexes up to date without plotting, e.g. after a nightly scrape.")
+		sys.exit(0)
+	elif(argv[1] == '--update'):
+		for filename in argv[2:]:
+			index = update_peak_index(filename, load_hdf5(filename), 40, 72)
+			logger.info("%s: %d resolved and %d provisional peaks over %d hours", filename, len(index['resolved_peaks']), len(index['provisional_peaks']), index['hours'])
 		sys.exit(0)
 	else:
 		df = load_hdf5(argv[1])
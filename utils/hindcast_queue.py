@@ -0,0 +1,359 @@
+# Runs a SWAN hindcast over many machines sharing a filesystem (e.g. an NFS mount), for the decade long runs one machine
+# cannot finish in time. The chunks of swan_hindcast.py become jobs in a queue folder on the shared storage:
+#
+#   queue.json       the run settings, written last by init so workers never see a half made queue
+#   stations.cube    the station archive cube, memory mapped by every worker
+#   weights.npy      the IDW weights of the SWAN grid, computed once by init. Other engines of interpolators.py are set up by each worker
+#   chunks/          finished chunk files, each written under a temporary name and renamed once complete
+#   claims/          claim files chunk_<first hour>.<attempt>, created with O_CREAT | O_EXCL so only one worker gets each attempt
+#
+# A worker claims the first chunk that is neither finished nor claimed, formats it and moves on to the next one.
+# It keeps touching its claim while it works. A claim left untouched for longer than the lease belongs to a worker that died,
+# and the next worker takes the chunk over by creating the next attempt. Should the first worker still finish, both write
+# the same chunk file, so the output does not change. The finalizer concatenates the chunks in time order into the SWAN file.
+#
+# Usage example e.g.
+#
+#   python3.6 hindcast_queue.py init /shared/hindcast --start "1995-01-01 00:00" --end "2004-12-31 23:00" strait_of_georgia.cube
+#   python3.6 hindcast_queue.py init /shared/kriging --start "1995-01-01 00:00" --end "2004-12-31 23:00" --interpolator kriging strait_of_georgia.cube
+#   python3.6 hindcast_queue.py worker /shared/hindcast                   (on every node, as many times as it has cores)
+#   python3.6 hindcast_queue.py status /shared/hindcast
+#   python3.6 hindcast_queue.py finalize /shared/hindcast --wait --output /shared/swan_hindcast
+#
+#   python3.6 hindcast_queue.py local --workers 4 --start "2000-01-01 00:00" --end "2000-12-31 23:00" Ballenas_Island_1020590 Comox_A_1021830
+#
+# The local mode runs the same init, workers and finalizer as processes on this machine with a temporary folder as the queue.
+#
+# The queue records the size and modification time of every station file at init. Workers and the finalizer refuse a queue
+# whose station files changed since, as its cube and chunks no longer match them.
+
+from multiprocessing import Process
+import numpy as np
+import pandas as pd
+import argparse, json, logging, os, shutil, socket, sys, tempfile, threading, time
+import os.path as path
+import profiling
+import interpolators
+import wind_analysis
+import swan_hindcast
+from archive_cube import export_cube, get_cube_path
+from station_loader import load_files, get_processed_directory
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the layout of the queue folder or the interpolation changes, workers refuse queues of another version
+QUEUE_VERSION = 3
+
+# Returns the paths of the files and folders of a queue
+def get_queue_paths(queue_directory):
+	return {
+		'manifest': path.join(queue_directory, 'queue.json'),
+		'cube': path.join(queue_directory, 'stations.cube'),
+		'weights': path.join(queue_directory, 'weights.npy'),
+		'chunks': path.join(queue_directory, 'chunks'),
+		'claims': path.join(queue_directory, 'claims'),
+	}
+
+# Returns the [filename, size, modification time] of every station file, as field_archive.get_data_version() reads them
+def get_source_stats(filenames):
+	sources = []
+	for filename in filenames:
+		stat = os.stat(get_processed_directory() + filename)
+		sources.append([filename, stat.st_size, stat.st_mtime_ns])
+	return sources
+
+# Raises when a station file of a queue changed since init. Nodes that do not see the station files
+# only read the cube copied into the queue, so the files missing here are not checked
+def check_sources(queue_directory, settings):
+
+	changed = []
+	for filename, size, mtime in settings['sources']:
+		try:
+			stat = os.stat(get_processed_directory() + filename)
+		except FileNotFoundError:
+			continue
+		if([stat.st_size, stat.st_mtime_ns] != [size, mtime]):
+			changed.append(filename)
+	if(changed):
+		raise ValueError("The station files %s changed since the queue in %s was made, start a new queue." % (', '.join(changed), queue_directory))
+
+# Creates the queue folder for a hindcast: exports the stations to a cube in it, computes the weights and writes the settings.
+# A queue that already exists with the same settings is left as it is, so init can be run again to resume
+def init_queue(queue_directory, filenames, start, end, chunk_hours, split, interpolator = None):
+
+	paths = get_queue_paths(queue_directory)
+	settings = {'version': QUEUE_VERSION, 'start': start, 'end': end, 'chunk_hours': chunk_hours, 'split': split,
+		'interpolator': None if interpolator is None else interpolators.get_spec_name(*interpolators.parse_spec(interpolator)),
+		'sources': get_source_stats(filenames)}
+	if(path.isfile(paths['manifest'])):
+		check_sources(queue_directory, read_manifest(queue_directory))
+		if(read_manifest(queue_directory) != settings):
+			raise ValueError("The queue in %s was made with other settings." % (queue_directory))
+		logger.info("Resuming the queue in %s", queue_directory)
+		return settings
+
+	for folder in (paths['chunks'], paths['claims']):
+		os.makedirs(folder, exist_ok = True)
+	with profiling.stage('init_queue') as current:
+		if(get_cube_path(filenames) is not None):
+			shutil.copyfile(get_cube_path(filenames), paths['cube'])
+		else:
+			export_cube(load_files(filenames), paths['cube'])
+		if(interpolator is None):
+			points = wind_analysis.generate_grid_coords(wind_analysis.SWAN_GRID)
+			np.save(paths['weights'], wind_analysis.generate_idw_weights(points))
+		current.count(bytes_written = profiling.file_size(paths['cube']) + profiling.file_size(paths['weights']))
+
+	with open(paths['manifest'] + '.tmp', 'w') as f:
+		json.dump(settings, f, indent = 2)
+	os.replace(paths['manifest'] + '.tmp', paths['manifest'])
+	logger.info("Queued %d chunks in %s", len(get_queue_chunks(settings)), queue_directory)
+	return settings
+
+# Reads the settings of a queue
+def read_manifest(queue_directory):
+	with open(get_queue_paths(queue_directory)['manifest']) as f:
+		return json.load(f)
+
+# Returns the (output suffix, first hour, number of hours) of every chunk of a queue in time order
+def get_queue_chunks(settings):
+	return swan_hindcast.plan_chunks(settings['start'], settings['end'], settings['chunk_hours'], settings['split'])
+
+# Returns the name of a chunk, which names both its chunk file and its claims
+def get_chunk_name(first_hour):
+	return path.splitext(path.basename(swan_hindcast.get_chunk_path('', first_hour)))[0]
+
+# Returns the names of the finished chunks
+def get_finished_chunks(queue_directory):
+	chunks_directory = get_queue_paths(queue_directory)['chunks']
+	return set(path.splitext(name)[0] for name in os.listdir(chunks_directory) if name.endswith('.swan'))
+
+# Returns the latest claim of every claimed chunk as {chunk name: (attempt, path of the claim file)}
+def get_claims(queue_directory):
+
+	claims_directory = get_queue_paths(queue_directory)['claims']
+	claims = {}
+	for name in os.listdir(claims_directory):
+		chunk_name, _, attempt = name.rpartition('.')
+		if(not attempt.isdigit()):
+			continue
+		if(chunk_name not in claims or int(attempt) > claims[chunk_name][0]):
+			claims[chunk_name] = (int(attempt), path.join(claims_directory, name))
+	return claims
+
+# Returns True when a claim has not been touched for longer than the lease, or no longer exists
+def is_claim_expired(claim_path, lease):
+	try:
+		return time.time() - os.stat(claim_path).st_mtime > lease
+	except FileNotFoundError:
+		return True
+
+# Tries to claim a chunk by creating the claim file of its next attempt. Creating with O_EXCL fails when another worker
+# created that attempt first, so only one worker ever holds an attempt. Returns the path of the claim file, or None
+def try_claim(queue_directory, chunk_name, claims, worker_id, lease):
+
+	attempt = 1
+	if(chunk_name in claims):
+		latest_attempt, latest_path = claims[chunk_name]
+		if(not is_claim_expired(latest_path, lease)):
+			return None
+		attempt = latest_attempt + 1
+	claim_path = path.join(get_queue_paths(queue_directory)['claims'], '%s.%d' % (chunk_name, attempt))
+	try:
+		descriptor = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+	except FileExistsError:
+		return None
+	with os.fdopen(descriptor, 'w') as f:
+		json.dump({'worker': worker_id, 'claimed': time.time()}, f)
+	return claim_path
+
+# Touches a claim file every interval seconds until stopped, so the claim does not expire while the chunk is being formatted
+class ClaimHeartbeat(threading.Thread):
+
+	def __init__(self, claim_path, interval):
+		threading.Thread.__init__(self, daemon = True)
+		self.claim_path = claim_path
+		self.interval = interval
+		self.stopped = threading.Event()
+
+	def run(self):
+		while(not self.stopped.wait(self.interval)):
+			try:
+				os.utime(self.claim_path)
+			except FileNotFoundError:
+				return
+
+	def stop(self):
+		self.stopped.set()
+		self.join()
+
+# Claims and formats chunks until every chunk is finished or claimed by a live worker.
+# With wait the worker keeps polling instead, to take over the chunks of workers that die. Returns the number of chunks formatted
+def run_worker(queue_directory, lease, wait, poll_seconds = 5):
+
+	paths = get_queue_paths(queue_directory)
+	settings = read_manifest(queue_directory)
+	if(settings.get('version') != QUEUE_VERSION):
+		raise ValueError("The queue in %s has version %s, this worker reads version %d." % (queue_directory, settings.get('version'), QUEUE_VERSION))
+	check_sources(queue_directory, settings)
+	worker_id = '%s:%d' % (socket.gethostname(), os.getpid())
+	chunks = get_queue_chunks(settings)
+	# The station cube and the weights are opened once and kept for every chunk this worker formats
+	if(settings['interpolator'] is None):
+		swan_hindcast.init_worker(paths['cube'], None, np.load(paths['weights']))
+	else:
+		swan_hindcast.init_worker(paths['cube'], None, None, settings['interpolator'])
+
+	formatted = 0
+	with profiling.stage('queue_worker') as current:
+		while(True):
+			finished = get_finished_chunks(queue_directory)
+			pending = [(get_chunk_name(first_hour), first_hour, hours) for suffix, first_hour, hours in chunks if get_chunk_name(first_hour) not in finished]
+			if(not pending):
+				break
+			claims = get_claims(queue_directory)
+			for chunk_name, first_hour, hours in pending:
+				claim_path = try_claim(queue_directory, chunk_name, claims, worker_id, lease)
+				if(claim_path is not None):
+					break
+			else:
+				if(not wait):
+					break
+				time.sleep(poll_seconds)
+				continue
+
+			heartbeat = ClaimHeartbeat(claim_path, lease / 3.0)
+			heartbeat.start()
+			try:
+				chunk_path, hours = swan_hindcast.compute_chunk((swan_hindcast.get_chunk_path(paths['chunks'], first_hour), first_hour, hours))
+			finally:
+				heartbeat.stop()
+			current.count(rows = hours, bytes_written = profiling.file_size(chunk_path))
+			formatted += 1
+			logger.info("%s formatted %s (%d hours)", worker_id, chunk_name, hours)
+	return formatted
+
+# Returns the number of finished, claimed and pending chunks of a queue
+def get_queue_status(queue_directory, lease):
+
+	chunks = get_queue_chunks(read_manifest(queue_directory))
+	finished = get_finished_chunks(queue_directory)
+	claims = get_claims(queue_directory)
+	status = {'chunks': len(chunks), 'finished': 0, 'claimed': 0, 'expired': 0, 'pending': 0}
+	for suffix, first_hour, hours in chunks:
+		chunk_name = get_chunk_name(first_hour)
+		if(chunk_name in finished):
+			status['finished'] += 1
+		elif(chunk_name not in claims):
+			status['pending'] += 1
+		elif(is_claim_expired(claims[chunk_name][1], lease)):
+			status['expired'] += 1
+		else:
+			status['claimed'] += 1
+	return status
+
+# Concatenates the finished chunks into the SWAN file(s). With wait it polls until every chunk is finished,
+# otherwise it raises when some are missing. Returns the paths of the output files
+def finalize_queue(queue_directory, output, wait, poll_seconds = 5):
+
+	settings = read_manifest(queue_directory)
+	check_sources(queue_directory, settings)
+	chunks = get_queue_chunks(settings)
+	while(True):
+		missing = len(chunks) - len(get_finished_chunks(queue_directory) & set(get_chunk_name(first_hour) for suffix, first_hour, hours in chunks))
+		if(missing == 0):
+			break
+		if(not wait):
+			raise ValueError("%d of %d chunks are not finished yet." % (missing, len(chunks)))
+		time.sleep(poll_seconds)
+
+	with profiling.stage('merge_chunks') as current:
+		written = swan_hindcast.merge_chunks(output, chunks, get_queue_paths(queue_directory)['chunks'])
+		current.count(bytes_written = sum(profiling.file_size(filename) for filename in written))
+	return written
+
+# Runs the whole queue on this machine: init, a number of worker processes and the finalizer.
+# Without a queue folder a temporary folder stands in for the shared filesystem and is removed afterwards
+def run_local(filenames, start, end, chunk_hours, split, workers, lease, output, queue_directory = None, interpolator = None):
+
+	temporary = queue_directory is None
+	if(temporary):
+		queue_directory = tempfile.mkdtemp(prefix = 'wind_tools_hindcast_')
+	try:
+		init_queue(queue_directory, filenames, start, end, chunk_hours, split, interpolator)
+		processes = [Process(target = run_worker, args = (queue_directory, lease, False)) for worker in range(workers)]
+		for process in processes:
+			process.start()
+		for process in processes:
+			process.join()
+		return finalize_queue(queue_directory, output, False)
+	finally:
+		if(temporary):
+			shutil.rmtree(queue_directory, ignore_errors = True)
+
+# Returns the hour in the YYYY-MM-DD hh:mm format used by wind_analysis.py
+def format_hour(time):
+	return pd.Timestamp(time).strftime(swan_hindcast.TIME_FORMAT)
+
+# Returns the default path of the SWAN file
+def get_default_output():
+	return path.abspath(path.join(__file__ ,"../..")) + "/results/swan_hindcast"
+
+# The main function handles higher level program logic
+def main(argv):
+
+	argv = profiling.setup(argv)
+	parser = argparse.ArgumentParser(description = "Run a SWAN hindcast as a queue of chunks shared by workers on several machines.")
+	commands = parser.add_subparsers(dest = 'command')
+	init = commands.add_parser('init', help = "create the queue of a hindcast")
+	init.add_argument('queue', help = "queue folder on the shared filesystem")
+	local = commands.add_parser('local', help = "run the whole queue with worker processes on this machine")
+	for command in (init, local):
+		command.add_argument('filenames', nargs = '+', help = "a .cube file or processed wind station files in data/processed")
+		command.add_argument('--start', required = True, help = "first hour, YYYY-MM-DD hh:mm")
+		command.add_argument('--end', required = True, help = "last hour (inclusive), YYYY-MM-DD hh:mm")
+		command.add_argument('--chunk-hours', type = int, default = 24 * 7, help = "hours formatted by a worker at a time")
+		command.add_argument('--split', choices = list(swan_hindcast.SPLIT_FORMATS), default = 'none', help = "write a single file, or one file per year or month")
+		command.add_argument('--interpolator', default = None, help = "interpolation engine and options used by every worker, e.g. kriging:model=spherical,range=60 (see interpolators.py), defaults to IDW")
+	local.add_argument('--queue', default = None, help = "queue folder, a temporary folder by default")
+	local.add_argument('--workers', type = int, default = os.cpu_count(), help = "number of worker processes")
+	worker = commands.add_parser('worker', help = "claim and format chunks of a queue")
+	worker.add_argument('queue', help = "queue folder on the shared filesystem")
+	worker.add_argument('--wait', action = 'store_true', help = "keep polling for the chunks of workers that died until every chunk is finished")
+	status = commands.add_parser('status', help = "count the finished, claimed and pending chunks of a queue")
+	status.add_argument('queue', help = "queue folder on the shared filesystem")
+	finalize = commands.add_parser('finalize', help = "concatenate the finished chunks into the SWAN file")
+	finalize.add_argument('queue', help = "queue folder on the shared filesystem")
+	finalize.add_argument('--wait', action = 'store_true', help = "wait for every chunk to be finished")
+	for command in (local, worker, status):
+		command.add_argument('--lease', type = float, default = 600, help = "seconds after which the claim of a silent worker expires")
+	for command in (local, finalize):
+		command.add_argument('--output', default = None, help = "path of the SWAN file, defaults to results/swan_hindcast. With --split the period is appended")
+	args = parser.parse_args(argv[1:])
+
+	if(args.command is None):
+		parser.print_help()
+		sys.exit(0)
+	if(getattr(args, 'interpolator', None) is not None):
+		try:
+			interpolators.parse_spec(args.interpolator)
+		except ValueError as error:
+			parser.error(str(error))
+	elif(args.command == 'init'):
+		init_queue(path.abspath(args.queue), args.filenames, format_hour(args.start), format_hour(args.end), args.chunk_hours, args.split, args.interpolator)
+	elif(args.command == 'worker'):
+		logger.info("Formatted %d chunks", run_worker(path.abspath(args.queue), args.lease, args.wait))
+	elif(args.command == 'status'):
+		print(json.dumps(get_queue_status(path.abspath(args.queue), args.lease)))
+	else:
+		output = path.abspath(args.output) if args.output else get_default_output()
+		if(args.command == 'finalize'):
+			written = finalize_queue(path.abspath(args.queue), output, args.wait)
+		else:
+			written = run_local(args.filenames, format_hour(args.start), format_hour(args.end), args.chunk_hours, args.split,
+				args.workers, args.lease, output, path.abspath(args.queue) if args.queue else None, args.interpolator)
+		logger.info("Wrote %s", '\n      '.join(written))
+	sys.exit(0)
+
+if __name__ == "__main__":
+	main(sys.argv)
@@ -0,0 +1,239 @@
+# Interpolation engines for the station winds: inverse distance weighting, radial basis functions and ordinary kriging.
+#
+# Every engine is linear in the station readings, so for a given set of reporting stations the interpolated field is
+# a (points x stations) weight matrix times the readings. The matrix only depends on the geometry of the grid and of the stations
+# that reported, so it is worked out once per availability mask (solving the RBF or kriging system of the reporting stations)
+# and kept in a small cache. Every hour with the same stations reporting then costs one matrix product, as with the plain IDW weights.
+# The inverted system of each mask is kept as well, so the weights of points that change from hour to hour, as on the adaptive grid
+# of adaptive_grid.py, only cost their distances to the stations.
+#
+# An engine is chosen with a spec string, the name followed by its options, e.g.
+#
+#   idw                                  inverse distance squared, 40 km cutoff, as wind_analysis.generate_idw_weights()
+#   idw:power=3,cutoff=30
+#   rbf:function=multiquadric,epsilon=20,smoothing=0.5
+#   kriging:model=spherical,range=60,sill=1,nugget=0.1
+#
+# With every engine a point without a reporting station within cutoff kilometres is left uncovered, as with IDW.
+# The RBF and kriging weights of a point sum to 1, so for them a station only counts as reporting when every value it gives is finite,
+# and the system of the mask is solved for exactly the stations whose values are interpolated. IDW keeps counting a station with
+# a missing reading towards the weight sum, as wind_analysis.py always has.
+# Distances are in kilometres. Some stations are only tens of metres apart and report different values,
+# so the RBF smoothing and the kriging nugget default to more than 0 to keep their systems well conditioned.
+
+from collections import OrderedDict
+import numpy as np
+import wind_analysis
+
+# Masks whose weights are kept, the least recently used are dropped first
+MAX_CACHED_MASKS = 256
+
+# Options of every engine and their defaults
+ENGINE_OPTIONS = {
+	'idw': {'power': 2.0, 'cutoff': 40.0},
+	'rbf': {'function': 'linear', 'epsilon': 20.0, 'smoothing': 1.0, 'cutoff': 40.0},
+	'kriging': {'model': 'exponential', 'range': 50.0, 'sill': 1.0, 'nugget': 0.1, 'cutoff': 40.0},
+}
+
+# Radial basis functions of the distance in kilometres, signed so the interpolation matrix is conditionally positive definite
+RBF_FUNCTIONS = {
+	'linear': lambda distances, epsilon: -distances,
+	'multiquadric': lambda distances, epsilon: -np.sqrt(1 + (distances / epsilon)**2),
+	'gaussian': lambda distances, epsilon: np.exp(-(distances / epsilon)**2),
+}
+
+# Variogram models without the nugget, rising from 0 to the sill over the range
+VARIOGRAM_MODELS = {
+	'spherical': lambda distances, distance_range: np.where(distances < distance_range,
+		1.5 * distances / distance_range - 0.5 * (distances / distance_range)**3, 1),
+	'exponential': lambda distances, distance_range: 1 - np.exp(-3 * distances / distance_range),
+	'gaussian': lambda distances, distance_range: 1 - np.exp(-3 * (distances / distance_range)**2),
+}
+
+# Parses an engine spec such as 'kriging:model=spherical,range=60' into the engine name and its options, filling in the defaults
+def parse_spec(spec):
+
+	method, _, arguments = spec.partition(':')
+	if(method not in ENGINE_OPTIONS):
+		raise ValueError("Unknown interpolator %s, expected one of %s." % (method, ', '.join(ENGINE_OPTIONS)))
+	options = dict(ENGINE_OPTIONS[method])
+	for argument in filter(None, arguments.split(',')):
+		name, _, value = argument.partition('=')
+		if(name not in options):
+			raise ValueError("The %s interpolator has no option %s, expected one of %s." % (method, name, ', '.join(options)))
+		options[name] = value if isinstance(options[name], str) else float(value)
+	if(method == 'rbf' and options['function'] not in RBF_FUNCTIONS):
+		raise ValueError("Unknown radial basis function %s, expected one of %s." % (options['function'], ', '.join(RBF_FUNCTIONS)))
+	if(method == 'kriging' and options['model'] not in VARIOGRAM_MODELS):
+		raise ValueError("Unknown variogram model %s, expected one of %s." % (options['model'], ', '.join(VARIOGRAM_MODELS)))
+	return method, options
+
+# Returns the spec of an engine with every option spelled out in a fixed order, used to tell apart results of different engines
+def get_spec_name(method, options):
+	return method + ':' + ','.join('%s=%s' % (name, options[name]) for name in sorted(options))
+
+# Removes an --interpolator=<spec> or --interpolator <spec> argument from argv for the scripts that read argv directly.
+# Returns the spec, None when the argument is not given, and the remaining arguments
+def get_interpolator_argument(argv):
+
+	spec = None
+	remaining = []
+	arguments = iter(argv)
+	for argument in arguments:
+		if(argument == '--interpolator'):
+			spec = next(arguments, spec)
+		elif(argument.startswith('--interpolator=')):
+			spec = argument[len('--interpolator='):]
+		else:
+			remaining.append(argument)
+	return spec, remaining
+
+# Returns an interpolator of the globally declared stations of wind_analysis.py onto points, for the engine of spec.
+# The distances are computed here, the weights of each availability mask on first use by get_mask_weights()
+def create_interpolator(points, spec = 'idw'):
+
+	method, options = parse_spec(spec)
+	stations = np.column_stack((wind_analysis.lats, wind_analysis.lons))
+	point_distances = wind_analysis.generate_distance_matrix(points)
+	return {
+		'method': method,
+		'options': options,
+		'name': get_spec_name(method, options),
+		'point_distances': point_distances,
+		'station_distances': wind_analysis.generate_distance_matrix(stations),
+		'in_range': point_distances <= options['cutoff'],
+		'systems': OrderedDict(),
+		'cache': OrderedDict(),
+	}
+
+# IDW weights of the reporting stations from their distances to the points, the same as the columns of
+# wind_analysis.generate_idw_weights() when the power is 2. The sums are kept apart so the interpolation divides after
+# the matrix product as the plain weights do. IDW has no system to solve
+def get_idw_weights(interpolator, system, distances):
+
+	options = interpolator['options']
+	with np.errstate(divide = 'ignore'):
+		weights = np.where(distances <= options['cutoff'], 1 / distances**options['power'], 0)
+	# A point on top of a station takes its reading
+	on_station = np.isinf(weights)
+	if(on_station.any()):
+		hits = on_station.any(axis = 1)
+		weights[hits] = on_station[hits]
+	return weights, weights.sum(axis = 1)
+
+# Returns the inverse of the interpolation system of the reporting stations with a constant term,
+# which makes the weights of every point sum to 1. station_kernel is (stations x stations)
+def invert_augmented_system(station_kernel):
+
+	count = len(station_kernel)
+	system = np.ones((count + 1, count + 1))
+	system[:count, :count] = station_kernel
+	system[count, count] = 0
+	try:
+		return np.linalg.inv(system)
+	except np.linalg.LinAlgError:
+		return np.linalg.pinv(system)
+
+# Returns the (points x stations) weights of the points from their kernel values to the reporting stations and the inverted system.
+# The system is symmetric, so the weights of a point are its right hand side times the inverse
+def apply_augmented_system(system, point_kernel):
+	count = point_kernel.shape[1]
+	weights = point_kernel.dot(system[:count, :count]) + system[count, :count]
+	return weights, np.ones(len(weights))
+
+# The RBF system of the reporting stations, with the smoothing added to the diagonal of the station matrix
+def get_rbf_system(interpolator, reported):
+	options = interpolator['options']
+	station_kernel = RBF_FUNCTIONS[options['function']](interpolator['station_distances'][np.ix_(reported, reported)], options['epsilon'])
+	return invert_augmented_system(station_kernel + options['smoothing'] * np.eye(len(station_kernel)))
+
+# RBF weights of the reporting stations from their distances to the points
+def get_rbf_weights(interpolator, system, distances):
+	options = interpolator['options']
+	return apply_augmented_system(system, RBF_FUNCTIONS[options['function']](distances, options['epsilon']))
+
+# The semivariance of two places distances apart: the nugget plus the model scaled to the rest of the sill, and 0 at a station itself
+def get_semivariance(interpolator, distances):
+	options = interpolator['options']
+	model = VARIOGRAM_MODELS[options['model']]
+	return np.where(distances > 0, options['nugget'] + (options['sill'] - options['nugget']) * model(distances, options['range']), 0)
+
+# The ordinary kriging system of the reporting stations
+def get_kriging_system(interpolator, reported):
+	return invert_augmented_system(-get_semivariance(interpolator, interpolator['station_distances'][np.ix_(reported, reported)]))
+
+# Ordinary kriging weights of the reporting stations from their distances to the points
+def get_kriging_weights(interpolator, system, distances):
+	return apply_augmented_system(system, -get_semivariance(interpolator, distances))
+
+# The function building the system of the reporting stations of each engine, and the function weighing them for a set of points
+ENGINES = {
+	'idw': (lambda interpolator, reported: None, get_idw_weights),
+	'rbf': (get_rbf_system, get_rbf_weights),
+	'kriging': (get_kriging_system, get_kriging_weights),
+}
+
+# Returns the weights of the reporting stations for points at distances (points x reporting stations) from them and their sums.
+# The system of the reporting stations is solved on the first call with this mask and kept for the following ones,
+# so the weights of any points, e.g. the points of an adaptive grid, only cost their kernel values and a matrix product
+def get_point_weights(interpolator, reported, distances):
+
+	key = reported.tobytes()
+	systems = interpolator['systems']
+	if(key in systems):
+		systems.move_to_end(key)
+	else:
+		systems[key] = ENGINES[interpolator['method']][0](interpolator, reported)
+		if(len(systems) > MAX_CACHED_MASKS):
+			systems.popitem(last = False)
+	return ENGINES[interpolator['method']][1](interpolator, systems[key], distances)
+
+# Returns the station values and the mask of the stations the engine interpolates from, given the values of the stations in reported.
+# For RBF and kriging the stations with a missing value are dropped from the mask, for IDW both are returned as they are
+def get_available_stations(interpolator, station_values, reported):
+
+	if(interpolator['method'] == 'idw'):
+		return station_values, reported
+	station_values = np.asarray(station_values)
+	finite = np.isfinite(station_values).all(axis = tuple(range(1, station_values.ndim)))
+	if(finite.all()):
+		return station_values, reported
+	available = reported.copy()
+	available[np.flatnonzero(reported)[~finite]] = False
+	return station_values[finite], available
+
+# Returns the weights of the reporting stations for every point of the interpolator, their sums and a mask of the points
+# with a reporting station within the cutoff, computing them on the first hour with this mask
+def get_mask_weights(interpolator, reported):
+
+	key = reported.tobytes()
+	cache = interpolator['cache']
+	if(key in cache):
+		cache.move_to_end(key)
+		return cache[key]
+	covered = interpolator['in_range'][:, reported].any(axis = 1)
+	if(reported.any()):
+		weights, weight_sums = get_point_weights(interpolator, reported, interpolator['point_distances'][:, reported])
+	else:
+		weights, weight_sums = np.zeros((len(covered), 0)), np.zeros(len(covered))
+	cache[key] = (weights, weight_sums, covered)
+	if(len(cache) > MAX_CACHED_MASKS):
+		cache.popitem(last = False)
+	return cache[key]
+
+# Interpolates station_values, an array of one or more values per reporting station, onto the points of the interpolator.
+# Missing values add nothing to the IDW sums and leave their station out of the others, see get_available_stations().
+# Points without a reporting station within the cutoff get 0.
+# With rows only those points are interpolated, their weights worked out from the kept system of the mask rather than cached
+def interpolate(interpolator, station_values, reported, rows = None):
+
+	station_values, reported = get_available_stations(interpolator, station_values, reported)
+	if(rows is None):
+		weights, weight_sums, covered = get_mask_weights(interpolator, reported)
+	else:
+		covered = interpolator['in_range'][np.ix_(rows, reported)].any(axis = 1)
+		if(reported.any()):
+			weights, weight_sums = get_point_weights(interpolator, reported, interpolator['point_distances'][np.ix_(rows, reported)])
+		else:
+			weights, weight_sums = np.zeros((len(covered), 0)), np.zeros(len(covered))
+	return wind_analysis.apply_station_weights(weights, weight_sums, covered, station_values), covered
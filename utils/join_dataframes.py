@@ -1,120 +1,216 @@
 # This script attempts to do an inner join on dataframes
 # Written by Henri De Boever 2018/06/07
+#
+# Joins any number of station frames into a single record in time order. For every hour and column the reading of the first
+# source in priority order that has one is kept, by default the files given later win over the ones given earlier.
+# The sources are merged chunk_hours at a time, each keeping a cursor into its sorted times. Only the index column of every
+# station file is read up front, the readings are read a slice of hours at a time straight from the files, bypassing the frame cache,
+# and every chunk is written to the output as soon as it is joined, so neither the inputs nor the joined record are ever held in memory whole.
+#
+# Usage example e.g.
+#
+#   python3.6 join_dataframes.py Ballenas_Island_1020590 Ballenas_Island_CS_1020591 --output Ballenas_Island_All_Data.csv
+#   python3.6 join_dataframes.py Sandhead_CS_1107010 Sand_Heads_1107011 Sand_Heads_1107012 --priority Sand_Heads_1107011 --output Sand_Heads_All_Data.h5
+#
+# An output ending in .h5 or .hdf5 is written as an HDF5 table in the layout of the processed station files, keyed by its file name
+# so it can be loaded like any other station file once it is moved to data/processed. Anything else is written as csv.
 
 import pandas as pd
-import sys, os, os.path as path
-
-# A helper function to display progress bar while the frames are being read in
-def progress_bar(value, endvalue, bar_length=25):
-	percent = float(value) / endvalue
-	arrow = '-' * int(round(percent * bar_length)-1) + '>'
-	spaces = ' ' * (bar_length - len(arrow))
-	sys.stdout.write("\rPercent: [{0}] {1}%".format(arrow + spaces, int(round(percent * 100))))
-	sys.stdout.flush()
-
-# Loads an list of HDF5 files into memory. Takes a list of filenames provided by the user,
-# and returns a list of data frames which is passed onto other functions for further processing
-def load_files(filenames):
-
-	# Set this option to see more columns when printing pandas df for debugging purposes
-	pd.set_option('display.expand_frame_repr', False)
-
-	print("\nLoading data files into the program ...\n")
-	root_dir = path.abspath(path.join(__file__ ,"../.."))
-	relative_path = root_dir + "/data/processed/"
-	frames = []
-	for index, filename in enumerate(filenames):
-		# Search for the files in the data/processed directory
-		temp_path = relative_path + filename
-		frame = pd.read_hdf(temp_path, filename)
-		# Get rid of the columns that we will not be using in this analysis
-		try:
-			del frame['Wind Spd Flag'], frame['Visibility (km)'], frame['Visibility Flag'], frame['Hmdx'], frame['Hmdx Flag']
-			del frame['Dew Point Temp (°C)'], frame['Dew Point Temp Flag'], frame['Rel Hum (%)'], frame['Rel Hum Flag']
-			del frame['Weather'], frame['Wind Chill'], frame['Wind Chill Flag'], frame['Year'], frame['Month'], frame['Day'], frame['Time']
-			del frame['Stn Press Flag'], frame['Stn Press (kPa)'], frame['Wind Dir Flag'], frame['Temp Flag'], frame['Temp (°C)']
-			#print(frame)
-		except KeyError as e:
-			# This is a text file DF so get it into the same format as the Env.Can. df
-			print(e)
-			wind_speeds = frame.loc[((frame['Data Type'] == '070') | (frame['Data Type'] == '076'))]
-			wind_speeds = wind_speeds.rename(columns = {'Data' : 'Wind Spd (km/h)'})
-			wind_directions = frame.loc[((frame['Data Type'] == '156') | (frame['Data Type'] == '069'))]
-			wind_directions = wind_directions.rename(columns = {'Data' : 'Wind Dir (10s deg)'})
-			del wind_directions['Data Type'], wind_directions['climate_id']
-			del wind_speeds['Data Type'], wind_speeds['climate_id']
-			text_file_df = wind_speeds.join(wind_directions, how = 'inner', lsuffix = '_l')
-			frame = text_file_df
-		frames.append((filename, frame))
-		progress_bar(index + 1, len(filenames))
-	print("\nDone\n")
-	return frames
+import sys, os, os.path as path, logging, argparse, warnings
+import profiling
+from station_loader import (get_processed_directory, read_wind_frame, read_stored_times, get_time_condition, read_slev_csv, iterate_slev_csv,
+	read_slev_times, compact_frame, set_schema, SCHEMA_ENVIRONMENT_CANADA, STRING_MIN_ITEMSIZE, WIND_COLUMNS)
+
+# Hours of every source merged at a time, which bounds the rows held in memory while streaming a join
+DEFAULT_CHUNK_HOURS = 24 * 365
+
+logger = logging.getLogger(__name__)
 
 # This function takes a list of 2 dataframes as an argument and performs an inner join by matching the dataframe indices
 # No longer being called or used
 def inner_join_dataframes(dataframes):
 
-	print('\nJoining dataframes...')
+	logger.info('Joining dataframes...')
 
 	df1 = dataframes[0][1]
 	df2 = dataframes[1][1]
 
 	df1.index.names = ['time']
 	df2.index.names = ['time']
-	print(df1.index)
-	print(df2.index)
+	logger.debug("%s", df1.index)
+	logger.debug("%s", df2.index)
 
 	# perfrom an inner join by default
 	merged_df = pd.merge(df1, df2, left_index=True, right_index=True)
-	print(merged_df)
-	return merged_df
-
-# This function takes a list of 2 dataframes as an argument and performs an inner join by matching the dataframe indices
-def join_dataframes(dataframes):
-
-	print('\nJoining dataframes...')
-	df1 = dataframes[0][1]
-	df2 = dataframes[1][1]
-	df1.index.names = ['Date/Time']
-	df2.index.names = ['Date/Time']
-
-	# perform a join
-	merged_df = df1.join(df2, how = 'outer', lsuffix = '_left', rsuffix = '_right')
-	merged_df['Wind Spd (km/h)_left'] = merged_df['Wind Spd (km/h)_right'].fillna(merged_df['Wind Spd (km/h)_left'])
-	merged_df['Wind Dir (10s deg)_left'] = merged_df['Wind Dir (10s deg)_right'].fillna(merged_df['Wind Dir (10s deg)_left'])
-	del merged_df['Wind Dir (10s deg)_right'], merged_df['Wind Spd (km/h)_right']
-	merged_df.rename(columns = {'Wind Spd (km/h)_left' : 'Wind Spd (km/h)'}, inplace = True)
-	merged_df.rename(columns = {'Wind Dir (10s deg)_left' : 'Wind Dir (10s deg)'}, inplace = True)
-	#with pd.option_context('display.max_rows', None, 'display.max_columns', 4):
-		#print(df1)
-		#print(df2)
-	#	print(merged_df)
+	logger.debug("%s", merged_df)
 	return merged_df
 
-def save_file(frame):
-
-	# Convert the frame to hdf5 format
-	#frame.to_hdf('Sisters_Island_All_Data', 'Sisters_Island_All_Data', append = True)
-
-	# Convert the frame to .csv format
-	frame.to_csv('Ballenas_Island_All_Data', sep = ',')
+# Returns the positions of the sources in priority order: the filenames in priority first, in that order,
+# then the other sources with the later ones before the earlier ones, as the two file join always let the second file win
+def get_priority_order(filenames, priority = None):
+
+	order = list(reversed(range(len(filenames))))
+	if(priority):
+		unknown = [filename for filename in priority if filename not in filenames]
+		if(unknown):
+			raise ValueError("%s in the priority list not among the joined files %s." % (', '.join(unknown), ', '.join(filenames)))
+		preferred = [filenames.index(filename) for filename in priority]
+		order = preferred + [position for position in order if position not in preferred]
+	return order
+
+# Returns frame sorted by time with the first reading of every hour, which is what the chunked merge expects of each slice of a source
+def prepare_frame(frame):
+
+	frame = frame.copy(deep = False)
+	# Without a frequency, which the chunks of a table could not keep across appends
+	frame.index = pd.DatetimeIndex(frame.index, name = 'Date/Time', freq = None)
+	if(not frame.index.is_monotonic_increasing):
+		frame = frame.sort_index(kind = 'stable')
+	return frame[~frame.index.duplicated()]
+
+# Returns a source of the join over frame, a frame already in memory. A source holds its sorted distinct times, the dtypes
+# of its columns and a reader returning its rows from start up to but not including stop
+def frame_source(frame):
+	frame = prepare_frame(frame)
+	return {
+		'times': frame.index,
+		'dtypes': frame.dtypes,
+		'read': lambda start, stop: frame.iloc[frame.index.searchsorted(start):frame.index.searchsorted(stop)],
+	}
+
+# Returns a source of the join over the wind columns of the HDF5 station file at filepath, reading the rows of a slice of hours
+# with a where condition on the index. A file stored in the fixed format cannot be read in slices and is read whole
+def hdf_source(filepath, key):
+	times = read_stored_times(filepath, key)
+	if(times is None):
+		return frame_source(read_wind_frame(filepath, key, WIND_COLUMNS))
+	read = lambda start, stop: prepare_frame(read_wind_frame(filepath, key, WIND_COLUMNS, get_time_condition(start, stop)))
+	# An empty slice gives the columns and dtypes of the file
+	return {'times': times, 'dtypes': read(pd.Timestamp(0), pd.Timestamp(0)).dtypes, 'read': read}
+
+# Returns a source of the join over the sea level csv file at filepath. The file is read chunk_rows rows at a time and the rows after
+# the slice asked for are kept for the next one, which takes a file sorted by time. A file that is not sorted is read whole
+def csv_source(filepath, chunk_rows):
+	times = read_slev_times(filepath)
+	if(len(times) == 0 or not times.is_monotonic_increasing):
+		return frame_source(read_slev_csv(filepath))
+	rows = iterate_slev_csv(filepath, chunk_rows)
+	state = {'pending': next(rows)}
+
+	def read(start, stop):
+		pending = [state['pending']]
+		while(len(pending[-1]) == 0 or pending[-1].index[-1] < stop):
+			chunk = next(rows, None)
+			if(chunk is None):
+				break
+			pending.append(chunk)
+		frame = pd.concat(pending)
+		state['pending'] = frame[frame.index >= stop]
+		return prepare_frame(frame[(frame.index >= start) & (frame.index < stop)])
+
+	return {'times': times.unique(), 'dtypes': state['pending'].dtypes, 'read': read}
+
+# Returns the source of the join reading the processed station or sea level file filename a slice of hours at a time
+def open_source(filename, chunk_hours = DEFAULT_CHUNK_HOURS):
+	filepath = get_processed_directory() + filename
+	if(filename.endswith('.csv')):
+		# The sea level files hold a reading an hour
+		return csv_source(filepath, chunk_hours)
+	return hdf_source(filepath, filename)
+
+# Joins the chunks of the sources covering the same hours, parts being in priority order. A column missing in a
+# source, or NaN in an hour, is filled in from the next source that has it. Every chunk has the columns and dtypes of the
+# whole join, so a column no source has in these hours does not turn into float64 NaN and the chunks append to the same table
+def coalesce_chunk(parts, columns, dtypes):
+	merged = parts[0]
+	for part in parts[1:]:
+		merged = merged.combine_first(part)
+	return merged.reindex(columns = columns).astype(dtypes)
+
+# Yields the join of sources, a list of (filename, source) tuples as returned by open_source() or frame_source(), in time order,
+# chunk_hours at a time. Every source keeps a cursor into its sorted times. Each chunk starts at the earliest hour any source has left,
+# so long gaps shared by every source cost nothing, and only the sources with hours in a chunk are read for it
+def iterate_joined_chunks(sources, priority = None, chunk_hours = DEFAULT_CHUNK_HOURS):
+
+	order = get_priority_order([filename for filename, source in sources], priority)
+	sources = [sources[position][1] for position in order]
+	# A column keeps the dtype it has in the first source in priority order that has it
+	columns, dtypes = [], {}
+	for source in sources:
+		for column, dtype in source['dtypes'].items():
+			if(column not in dtypes):
+				columns.append(column)
+				dtypes[column] = dtype
+	step = pd.Timedelta(hours = chunk_hours)
+	cursors = [0] * len(sources)
+	while(True):
+		remaining = [source['times'][cursor] for source, cursor in zip(sources, cursors) if cursor < len(source['times'])]
+		if(not remaining):
+			return
+		start = min(remaining)
+		stop = start + step
+		ends = [source['times'].searchsorted(stop) for source in sources]
+		parts = [source['read'](start, stop) for source, cursor, end in zip(sources, cursors, ends) if end > cursor]
+		yield coalesce_chunk(parts, columns, dtypes)
+		cursors = ends
+
+# This function takes a list of (filename, frame) tuples and joins the frames on their time index, keeping for every hour
+# and column the reading of the first source in priority order that has one. Returns the whole joined frame
+def join_dataframes(dataframes, priority = None):
+
+	logger.info('Joining dataframes...')
+	chunks = list(iterate_joined_chunks([(filename, frame_source(frame)) for filename, frame in dataframes], priority))
+	return pd.concat(chunks) if chunks else pd.DataFrame(index = pd.DatetimeIndex([], name = 'Date/Time'))
+
+# Writes the chunks of a join to output as they come, as an HDF5 table keyed by the file name when output ends in .h5 or .hdf5
+# and as csv otherwise. The table is written in the compact dtypes of the scrapers, with room for longer strings in later chunks.
+# Returns the number of rows written
+def save_file(chunks, output):
+
+	rows = 0
+	if(output.endswith(('.h5', '.hdf5'))):
+		key = path.basename(output)
+		# The extension makes the key an invalid Python identifier, which only matters to PyTables' natural naming
+		with warnings.catch_warnings(), pd.HDFStore(output, mode = 'w') as store:
+			warnings.filterwarnings('ignore', message = 'object name is not a valid Python identifier')
+			for chunk in chunks:
+				store.append(key, compact_frame(chunk), min_itemsize = STRING_MIN_ITEMSIZE)
+				rows += len(chunk)
+			if(rows):
+				set_schema(store, key, SCHEMA_ENVIRONMENT_CANADA)
+		return rows
+
+	# Convert the frame to .csv format, writing the header with the first chunk
+	with open(output, 'w') as f:
+		for chunk in chunks:
+			chunk.to_csv(f, sep = ',', header = (rows == 0))
+			rows += len(chunk)
+	return rows
 
 # The main function handles higher level program logic
 def main(argv):
 
-	if(len(argv) < 2):
-		print("Please include the 2 files as program arguments.\nFiles should contain station data in hdf5 format: Station_Name_123456 where the number is the climate or station ID.")
-		print("Filenames should be separated by spaces.\n")
-		sys.exit(0)
-	else:
-		print('\n')
-		# Load the data in to the program from the hdf files
-		dataframes = load_files(argv[1:])
-		#inner_join_dataframes(dataframes)
-		final_frame = join_dataframes(dataframes)
-		print(final_frame)
-		save_file(final_frame)
-		sys.exit(0)
+	argv = profiling.setup(argv)
+	parser = argparse.ArgumentParser(description = "Join the readings of several stations into a single record, streaming it to a csv or HDF5 file.")
+	parser.add_argument('filenames', nargs = '+', help = "processed station files in data/processed, e.g. Station_Name_123456 where the number is the climate or station ID")
+	parser.add_argument('--output', default = 'Ballenas_Island_All_Data', help = "file the joined record is written to, an HDF5 table when it ends in .h5 or .hdf5 and csv otherwise")
+	parser.add_argument('--priority', nargs = '+', default = None, help = "files whose readings win, in order. The files given later win over the earlier ones otherwise")
+	parser.add_argument('--chunk-hours', type = int, default = DEFAULT_CHUNK_HOURS, help = "hours of every file joined and written at a time")
+	args = parser.parse_args(argv[1:])
+
+	# Check the priority list before anything is loaded or the output is opened, so a bad name leaves an existing output untouched
+	try:
+		get_priority_order(args.filenames, args.priority)
+	except ValueError as error:
+		parser.error(str(error))
+
+	# Open the files in data/processed, which reads their times only
+	sources = [(filename, open_source(filename, args.chunk_hours)) for filename in args.filenames]
+	with profiling.stage('join_dataframes') as current:
+		rows = save_file(iterate_joined_chunks(sources, args.priority, args.chunk_hours), args.output)
+		current.count(rows = rows, bytes_written = profiling.file_size(args.output))
+	logger.info("Joined %d files into %d hours. Wrote %s", len(sources), rows, args.output)
+	sys.exit(0)
 
 if __name__ == "__main__":
 	main(sys.argv)
@@ -0,0 +1,191 @@
+# Stage level profiling shared by the scrapers and the analysis tools.
+# Every script accepts --profile (or --profile=report.json): each stage then records its calls, wall and CPU time,
+# the rows and points it handled and the bytes it read and wrote, and a JSON report with the peak resident memory
+# is written to the results folder when the program exits. Without the flag the stages are a shared no-op object,
+# so instrumented code costs a function call per stage and nothing more.
+#
+# Messages go through the logging module instead of print: progress and status at INFO, shown as plain lines by default,
+# problems at WARNING and debug output (whole frames, intermediate shapes) at DEBUG, only shown with --log-level=DEBUG
+# or WIND_TOOLS_LOG_LEVEL=DEBUG. --log-level=WARNING keeps a script quiet. Only the results a command is asked for,
+# e.g. a summary table or a queue status, and the usage text are printed. progress_bar() is the one progress display of every script.
+#
+# Usage in a script e.g.
+#
+#   argv = profiling.setup(argv)
+#   with profiling.stage('read_file') as current:
+#       ...
+#       current.count(rows = len(df), bytes_read = os.path.getsize(filename))
+
+from collections import OrderedDict
+import atexit, json, logging, os, sys, threading, time
+import os.path as path
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+# Everything recorded while profiling is enabled
+profile_state = {'enabled': False, 'report': None, 'program': None, 'argv': None, 'wall': None, 'cpu': None, 'stages': OrderedDict()}
+# Stages can be recorded from several threads at once, e.g. by wind_service.py
+profile_lock = threading.Lock()
+
+# The stage returned while profiling is disabled, entering and counting do nothing
+class NullStage(object):
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return False
+
+	def count(self, rows = 0, points = 0, bytes_read = 0, bytes_written = 0):
+		pass
+
+NULL_STAGE = NullStage()
+
+# Times one run of a stage and adds it to the totals of every run of that stage
+class Stage(object):
+
+	def __init__(self, name):
+		self.name = name
+		with profile_lock:
+			self.totals = profile_state['stages'].setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+				'rows': 0, 'points': 0, 'bytes_read': 0, 'bytes_written': 0})
+
+	def __enter__(self):
+		self.wall = time.perf_counter()
+		self.cpu = time.process_time()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		wall = time.perf_counter() - self.wall
+		cpu = time.process_time() - self.cpu
+		with profile_lock:
+			self.totals['calls'] += 1
+			self.totals['wall_seconds'] += wall
+			self.totals['cpu_seconds'] += cpu
+		return False
+
+	def count(self, rows = 0, points = 0, bytes_read = 0, bytes_written = 0):
+		with profile_lock:
+			self.totals['rows'] += int(rows)
+			self.totals['points'] += int(points)
+			self.totals['bytes_read'] += int(bytes_read)
+			self.totals['bytes_written'] += int(bytes_written)
+
+# Returns the context manager timing a stage, or the shared no-op stage when profiling is disabled
+def stage(name):
+	if(not profile_state['enabled']):
+		return NULL_STAGE
+	return Stage(name)
+
+# Returns True when profiling is enabled
+def is_enabled():
+	return profile_state['enabled']
+
+# Starts recording stages, the report is written to filename when the program exits
+def enable_profiling(filename, program):
+	profile_state.update(enabled = True, report = filename, program = program, argv = list(sys.argv),
+		wall = time.perf_counter(), cpu = time.process_time(), stages = OrderedDict())
+	atexit.register(write_report)
+
+# Returns the size of a file in bytes, or 0 when it does not exist. Used to count the bytes read and written by a stage
+def file_size(filename):
+	try:
+		return os.path.getsize(filename)
+	except OSError:
+		return 0
+
+# Returns the peak resident memory of this process and of its finished child processes in bytes, None where it is not available
+def get_peak_rss():
+	if(resource is None):
+		return None, None
+	# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+	scale = 1 if sys.platform == 'darwin' else 1024
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+
+# Returns the report of everything recorded so far, with the rows and points per second of each stage
+def get_report():
+
+	stages = OrderedDict()
+	with profile_lock:
+		recorded = [(name, dict(totals)) for name, totals in profile_state['stages'].items()]
+	for name, totals in recorded:
+		result = dict(totals)
+		wall = totals['wall_seconds']
+		result['rows_per_second'] = totals['rows'] / wall if wall > 0 and totals['rows'] else None
+		result['points_per_second'] = totals['points'] / wall if wall > 0 and totals['points'] else None
+		stages[name] = result
+	peak_rss, peak_rss_children = get_peak_rss()
+	return OrderedDict([
+		('program', profile_state['program']),
+		('argv', profile_state['argv']),
+		('wall_seconds', time.perf_counter() - profile_state['wall']),
+		('cpu_seconds', time.process_time() - profile_state['cpu']),
+		('peak_rss_bytes', peak_rss),
+		('peak_rss_children_bytes', peak_rss_children),
+		('stages', stages),
+	])
+
+# Writes the report to the file given with --profile. Registered to run when the program exits
+def write_report():
+
+	if(not profile_state['enabled']):
+		return
+	directory = path.dirname(profile_state['report'])
+	if(directory and not path.isdir(directory)):
+		os.makedirs(directory)
+	with open(profile_state['report'], 'w') as f:
+		json.dump(get_report(), f, indent = 2)
+	sys.stderr.write("Profile written to %s\n" % (profile_state['report']))
+
+# Shows INFO messages as they are and every other level with the level and the logger name in front
+class MessageFormatter(logging.Formatter):
+
+	def format(self, record):
+		if(record.levelno == logging.INFO):
+			return record.getMessage()
+		return logging.Formatter.format(self, record)
+
+# Displays a progress bar of value out of endvalue, e.g. files read or hours interpolated so far.
+# The line is ended once the bar is full, so the messages that follow start on a line of their own
+def progress_bar(value, endvalue, bar_length = 25):
+	percent = float(value) / endvalue
+	arrow = '-' * int(round(percent * bar_length)-1) + '>'
+	spaces = ' ' * (bar_length - len(arrow))
+	sys.stdout.write("\rPercent: [{0}] {1}%".format(arrow + spaces, int(round(percent * 100))))
+	if(value >= endvalue):
+		sys.stdout.write('\n')
+	sys.stdout.flush()
+
+# Removes the --profile and --log-level options from argv, sets up logging and profiling, and returns the remaining arguments.
+# Called first thing by the main function of every script, so the options work the same whether a script reads sys.argv or uses argparse
+def setup(argv):
+
+	program = path.splitext(path.basename(argv[0]))[0] if argv else 'wind_tools'
+	level = os.environ.get('WIND_TOOLS_LOG_LEVEL', 'INFO')
+	report = None
+	remaining = []
+	arguments = iter(argv)
+	for argument in arguments:
+		if(argument == '--profile'):
+			report = ''
+		elif(argument.startswith('--profile=')):
+			report = argument[len('--profile='):]
+		elif(argument == '--log-level'):
+			level = next(arguments, level)
+		elif(argument.startswith('--log-level=')):
+			level = argument[len('--log-level='):]
+		else:
+			remaining.append(argument)
+
+	handler = logging.StreamHandler()
+	handler.setFormatter(MessageFormatter('%(levelname)s %(name)s: %(message)s'))
+	logging.basicConfig(level = getattr(logging, level.upper(), logging.INFO), handlers = [handler])
+	if(report is not None):
+		if(report == ''):
+			root_dir = path.abspath(path.join(__file__ ,"../.."))
+			report = root_dir + "/results/profile_%s_%s.json" % (program, time.strftime('%Y%m%d_%H%M%S'))
+		enable_profiling(path.abspath(report), program)
+	return remaining
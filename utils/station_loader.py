@@ -0,0 +1,310 @@
+# Shared loader for the processed station files used by the analysis tools.
+# Reads only the columns an analysis asks for, works out how a file was scraped from the metadata stored
+# alongside the frame instead of waiting for a KeyError, and returns every station in the same
+# normalized (wind speed, wind direction) format indexed by a datetime64 index.
+# The scrapers store compact frames written by compact_frame(), and the wind columns are held as float32 once loaded,
+# so a station takes half the memory of the float64 frames, in the cache as well as in the stores.
+#
+# The scrapers decode the sentinels and flags of every reading into a uint8 quality bit-field stored next to it. Asking for
+# the quality columns (QUALITY_COLUMNS) returns them with the readings, and filter_quality() drops readings by their bits in one vectorized step.
+#
+# Loaded frames are kept in an in-process LRU cache keyed by file path, modification time and requested columns,
+# so scripting several tools together (peaks, then surge correlation, then maps) only decodes each station once.
+# The cache budget defaults to WIND_TOOLS_CACHE_MB megabytes and can be changed with set_cache_budget().
+# The processed files are read from data/processed unless WIND_TOOLS_PROCESSED_DIR points somewhere else.
+
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+import os, logging
+import os.path as path
+import profiling
+
+logger = logging.getLogger(__name__)
+
+SPEED_COLUMN = 'Wind Spd (km/h)'
+DIRECTION_COLUMN = 'Wind Dir (10s deg)'
+WIND_COLUMNS = [SPEED_COLUMN, DIRECTION_COLUMN]
+
+# The scrapers record which of these layouts they wrote in the HDF5 node attributes under SCHEMA_ATTRIBUTE
+SCHEMA_ATTRIBUTE = 'wind_tools_schema'
+SCHEMA_ENVIRONMENT_CANADA = 'environment_canada'
+SCHEMA_BUOY = 'buoy'
+SCHEMA_TEXT_FILE = 'text_file'
+
+# The readings are whole km/h and 10s of degrees, or tenths from the buoys, which float32 holds with room to spare
+MEASUREMENT_DTYPE = np.float32
+
+# The quality bits of a reading, decoded from the Environment Canada and HLY15 flags and sentinels
+QUALITY_MISSING = 1
+QUALITY_ESTIMATED = 2
+QUALITY_NOT_AVAILABLE = 4
+QUALITY_UNREVIEWED = 8
+QUALITY_OTHER = 128
+
+# The flags of the Environment Canada legend, any other flag sets QUALITY_OTHER
+FLAG_QUALITY = {
+	'M': QUALITY_MISSING,
+	'E': QUALITY_ESTIMATED,
+	'NA': QUALITY_NOT_AVAILABLE,
+	'**': QUALITY_UNREVIEWED,
+}
+
+# The quality column of each wind column, as the scrapers store them
+QUALITY_COLUMNS = {
+	SPEED_COLUMN: 'Wind Spd Quality',
+	DIRECTION_COLUMN: 'Wind Dir Quality',
+}
+
+# The HLY15 data types are 3 digit codes, stored as categoricals with every code as a fixed category so every chunk appended to a
+# station file has the same codes. The climate id is left a string: there is one per station file and new stations keep being added
+DATA_TYPES = ['%03d' % code for code in range(1000)]
+CATEGORY_COLUMNS = {
+	'Data Type': DATA_TYPES,
+}
+
+# Room kept for the text columns in the HDF5 tables, e.g. the climate id and the weather, passed as min_itemsize when appending,
+# so later chunks with longer strings still fit
+STRING_MIN_ITEMSIZE = {'values': 64}
+
+# Text file frames are stored in long format, one row per (time, Data Type)
+TEXT_FILE_DATA_TYPES = {
+	SPEED_COLUMN: ['070', '076'],
+	DIRECTION_COLUMN: ['156', '069'],
+}
+
+# The LRU cache of loaded frames, least recently used first, and its bookkeeping
+frame_cache = OrderedDict()
+cache_state = {'budget': int(float(os.environ.get('WIND_TOOLS_CACHE_MB', 1024)) * 1024 * 1024), 'size': 0, 'hits': 0, 'misses': 0}
+
+# Returns the directory the processed station files live in
+def get_processed_directory():
+	if(os.environ.get('WIND_TOOLS_PROCESSED_DIR')):
+		return path.join(os.environ['WIND_TOOLS_PROCESSED_DIR'], '')
+	root_dir = path.abspath(path.join(__file__ ,"../.."))
+	return root_dir + "/data/processed/"
+
+# Sets the memory budget of the frame cache in megabytes, evicting frames until the cache fits. 0 disables caching
+def set_cache_budget(megabytes):
+	cache_state['budget'] = int(megabytes * 1024 * 1024)
+	evict_frames()
+
+# Empties the frame cache
+def clear_cache():
+	frame_cache.clear()
+	cache_state['size'] = 0
+
+# Returns the number of cached frames, their size in bytes, the budget and the hit and miss counts
+def get_cache_info():
+	return dict(cache_state, frames = len(frame_cache))
+
+# Drops the least recently used frames until the cache fits in its budget
+def evict_frames():
+	while(frame_cache and cache_state['size'] > cache_state['budget']):
+		key, (frame, size) = frame_cache.popitem(last = False)
+		cache_state['size'] -= size
+
+# Returns the frame read by reader() for filepath and columns, reading it only if it is not already cached.
+# The modification time is part of the key, so a file rewritten by a scraper is read again.
+# Callers get a shallow copy, so renaming or adding columns never alters the cached frame
+def get_cached_frame(filepath, columns, reader):
+
+	key = (path.abspath(filepath), os.stat(filepath).st_mtime_ns, tuple(columns))
+	if(key in frame_cache):
+		frame_cache.move_to_end(key)
+		cache_state['hits'] += 1
+		return frame_cache[key][0].copy(deep = False)
+
+	cache_state['misses'] += 1
+	frame = reader()
+	size = int(frame.memory_usage(index = True, deep = True).sum())
+	if(size <= cache_state['budget']):
+		frame_cache[key] = (frame, size)
+		cache_state['size'] += size
+		evict_frames()
+	return frame.copy(deep = False)
+
+# Returns frame with the compact dtypes the scrapers store: float measurements as float32 and the CATEGORY_COLUMNS as categoricals
+# with their fixed categories. The dtypes do not depend on the values of the frame, so chunks appended to the same table always match.
+# Other text columns, the climate id among them, are left as strings, appended with STRING_MIN_ITEMSIZE.
+# The datetime64 index is kept, it is stored as int64 nanoseconds
+def compact_frame(frame):
+
+	frame = frame.copy()
+	for column in frame.columns:
+		series = frame[column]
+		if(column in CATEGORY_COLUMNS):
+			unknown = set(series.dropna()) - set(CATEGORY_COLUMNS[column])
+			if(unknown):
+				raise ValueError("Unknown %s %s in the frame to store, expected one of %s ... %s." % (column, ', '.join(sorted(map(str, unknown))),
+					CATEGORY_COLUMNS[column][0], CATEGORY_COLUMNS[column][-1]))
+			frame[column] = pd.Categorical(series, categories = CATEGORY_COLUMNS[column])
+		elif(pd.api.types.is_float_dtype(series.dtype)):
+			frame[column] = series.astype(MEASUREMENT_DTYPE)
+	return frame
+
+# Returns the uint8 quality bits of a sequence of flag strings. Each distinct flag is decoded once, empty flags have no bits
+def get_flag_quality(flags):
+	codes, uniques = pd.factorize(pd.Series(flags).astype(object).str.strip())
+	# The extra 0 at the end is picked by the code -1 of the missing flags
+	bits = [FLAG_QUALITY.get(flag, QUALITY_OTHER) if flag else 0 for flag in uniques] + [0]
+	return np.array(bits, dtype = np.uint8)[codes]
+
+# Returns frame with its string flag columns, e.g. 'Wind Spd Flag', replaced by uint8 quality columns, e.g. 'Wind Spd Quality'
+def decode_flag_columns(frame):
+
+	frame = frame.copy()
+	names = {}
+	for column in frame.columns:
+		if(column.endswith(' Flag')):
+			frame[column] = get_flag_quality(frame[column])
+			names[column] = column[:-len('Flag')] + 'Quality'
+	return frame.rename(columns = names)
+
+# Returns frame with the readings whose quality has any of bits set replaced by NaN, e.g. filter_quality(frame, QUALITY_ESTIMATED)
+# leaves out the estimated readings. The frame has to be loaded with the quality columns of its wind columns
+def filter_quality(frame, bits):
+
+	frame = frame.copy(deep = False)
+	for column, quality_column in QUALITY_COLUMNS.items():
+		if(column in frame and quality_column in frame):
+			frame[column] = frame[column].where((frame[quality_column].to_numpy() & bits) == 0)
+	return frame
+
+# Records the layout of a frame that was just written to an HDF5 store. Called by the scrapers
+def set_schema(store, key, schema):
+	store.get_storer(key).attrs[SCHEMA_ATTRIBUTE] = schema
+
+# Returns the names of the columns stored under key, read from the table metadata rather than the data
+def get_stored_columns(store, key):
+	storer = store.get_storer(key)
+	if(storer.is_table):
+		return list(storer.non_index_axes[0][1])
+	return list(store.select(key, start = 0, stop = 0).columns)
+
+# Returns the layout of the frame stored under key
+def get_schema(store, key):
+	attributes = store.get_storer(key).attrs
+	if(SCHEMA_ATTRIBUTE in attributes):
+		return attributes[SCHEMA_ATTRIBUTE]
+	# Files scraped before the schema was recorded are told apart by their column names
+	if('Data Type' in get_stored_columns(store, key)):
+		return SCHEMA_TEXT_FILE
+	return SCHEMA_ENVIRONMENT_CANADA
+
+# Reads the requested wind columns of a single processed station file, through the frame cache.
+# Environment Canada and buoy frames are read with only those columns selected, text file frames only read
+# their 'Data Type' and 'Data' columns and pivot the matching data types into the same normalized columns.
+# columns can also hold the QUALITY_COLUMNS of the wind columns
+def load_wind_frame(filename, columns = WIND_COLUMNS):
+	filepath = get_processed_directory() + filename
+	return get_cached_frame(filepath, columns, lambda: read_wind_frame(filepath, filename, columns))
+
+# Reads the requested wind columns stored under key in the HDF5 file at filepath, bypassing the cache.
+# With where only the matching rows are read, see read_wind_columns()
+def read_wind_frame(filepath, key, columns, where = None):
+	with profiling.stage('read_wind_frame') as current:
+		frame = read_wind_columns(filepath, key, columns, where)
+		current.count(rows = len(frame), points = frame.size, bytes_read = profiling.file_size(filepath))
+	return frame
+
+# Returns the where condition of the rows stored from start up to but not including stop. Files stored before the datetime64
+# index hold it as '%Y-%m-%d %H:%M' strings, which compare the same way, so the condition is written in that format
+def get_time_condition(start, stop):
+	return 'index >= "%s" & index < "%s"' % (start.strftime('%Y-%m-%d %H:%M'), stop.strftime('%Y-%m-%d %H:%M'))
+
+# Returns the sorted distinct times stored under key in the HDF5 file at filepath, reading the index column alone.
+# Returns None for a file stored in the fixed format, which cannot be read a column or a slice of rows at a time
+def read_stored_times(filepath, key):
+
+	with pd.HDFStore(filepath, mode = 'r') as store:
+		if(not store.get_storer(key).is_table):
+			return None
+		times = store.select_column(key, 'index')
+	times = pd.DatetimeIndex(pd.to_datetime(times, format = '%Y-%m-%d %H:%M'), name = 'Date/Time')
+	return times.unique().sort_values()
+
+# Does the reading for read_wind_frame(). With where, e.g. get_time_condition(start, stop), only the matching rows of a table are read
+def read_wind_columns(filepath, key, columns, where = None):
+
+	# A quality column is read along with the readings it describes
+	measurements = [column for column in WIND_COLUMNS if column in columns or QUALITY_COLUMNS[column] in columns]
+	qualities = [column for column in measurements if QUALITY_COLUMNS[column] in columns]
+	with pd.HDFStore(filepath, mode = 'r') as store:
+		stored = get_stored_columns(store, key)
+		if(get_schema(store, key) == SCHEMA_TEXT_FILE):
+			long_frame = store.select(key, where = where, columns = ['Data Type', 'Data'] + (['Quality'] if qualities and 'Quality' in stored else []))
+			series = []
+			for column in measurements:
+				rows = long_frame['Data Type'].isin(TEXT_FILE_DATA_TYPES[column])
+				part = long_frame.loc[rows, ['Data']].rename(columns = {'Data': column})
+				if(column in qualities and 'Quality' in long_frame):
+					part[QUALITY_COLUMNS[column]] = long_frame.loc[rows, 'Quality']
+				series.append(part)
+			frame = series[0]
+			for other in series[1:]:
+				frame = frame.join(other, how = 'inner')
+		else:
+			frame = store.select(key, where = where, columns = measurements + [QUALITY_COLUMNS[column] for column in qualities if QUALITY_COLUMNS[column] in stored])
+	# Frames stored before the scrapers wrote a datetime64 index are parsed here in a single vectorized call
+	frame.index = pd.to_datetime(frame.index, format = '%Y-%m-%d %H:%M')
+	frame.index.name = 'Date/Time'
+	# Frames stored before the scrapers wrote float32 are compacted here
+	frame[measurements] = frame[measurements].astype(MEASUREMENT_DTYPE)
+	# Missing readings are flagged whatever the source, which also gives buoy files and files stored before the quality columns their missing bits
+	for column in qualities:
+		quality = frame[QUALITY_COLUMNS[column]].to_numpy() if QUALITY_COLUMNS[column] in frame else 0
+		frame[QUALITY_COLUMNS[column]] = (quality | np.where(np.isnan(frame[column].to_numpy()), QUALITY_MISSING, 0)).astype(np.uint8)
+	return frame[columns]
+
+# Reads a sea level (SLEV) csv file from the processed directory into a frame with a single SLEV column
+def load_slev_csv(filename):
+	filepath = get_processed_directory() + filename
+	return get_cached_frame(filepath, ['SLEV'], lambda: read_slev_csv(filepath))
+
+# Reads the sea level csv file at filepath, bypassing the cache
+def read_slev_csv(filepath):
+
+	with profiling.stage('read_slev_csv') as current:
+		frame = format_slev_rows(pd.read_csv(filepath, delimiter = ',', header = None,
+			names = ['Date/Time', 'SLEV', 'N/A'], usecols = ['Date/Time', 'SLEV']))
+		current.count(rows = len(frame), bytes_read = profiling.file_size(filepath))
+	return frame
+
+# Yields the sea level csv file at filepath chunk_rows rows at a time, in the order of the file, bypassing the cache
+def iterate_slev_csv(filepath, chunk_rows):
+	rows = pd.read_csv(filepath, delimiter = ',', header = None,
+		names = ['Date/Time', 'SLEV', 'N/A'], usecols = ['Date/Time', 'SLEV'], chunksize = chunk_rows)
+	for chunk in rows:
+		yield format_slev_rows(chunk)
+
+# Returns the times of the sea level csv file at filepath in the order of the file, reading the time column alone
+def read_slev_times(filepath):
+	times = pd.read_csv(filepath, delimiter = ',', header = None, names = ['Date/Time', 'SLEV', 'N/A'], usecols = ['Date/Time'])
+	return pd.DatetimeIndex(pd.to_datetime(times['Date/Time']), name = 'Date/Time')
+
+# Returns the rows of a sea level csv file, as read by pd.read_csv, indexed by time with a numeric SLEV column
+def format_slev_rows(frame):
+	frame['Date/Time'] = pd.to_datetime(frame['Date/Time'])
+	frame = frame.set_index('Date/Time')
+	frame['SLEV'] = pd.to_numeric(frame['SLEV'], errors = 'coerce')
+	return frame
+
+# Loads a list of processed files into memory. Takes a list of filenames provided by the user,
+# and returns a list of (filename, frame) tuples which is passed onto other functions for further processing.
+# HDF5 station files are normalized to the wind columns, sea level .csv files keep their SLEV column
+def load_files(filenames, columns = WIND_COLUMNS):
+
+	logger.info("Loading data files into the program ...")
+	frames = []
+	with profiling.stage('load_files') as current:
+		for index, filename in enumerate(filenames):
+			if(filename.endswith('.csv')):
+				frame = load_slev_csv(filename)
+			else:
+				frame = load_wind_frame(filename, columns)
+			frames.append((filename, frame))
+			current.count(rows = len(frame))
+			profiling.progress_bar(index + 1, len(filenames))
+	logger.info("Done")
+	return frames
@@ -0,0 +1,217 @@
+# Generates the SWAN wind input for a long hindcast, e.g. several years, on every core.
+# The time range is split into chunks of hours and each chunk is interpolated and formatted by a worker process into its own
+# chunk file, written under a temporary name and renamed once complete. When every chunk is done the chunk files are
+# concatenated in time order into the final SWAN file, or into one file per year or month with --split.
+#
+# The chunk files and a manifest of the run settings are kept in a checkpoint folder next to the output, <output>.chunks.
+# An interrupted run started again with the same settings only computes the chunks that are not there yet.
+# The checkpoint folder is removed once the output is written, unless --keep-chunks is given.
+#
+# The output is the same as appending every hour read from the archive cube with wind_analysis.generate_SWAN_input().
+# Station files are read into an in memory cube first as wind_service.py does, so stations without a reading for an hour are left out.
+#
+# Usage example e.g.
+#
+#   python3.6 swan_hindcast.py --start "1995-01-01 00:00" --end "2004-12-31 23:00" strait_of_georgia.cube
+#   python3.6 swan_hindcast.py --start "2000-01-01 00:00" --end "2001-12-31 23:00" --split month --processes 8 Ballenas_Island_1020590 Comox_A_1021830
+
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+import argparse, json, logging, os, shutil, sys, tempfile
+import os.path as path
+import profiling
+import interpolators
+import wind_analysis
+from archive_cube import open_cube, open_stations, get_cube_path, get_vector_data
+from station_loader import get_processed_directory
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the layout of the checkpoint folder or the interpolation changes, older checkpoints are started over
+HINDCAST_VERSION = 2
+TIME_FORMAT = '%Y-%m-%d %H:%M'
+# The suffix of each output file when the hindcast is split into one file per period
+SPLIT_FORMATS = {'none': None, 'year': '%Y', 'month': '%Y%m'}
+
+# Everything a worker process needs to format its chunks, set once per process by init_worker()
+worker_state = {}
+
+# Returns the cube header and data of the stations. filenames is either a single .cube file, which each worker opens
+# as its own memory map, or a list of processed station files that are loaded once here and handed to the workers
+def load_source(filenames):
+
+	cube_path = get_cube_path(filenames)
+	if(cube_path is not None):
+		return cube_path, None
+	return open_stations(filenames)
+
+# Pool initializer, opens the stations and computes the SWAN grid and its interpolation weights once per worker.
+# The weights can be passed in when they were computed ahead, as hindcast_queue.py does. With an interpolator spec the worker
+# uses that engine of interpolators.py instead, which works out its weights once for each set of reporting stations
+def init_worker(source, cube, weights = None, interpolator = None):
+
+	if(cube is None):
+		header, cube = open_cube(source)
+	else:
+		header = source
+	points = wind_analysis.generate_grid_coords(wind_analysis.SWAN_GRID)
+	worker_state['header'] = header
+	worker_state['cube'] = cube
+	worker_state['points'] = points
+	if(interpolator is not None):
+		worker_state['weights'] = interpolators.create_interpolator(points, interpolator)
+	else:
+		worker_state['weights'] = wind_analysis.generate_idw_weights(points) if weights is None else weights
+
+# Splits the hours from start to end inclusive into chunks of at most chunk_hours that never cross a year or a month
+# when the output is split by year or month. Returns (output suffix, first hour, number of hours) for each chunk in time order
+def plan_chunks(start, end, chunk_hours, split):
+
+	times = pd.date_range(start, end, freq = 'h')
+	if(SPLIT_FORMATS[split] is None):
+		suffixes = np.full(len(times), '', dtype = object)
+	else:
+		suffixes = np.asarray(times.strftime('_' + SPLIT_FORMATS[split]), dtype = object)
+	chunks = []
+	period_starts = np.concatenate(([0], np.flatnonzero(suffixes[1:] != suffixes[:-1]) + 1, [len(times)]))
+	for period_start, period_end in zip(period_starts[:-1], period_starts[1:]):
+		for chunk_start in range(period_start, period_end, chunk_hours):
+			chunks.append((suffixes[chunk_start], times[chunk_start], min(chunk_hours, period_end - chunk_start)))
+	return chunks
+
+# Returns the path of the checkpoint folder of an output
+def get_checkpoint_directory(output):
+	return output + '.chunks'
+
+# Returns the path of the file holding a chunk, named after its first hour
+def get_chunk_path(checkpoint_directory, first_hour):
+	return path.join(checkpoint_directory, 'chunk_%s.swan' % first_hour.strftime('%Y%m%d%H'))
+
+# Pool worker, writes the SWAN blocks of every hour of a chunk to its chunk file.
+# The blocks are written to a temporary file of a unique name first, so a chunk file only ever exists once it is complete,
+# even when two workers of hindcast_queue.py format the same chunk
+def compute_chunk(task):
+
+	chunk_path, first_hour, hours = task
+	blocks = []
+	for time in pd.date_range(first_hour, periods = hours, freq = 'h').strftime(TIME_FORMAT):
+		vector_data = get_vector_data(worker_state['header'], worker_state['cube'], time)
+		x_components, y_components, covered = wind_analysis.interpolate_wind_components(worker_state['weights'], vector_data)
+		blocks.append(wind_analysis.format_SWAN_block(worker_state['points'], x_components, y_components, covered, time))
+	descriptor, temporary_path = tempfile.mkstemp(dir = path.dirname(chunk_path), prefix = path.basename(chunk_path) + '.', suffix = '.tmp')
+	with os.fdopen(descriptor, 'w') as f:
+		f.write('\n'.join(blocks))
+	os.replace(temporary_path, chunk_path)
+	return chunk_path, hours
+
+# Returns the settings a checkpoint was made with. A checkpoint is only resumed when they are unchanged,
+# including the modification times of the station files
+def get_manifest(filenames, start, end, chunk_hours, split, interpolator = None):
+	return {
+		'version': HINDCAST_VERSION,
+		'start': start,
+		'end': end,
+		'chunk_hours': chunk_hours,
+		'split': split,
+		'interpolator': None if interpolator is None else interpolators.get_spec_name(*interpolators.parse_spec(interpolator)),
+		'sources': [[filename, os.stat(get_processed_directory() + filename).st_mtime_ns] for filename in filenames],
+	}
+
+# Prepares the checkpoint folder of a run. Chunk files are kept when the folder was made with the same settings,
+# otherwise the folder is emptied. Returns the paths of the chunk files already finished
+def open_checkpoint(checkpoint_directory, manifest):
+
+	manifest_path = path.join(checkpoint_directory, 'hindcast.json')
+	if(path.isfile(manifest_path)):
+		with open(manifest_path) as f:
+			if(json.load(f) == manifest):
+				return set(path.join(checkpoint_directory, name) for name in os.listdir(checkpoint_directory) if name.endswith('.swan'))
+		logger.warning("The checkpoint in %s was made with other settings, starting over.", checkpoint_directory)
+	shutil.rmtree(checkpoint_directory, ignore_errors = True)
+	os.makedirs(checkpoint_directory)
+	with open(manifest_path, 'w') as f:
+		json.dump(manifest, f, indent = 2)
+	return set()
+
+# Concatenates the chunk files in time order into one output file per suffix, with a new line between chunks
+# as between the hours of a chunk. Each output is written under a temporary name and renamed once complete.
+# Returns the paths of the output files
+def merge_chunks(output, chunks, checkpoint_directory):
+
+	outputs = []
+	for suffix, first_hour, hours in chunks:
+		if(not outputs or outputs[-1][0] != suffix):
+			outputs.append((suffix, []))
+		outputs[-1][1].append(get_chunk_path(checkpoint_directory, first_hour))
+
+	written = []
+	for suffix, chunk_paths in outputs:
+		with open(output + suffix + '.tmp', 'w') as f:
+			for index, chunk_path in enumerate(chunk_paths):
+				if(index > 0):
+					f.write('\n')
+				with open(chunk_path) as chunk:
+					shutil.copyfileobj(chunk, f)
+		os.replace(output + suffix + '.tmp', output + suffix)
+		written.append(output + suffix)
+	return written
+
+# Computes every chunk that is not checkpointed yet in a process pool, then merges the chunks into the output files.
+# Returns the paths of the output files
+def run_hindcast(filenames, start, end, output, chunk_hours, split, processes, keep_chunks, interpolator = None):
+
+	chunks = plan_chunks(start, end, chunk_hours, split)
+	checkpoint_directory = get_checkpoint_directory(output)
+	finished = open_checkpoint(checkpoint_directory, get_manifest(filenames, start, end, chunk_hours, split, interpolator))
+	tasks = [(get_chunk_path(checkpoint_directory, first_hour), first_hour, hours) for suffix, first_hour, hours in chunks]
+	tasks = [task for task in tasks if task[0] not in finished]
+	logger.info("Hindcast from %s to %s in %d chunks, %d already finished ...", start, end, len(chunks), len(chunks) - len(tasks))
+
+	if(tasks):
+		source, cube = load_source(filenames)
+		with profiling.stage('hindcast_chunks') as current, Pool(processes, initializer = init_worker, initargs = (source, cube, None, interpolator)) as pool:
+			for index, (chunk_path, hours) in enumerate(pool.imap_unordered(compute_chunk, tasks)):
+				current.count(rows = hours, bytes_written = profiling.file_size(chunk_path))
+				profiling.progress_bar(index + 1, len(tasks))
+
+	with profiling.stage('merge_chunks') as current:
+		written = merge_chunks(output, chunks, checkpoint_directory)
+		current.count(bytes_written = sum(profiling.file_size(filename) for filename in written))
+	if(not keep_chunks):
+		shutil.rmtree(checkpoint_directory)
+	return written
+
+# The main function handles higher level program logic
+def main(argv):
+
+	argv = profiling.setup(argv)
+	parser = argparse.ArgumentParser(description = "Generate the SWAN wind input over a long time range in parallel, with checkpoints.")
+	parser.add_argument('filenames', nargs = '+', help = "a .cube file or processed wind station files in data/processed")
+	parser.add_argument('--start', required = True, help = "first hour, YYYY-MM-DD hh:mm")
+	parser.add_argument('--end', required = True, help = "last hour (inclusive), YYYY-MM-DD hh:mm")
+	parser.add_argument('--chunk-hours', type = int, default = 24 * 7, help = "hours computed by a worker at a time")
+	parser.add_argument('--split', choices = list(SPLIT_FORMATS), default = 'none', help = "write a single file, or one file per year or month")
+	parser.add_argument('--processes', type = int, default = None, help = "number of worker processes, defaults to the number of CPUs")
+	parser.add_argument('--output', default = None, help = "path of the SWAN file, defaults to results/swan_hindcast. With --split the period is appended")
+	parser.add_argument('--keep-chunks', action = 'store_true', help = "keep the checkpoint folder after the output is written")
+	parser.add_argument('--interpolator', default = None, help = "interpolation engine and options, e.g. kriging:model=spherical,range=60 (see interpolators.py), defaults to IDW")
+	args = parser.parse_args(argv[1:])
+
+	start = pd.Timestamp(args.start).strftime(TIME_FORMAT)
+	end = pd.Timestamp(args.end).strftime(TIME_FORMAT)
+	if(pd.Timestamp(end) < pd.Timestamp(start) or args.chunk_hours < 1):
+		parser.error("the end must not be before the start and chunks need at least one hour")
+	if(args.interpolator is not None):
+		try:
+			interpolators.parse_spec(args.interpolator)
+		except ValueError as error:
+			parser.error(str(error))
+	output = path.abspath(args.output) if args.output else path.abspath(path.join(__file__ ,"../..")) + "/results/swan_hindcast"
+
+	written = run_hindcast(args.filenames, start, end, output, args.chunk_hours, args.split, args.processes, args.keep_chunks, args.interpolator)
+	logger.info("Wrote %s", '\n      '.join(written))
+	sys.exit(0)
+
+if __name__ == "__main__":
+	main(sys.argv)
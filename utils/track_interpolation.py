@@ -0,0 +1,142 @@
+# Interpolates the station winds at arbitrary points, e.g. along vessel tracks or at proposed sensor sites, with the same
+# interpolation engines and cutoff as the SWAN grid in wind_analysis.py, inverse distance weights by default. As there, the X and Y
+# components are interpolated, by the same wind_analysis.interpolate_station_winds().
+#
+# Every sample is a (lat, lon, time). The distances from the samples to every station are computed in one vectorized call per batch
+# of samples, and the samples are grouped by hour so the station readings of each hour are looked up once and the samples of
+# that hour are weighed together. There is no Python call per sample. Each sample uses the readings of the nearest hour,
+# a time half way between two hours taking the later one, whether it is given for every sample or with --time.
+#
+# Usage example e.g.
+#
+#   python3.6 track_interpolation.py --samples vessel_track.csv --output vessel_track_winds.csv strait_of_georgia.cube
+#   python3.6 track_interpolation.py --samples sensor_sites.csv --time "2000-12-14 21:00" --output sensor_winds.csv Ballenas_Island_1020590 Comox_A_1021830
+#   python3.6 track_interpolation.py --samples vessel_track.csv --interpolator kriging:model=spherical,range=60 --output vessel_track_winds.csv strait_of_georgia.cube
+#
+# The samples file has a lat and a lon column, and a time column unless --time is given. The output has the samples
+# with their wind speed (km/h), wind direction (10s of degrees), the X and Y components (knots) and whether any station was within the cutoff.
+
+import numpy as np
+import pandas as pd
+import argparse, logging, sys
+import profiling
+import wind_analysis
+import interpolators
+from archive_cube import open_stations
+from station_loader import SPEED_COLUMN, DIRECTION_COLUMN
+
+logger = logging.getLogger(__name__)
+
+# Samples interpolated at a time, which bounds the (samples x stations) arrays held in memory
+SAMPLE_BATCH_SIZE = 100000
+
+# Returns the readings of every hour at positions in the cube ordered like the globally declared station lists of wind_analysis.py:
+# speed and direction arrays of shape (hours x stations), NaN where the reading is missing, and a mask of the stations that reported.
+# These are the arrays wind_analysis.get_station_arrays() returns for the readings of each hour, the first reading winning
+# when several files map to the same station name. Hours outside the cube have no readings
+def get_station_readings(header, cube, positions):
+
+	station_count = len(wind_analysis.station_names)
+	speeds = np.full((len(positions), station_count), np.nan)
+	directions = np.full((len(positions), station_count), np.nan)
+	reported = np.zeros((len(positions), station_count), dtype = bool)
+	inside = np.flatnonzero((positions >= 0) & (positions < header['hours']))
+	hours = np.asarray(cube[positions[inside]], dtype = float)
+	speed_index = header['variables'].index(SPEED_COLUMN)
+	direction_index = header['variables'].index(DIRECTION_COLUMN)
+
+	for cube_index, filename in enumerate(header['stations']):
+		name = wind_analysis.get_data_from_vector([(filename, None, None)])[0][0]
+		if(name not in wind_analysis.station_names):
+			continue
+		index = wind_analysis.station_names.index(name)
+		station_speeds, station_directions = hours[:, cube_index, speed_index], hours[:, cube_index, direction_index]
+		# A station reports an hour when it has either reading, as in archive_cube.get_vector_data()
+		take = ~(np.isnan(station_speeds) & np.isnan(station_directions)) & ~reported[inside, index]
+		rows = inside[take]
+		speeds[rows, index] = station_speeds[take]
+		directions[rows, index] = station_directions[take]
+		reported[rows, index] = True
+	return speeds, directions, reported
+
+# Returns the position in the cube of the nearest hour of every time, a time half way between two hours taking the later one
+def get_hour_positions(header, times):
+	origin = pd.Timestamp(header['time_origin'])
+	hours = (pd.DatetimeIndex(times) - origin) / pd.Timedelta(hours = header['time_step_hours'])
+	return np.floor(np.asarray(hours, dtype = float) + 0.5).astype(int)
+
+# Interpolates one batch of samples with the interpolator of its points, hour_positions holding the cube position of each sample
+def interpolate_batch(header, cube, interpolator, hour_positions):
+
+	# Look the readings of each hour up once, then interpolate the samples of that hour together
+	unique_positions, sample_hours = np.unique(hour_positions, return_inverse = True)
+	speeds, directions, reported = get_station_readings(header, cube, unique_positions)
+	order = np.argsort(sample_hours, kind = 'stable')
+	bounds = np.searchsorted(sample_hours[order], np.arange(len(unique_positions) + 1))
+	x_components, y_components = np.zeros(len(hour_positions)), np.zeros(len(hour_positions))
+	covered = np.zeros(len(hour_positions), dtype = bool)
+	for hour in range(len(unique_positions)):
+		rows = order[bounds[hour]:bounds[hour + 1]]
+		x_components[rows], y_components[rows], covered[rows] = wind_analysis.interpolate_station_winds(interpolator,
+			speeds[hour], directions[hour], reported[hour], rows)
+	return x_components, y_components, covered
+
+# Interpolates the wind at every (lat, lon, time) sample. times is a single time for every sample or one time per sample,
+# both rounded to the nearest hour by get_hour_positions(). spec is an interpolation engine of interpolators.py, IDW within 40 km by default.
+# Returns the X and Y components (knots) and a mask of the samples that had a station within the cutoff.
+# Samples without a station within the cutoff, or outside the hours of the stations, get 0 like the grid points in the SWAN input
+def interpolate_samples(header, cube, sample_lats, sample_lons, times, spec = 'idw'):
+
+	sample_lats = np.asarray(sample_lats, dtype = float).reshape(-1)
+	sample_lons = np.asarray(sample_lons, dtype = float).reshape(-1)
+	if(np.ndim(times) == 0):
+		hour_positions = np.full(len(sample_lats), get_hour_positions(header, [pd.Timestamp(times)])[0], dtype = int)
+	else:
+		hour_positions = get_hour_positions(header, times)
+
+	x_components, y_components = np.zeros(len(sample_lats)), np.zeros(len(sample_lats))
+	covered = np.zeros(len(sample_lats), dtype = bool)
+	with profiling.stage('interpolate_samples') as current:
+		for start in range(0, len(sample_lats), SAMPLE_BATCH_SIZE):
+			batch = slice(start, start + SAMPLE_BATCH_SIZE)
+			interpolator = interpolators.create_interpolator(np.column_stack((sample_lats[batch], sample_lons[batch])), spec)
+			x_components[batch], y_components[batch], covered[batch] = interpolate_batch(header, cube, interpolator, hour_positions[batch])
+		current.count(points = len(sample_lats))
+	return x_components, y_components, covered
+
+# The main function handles higher level program logic
+def main(argv):
+
+	argv = profiling.setup(argv)
+	parser = argparse.ArgumentParser(description = "Interpolate the station winds at the points and times of a csv file.")
+	parser.add_argument('filenames', nargs = '+', help = "a .cube file or processed wind station files in data/processed")
+	parser.add_argument('--samples', required = True, help = "csv file with lat, lon and time columns")
+	parser.add_argument('--time', default = None, help = "time of every sample when the file has no time column, YYYY-MM-DD hh:mm")
+	parser.add_argument('--cutoff', type = float, default = 40, help = "stations further than this many kilometres are left out by the default IDW")
+	parser.add_argument('--interpolator', default = None, help = "interpolation engine and options, e.g. kriging:model=spherical,range=60 (see interpolators.py), with its own cutoff")
+	parser.add_argument('--output', required = True, help = "csv file the samples and their winds are written to")
+	args = parser.parse_args(argv[1:])
+
+	samples = pd.read_csv(args.samples)
+	if(args.time is None and 'time' not in samples):
+		parser.error("the samples file has no time column, give the time of every sample with --time")
+	spec = args.interpolator if args.interpolator is not None else 'idw:cutoff=%g' % args.cutoff
+	try:
+		method, options = interpolators.parse_spec(spec)
+	except ValueError as error:
+		parser.error(str(error))
+	times = args.time if args.time is not None else pd.to_datetime(samples['time'])
+	header, cube = open_stations(args.filenames)
+	x_components, y_components, covered = interpolate_samples(header, cube, samples['lat'], samples['lon'], times, spec)
+	speeds, directions = wind_analysis.get_speeds_and_directions(x_components, y_components)
+	samples['wind_speed'] = np.where(covered, speeds, 0)
+	samples['wind_direction'] = np.where(covered, directions, 0)
+	samples['wind_x'] = x_components
+	samples['wind_y'] = y_components
+	samples['covered'] = covered
+	samples.to_csv(args.output, index = False)
+	logger.info("Interpolated %d samples, %d within %g km of a station. Wrote %s", len(samples), covered.sum(), options['cutoff'], args.output)
+	sys.exit(0)
+
+if __name__ == "__main__":
+	main(sys.argv)
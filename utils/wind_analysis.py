@@ -6,16 +6,22 @@
 # Store the data for a certain date (or date range) in a pandas dataframe that could then be plotted onto
 # a map using a Basemap. A simpler version could be attempted where we overlay the graphs of multiple
 # stations on the same plot.
+#
+# matplotlib and Basemap are only imported by the plotting functions, so writing the SWAN input
+# (and importing this module from wind_service.py or a batch job) does not pay for loading them.
 
 from collections import OrderedDict
 from datetime import datetime, date, timedelta
-from mpl_toolkits.basemap import Basemap, cm
-import matplotlib.pyplot as plt
 import os.path as path
 import datetime as dt
 import numpy as np
 import pandas as pd
-import sys, os, shutil
+import sys, os, shutil, logging
+import profiling
+from archive_cube import open_stations, get_cube_path, get_vector_data, get_fill_gaps_argument, fill_gaps
+from station_loader import load_files, SPEED_COLUMN, DIRECTION_COLUMN
+
+logger = logging.getLogger(__name__)
 
 
 # Globally declared lists containing station location data
@@ -48,6 +54,10 @@ station_names = ['BALLENAS ISLAND', 'CAMPBELL RIVER A', 'CAPE MUDGE CS', 'CHROME
 'VICTORIA HARBOUR A', 'RACE ROCKS', 'TOFINO A', 'SHERINGHAM POINT', 'ESQUIMALT HARBOUR', 'HALIBUT BANK BUOY',
 'SENTRY SHOAL BUOY', 'MALAHAT', 'HOWE SOUND PAM ROCKS', 'SQUAMISH AIRPORT', 'PORT ALBERNI AUT', 'AMPHITRITE POINT', 'ESTEVAN POINT CS']
 
+# The grid the SWAN input is written on: start lat, start lon, end lat, end lon (exclusive) and resolution in degrees.
+# Every tool building the SWAN grid builds it from this one, so their fields and weights always line up
+SWAN_GRID = {'start_lat': 48.5, 'start_lon': -125.5, 'end_lat': 50.3125, 'end_lon': -121.9375, 'resolution': 0.0625}
+
 # ------------------------------------------------------------------------------------------------
 
 # A helper function that calculates the distance between given lat/long pairs taking into account
@@ -111,7 +121,7 @@ def create_station_dict():
 	station_locations = {}
 	for index, station in enumerate(station_names):
 		station_locations[station] = (lats[index], lons[index])
-	print(station_locations)
+	logger.debug("%s", station_locations)
 	return station_locations
 
 # A helper function that takes time in YYYY-MM-DD hh:mm and returns YYYYMMHH.hhmmss
@@ -120,112 +130,125 @@ def convert_time_to_ISO(time):
 	iso_time = iso_time + "00"
 	return iso_time
 
+# Returns a (points x stations) matrix of the great circle distances in kilometres from every point
+# to every station in the globally declared lists, computed in a single vectorized call
+def generate_distance_matrix(points):
+	points = np.asarray(points, dtype = float).reshape(-1, 2)
+	return great_circle_distance(np.asarray(lats)[np.newaxis, :], np.asarray(lons)[np.newaxis, :], points[:, 0:1], points[:, 1:2]) / 1000
+
+# Returns the (points x stations) inverse distance squared weights used by the interpolation.
+# Stations further than cutoff kilometres from a point get a weight of 0
+def generate_idw_weights(points, cutoff = 40):
+	distances = generate_distance_matrix(points)
+	with np.errstate(divide = 'ignore'):
+		return np.where(distances <= cutoff, 1 / distances**2, 0)
+
+# Orders the readings in vector_data like the globally declared station lists.
+# Returns speed and direction arrays, NaN where the reading is missing, and a mask of the stations that reported.
+# As before, the first reading wins when several files map to the same station name.
+def get_station_arrays(vector_data):
+	speeds = np.full(len(station_names), np.nan)
+	directions = np.full(len(station_names), np.nan)
+	reported = np.zeros(len(station_names), dtype = bool)
+	for name, wind_speed, wind_direction in get_data_from_vector(vector_data):
+		if(name in station_names):
+			index = station_names.index(name)
+			if(not reported[index]):
+				speeds[index], directions[index], reported[index] = wind_speed, wind_direction, True
+	return speeds, directions, reported
+
+# Converts wind speeds in km/h and directions in 10s of degrees to the X and Y components in knots that SWAN reads
+def get_wind_components(wind_speeds, wind_directions):
+	x_components = 0.539957 * wind_speeds * np.cos(np.deg2rad(-wind_directions * 10) - np.pi/2)
+	y_components = 0.539957 * wind_speeds * np.sin(np.deg2rad(-wind_directions * 10) - np.pi/2)
+	return x_components, y_components
+
+# Returns the wind speeds in km/h and directions in 10s of degrees (from 0 to 36) of X and Y components in knots,
+# the inverse of get_wind_components()
+def get_speeds_and_directions(x_components, y_components):
+	speeds = np.hypot(x_components, y_components) / 0.539957
+	directions = np.mod(-(np.rad2deg(np.arctan2(y_components, x_components)) + 90) / 10, 36)
+	return speeds, directions
+
+# Returns the weighted means of station_values, one or more values per reporting station, for the (points x reporting stations) weights
+# and their sums. Missing values add nothing to the weighted sums and points that are not covered get 0.
+# Used with the IDW weights here and with the weights of every engine of interpolators.py
+def apply_station_weights(weights, weight_sums, covered, station_values):
+	station_values = np.asarray(station_values)
+	shape = (-1,) + (1,) * (station_values.ndim - 1)
+	with np.errstate(invalid = 'ignore', divide = 'ignore'):
+		return np.where(covered.reshape(shape), weights.dot(np.nan_to_num(station_values)) / weight_sums.reshape(shape), 0)
+
+# Interpolates the readings in vector_data onto the points the weights were generated for.
+# The readings are converted to X and Y components once per station and both components are interpolated with the same weights,
+# so directions either side of north average to north instead of south, and no trigonometry is done per point.
+# Every station that reported within the cutoff counts towards the weight sum, missing values add nothing to the weighted sums.
+# weights is either the matrix of generate_idw_weights() or an interpolator of interpolators.create_interpolator() for another engine.
+# Returns the X and Y components in knots and a mask of the points that had at least one station within the cutoff
+def interpolate_wind_components(weights, vector_data):
+	speeds, directions, reported = get_station_arrays(vector_data)
+	return interpolate_station_winds(weights, speeds, directions, reported)
+
+# Does the interpolation of interpolate_wind_components() for station arrays as returned by get_station_arrays().
+# With rows only those points of the weights are interpolated
+def interpolate_station_winds(weights, speeds, directions, reported, rows = None):
+	station_x_components, station_y_components = get_wind_components(speeds[reported], directions[reported])
+	station_values = np.column_stack((station_x_components, station_y_components))
+	if(isinstance(weights, dict)):
+		import interpolators
+		components, covered = interpolators.interpolate(weights, station_values, reported, rows)
+	else:
+		station_weights = weights[:, reported] if rows is None else weights[np.ix_(rows, reported)]
+		inverse_distance_sum = station_weights.sum(axis = 1)
+		covered = inverse_distance_sum > 0
+		components = apply_station_weights(station_weights, inverse_distance_sum, covered, station_values)
+	return components[:, 0], components[:, 1], covered
+
+# Returns the text of one SWAN time step: the ISO time followed by the WIND_X and WIND_Y blocks,
+# one row of x_dimension tab separated values per grid latitude. Points without data are written as 0
+def format_SWAN_block(points, x_components, y_components, covered, time):
+
+	y_dimension = int(np.absolute((points[-1][0] - points[0][0])/0.0625)) + 1
+	x_dimension = int(np.absolute((points[-1][1] - points[0][1])/0.0625)) + 1
+	logger.debug("Y DIM: %s", y_dimension)
+	logger.debug("X DIM: %s", x_dimension)
+	logger.debug("%s %s %s", len(x_components), len(y_components), len(points))
+
+	block = [convert_time_to_ISO(time)]
+	for name, components in (("WIND_X", x_components), ("WIND_Y", y_components)):
+		values = [str(value) if point_covered else '0' for value, point_covered in zip(np.round(components, 2).tolist(), covered.tolist())]
+		rows = ['\t'.join(values[i:i + x_dimension]) + '\t' for i in range(0, len(values), x_dimension)]
+		block.append(name)
+		block.append('\n'.join(rows))
+	return '\n'.join(block)
+
 # opens a file and writes wind X-comps and wind Y-comps to a text file in the format that SWAN can read
-def generate_SWAN_input(points, vector_data, time):
+# weights can be generated once with generate_idw_weights(points) and reused for every time step
+def generate_SWAN_input(points, vector_data, time, weights = None):
+
+	logger.info("Formatting data for SWAN for time %s ...", time)
+	if(weights is None):
+		weights = generate_idw_weights(points)
+	# Interpolation here: Calculate the wind X and Y components for every unknown location at once
+	x_components, y_components, covered = interpolate_wind_components(weights, vector_data)
+	block = format_SWAN_block(points, x_components, y_components, covered, time)
 
-	print("\nFormatting data for SWAN for time %s ..." % (time))
-	x_components = []
-	y_components = []
 	filename = "swan_input_data"
 	with open(filename, "a") as f:
-		# get the ISO time from the input time
-		iso_time = convert_time_to_ISO(time)
 		# Check if the file is empty
 		if(os.stat(filename).st_size != 0):
 			# if not empty, write a new line before appending a new time step
-			f.write('\n' + iso_time)
+			f.write('\n' + block)
 		else:
 			# if it is empty, then start writing at the top of the file
-			f.write(iso_time)
-
-		# Find the distance from all the stations to that point
-		data = get_data_from_vector(vector_data)
-
-		iterator = 0
-		for item in points:
-			#print(item)
-			point_lat = item[0]
-			point_long = item[1]
-			point_wind_speed = 0
-			point_wind_direction = 0
-			inverse_distance_sum = 0
-			data_with_distances = []
-			distances_from_stations_to_point = []
-
-			# Compute the distances
-			for i in range(0, len(station_names)):
-				distance = great_circle_distance(lats[i], lons[i], point_lat, point_long)
-				distances_from_stations_to_point.append((station_names[i], round(distance, 2)))
-
-			#print(distances_from_stations_to_point)
-			# Combine both lists to get the items that we need
-			# It would be possible to add a distance restriction in this loop here
-			for item in distances_from_stations_to_point:
-				#print(item)
-				for item2 in data:
-					if(item[0] == item2[0]):
-						# Convert metres to kilometres before appending
-						data_with_distances.append((item2[0], item2[1], item2[2], (item[1]/1000)))
-						break
-
-			# Interpolation here: Calculate point wind speed and wind direction for a given unknown location
-			temp1 = 0.0
-			temp2 = 0.0
-			for item in data_with_distances:
-				# Get the sum of the inverse distance squared for each point
-				# If the distance is less than 70kms, include the point
-				if(item[3] <= 40):
-					inverse_distance_sum += (1 / (item[3])**2)
-				else:
-					pass
-			for item in data_with_distances:
-				# If the distance is less than 70kms, include the point
-				if(item[3] <= 40):
-					if(not np.isnan(item[1])):
-						temp1 = (item[1] / (item[3])**2)
-						point_wind_speed = point_wind_speed + temp1
-						#print("wind spd: %s" % str(point_wind_speed))
-					if(not np.isnan(item[2])):
-						temp2 = (item[2] / (item[3])**2)
-						point_wind_direction = point_wind_direction + temp2
-						#print("wind dir: %s" % str(point_wind_direction))
-				else:
-					pass
-			try:
-				#print(point_wind_speed/inverse_distance_sum, point_wind_direction/inverse_distance_sum)
-				point_wind_speed = (point_wind_speed/inverse_distance_sum)
-				point_wind_direction = (point_wind_direction/inverse_distance_sum)
-				x_components.append(0.539957 * point_wind_speed * np.cos(np.deg2rad(-point_wind_direction * 10) - np.pi/2))
-				y_components.append(0.539957 * point_wind_speed * np.sin(np.deg2rad(-point_wind_direction * 10) - np.pi/2))
-			except ZeroDivisionError as e:
-				point_wind_speed = 0
-				point_wind_direction = 0
-				x_components.append(0)
-				y_components.append(0)
-			iterator += 1
-
-		y_dimension = int(np.absolute((points[-1][0] - points[0][0])/0.0625)) + 1
-		x_dimension = int(np.absolute((points[-1][1] - points[0][1])/0.0625)) + 1
-		print("Y DIM: %s" % y_dimension)
-		print("X DIM: %s" % x_dimension)
-		print(len(x_components), len(y_components), len(points))
-		f.write("\nWIND_X\n")
-		for i, x in enumerate(x_components):
-			val = round(x, 2)
-			if(i % x_dimension == 0 and i != 0):
-				f.write('\n')
-			f.write(str(val) + '\t')
-		f.write("\nWIND_Y\n")
-		for i, y in enumerate(y_components):
-			val = round(y, 2)
-			if(i % x_dimension == 0 and i != 0):
-				f.write('\n')
-			f.write(str(val) + '\t')
-	print("Done\n")
+			f.write(block)
+	logger.info("Done")
 
 # A function that generates an inverse distance weighted interpolation on a given list of input points
-def idw_interpolation(points, vector_data, time, projection):
+# weights can be generated once with generate_idw_weights(points) and reused for every time step
+def idw_interpolation(points, vector_data, time, projection, weights = None):
 
+	import matplotlib.pyplot as plt
 	fig = plt.figure()
 	fig = plt.figure(figsize = (11, 8))
 	plt.title('Vancouver Island : Hourly Wind Data IDW Interpolation for %s' % (time))
@@ -238,80 +261,16 @@ def idw_interpolation(points, vector_data, time, projection):
 	projection.drawparallels(np.arange(frame_lat[0],frame_lat[1],0.5),labels = [1,0,0,0], color = 'white')
 	projection.drawmeridians(np.arange(frame_lon[0],frame_lon[1],0.5),labels = [0,0,0,1], color = 'white')
 
-	# Format the vector data into a more manageable format
-	data = get_data_from_vector(vector_data)
+	logger.info("Computing inverse distance weighted wind speed interpolation for each coordinate provided ...")
+	if(weights is None):
+		weights = generate_idw_weights(points)
+	# Interpolate: Calculate the wind X and Y components for every unknown location at once
+	x_components, y_components, covered = interpolate_wind_components(weights, vector_data)
+	# Points without a station within the cutoff get no barb
+	points = np.asarray(points)[covered]
+	projection.barbs(points[:, 1], points[:, 0], x_components[covered], y_components[covered],
+		color = 'w', length = 4, sizes = dict(emptybarb = 0.20, spacing = 0.2, height = 0.25))
 
-	iterator = 0
-	print("\nComputing inverse distance weighted wind speed interpolation for each coordinate provided ...\n")
-	for item in points:
-		point_lat = item[0]
-		point_long = item[1]
-		point_wind_speed = 0
-		point_wind_direction = 0
-		inverse_distance_sum = 0
-		data_with_distances = []
-		distances_from_stations_to_point = []
-
-		progress_bar(iterator, len(points))
-		iterator += 1
-
-		# Find the distance from all the stations to that point
-		for i in range(0, len(station_names)):
-			distance = great_circle_distance(lats[i], lons[i], point_lat, point_long)
-			distances_from_stations_to_point.append((station_names[i], round(distance, 2)))
-
-		# Combine both lists to get the items that we need
-		for item in distances_from_stations_to_point:
-			#print(item)
-			for item2 in data:
-				if(item[0] == item2[0]):
-					# Convert metres to kilometres
-					data_with_distances.append((item2[0], item2[1], item2[2], (item[1]/1000)))
-					break
-		# Remove NaNs from data_with_distances
-		for index, item in enumerate(data_with_distances):
-			if(item[0] is np.nan or item[1] is np.nan):
-				del data_with_distances[index]
-
-		# Interpolate: Calculate point wind speed and wind direction for a given unknown location
-		temp1 = 0.0
-		temp2 = 0.0
-		for item in data_with_distances:
-			# Get the sum of the inverse distance squared for each point
-			# If the distance is less than 70kms, include the point
-			if(item[3] <= 40):
-				inverse_distance_sum += (1 / (item[3])**2)
-			else:
-				pass
-		for item in data_with_distances:
-			# If the distance is less than 70kms, include the point
-			if(item[3] <= 40):
-				if(not np.isnan(item[1])):
-					temp1 = (item[1] / (item[3])**2)
-					point_wind_speed = point_wind_speed + temp1
-					#print("wind spd: %s" % str(point_wind_speed))
-				if(not np.isnan(item[2])):
-					temp2 = (item[2] / (item[3])**2)
-					point_wind_direction = point_wind_direction + temp2
-					#print("wind dir: %s" % str(point_wind_direction))
-			else:
-				pass
-		try:
-			point_wind_speed = (point_wind_speed/inverse_distance_sum)
-			point_wind_direction = (point_wind_direction/inverse_distance_sum)
-			# projection.quiver(point_long, point_lat,
-			#     0.539957 * point_wind_speed * np.cos(np.deg2rad(270 - (point_wind_direction * 10))),
-			#     0.539957 * point_wind_speed * np.sin(np.deg2rad(270 - (point_wind_direction * 10))),
-			#     width = 0.001, headwidth = 2.0, color = 'w')
-			projection.barbs(point_long, point_lat,
-				0.539957 * point_wind_speed * np.cos(np.deg2rad(-point_wind_direction * 10) - np.pi/2),
-				0.539957 * point_wind_speed * np.sin(np.deg2rad(-point_wind_direction * 10) - np.pi/2),
-				color = 'w', length = 4, sizes = dict(emptybarb = 0.20, spacing = 0.2, height = 0.25))
-			point_long, point_lat = projection(point_long, point_lat)
-		except ZeroDivisionError as e:
-			continue
-
-	print("\n")
 	# Save the figure to the local directory 2 levels up
 	root_dir = path.abspath(path.join(__file__ ,"../.."))
 	relative_path = root_dir + "/results/"
@@ -347,93 +306,25 @@ def generate_list_of_coords(start_lat, start_long, end_lat, ent_long, resolution
 	point_longs = np.arange(start_long, ent_long, resolution)
 	return [(lat, long) for lat in point_lats for long in point_longs]
 
-# A helper function to display progress bar while the frames are being read in
-# Useful to show the execution order of the program for the user
-def progress_bar(value, endvalue, bar_length = 25):
-	percent = float(value) / endvalue
-	arrow = '-' * int(round(percent * bar_length)-1) + '>'
-	spaces = ' ' * (bar_length - len(arrow))
-	sys.stdout.write("\rProgress: [{0}] {1}%".format(arrow + spaces, int(round(percent * 100))))
-	sys.stdout.flush()
-
-# Loads an list of HDF5 files into memory. Takes a list of filenames provided by the user,
-# and returns a list of data frames which is passed onto other functions for further processing
-def load_files(filenames):
-	# Set this option to see more columns when printing pandas df for debugging purposes
-	pd.set_option('display.expand_frame_repr', False)
-
-	print("\nLoading data files into the program ...\n")
-	root_dir = path.abspath(path.join(__file__ ,"../.."))
-	relative_path = root_dir + "/data/processed/"
-	frames = []
-	for index, filename in enumerate(filenames):
-		# Search for the files in the data/processed directory
-		temp_path = relative_path + filename
-		frame = pd.read_hdf(temp_path, filename)
-		#print(filename)
-		if((filename != 'Halibut_Bank_Buoy_46146') and (filename != 'Sentry_Shoal_Buoy_46131')):
-			# Get rid of the columns that we will not be using in this analysis
-			try:
-				del frame['Wind Spd Flag'], frame['Visibility (km)'], frame['Visibility Flag'], frame['Hmdx'], frame['Hmdx Flag']
-				del frame['Dew Point Temp (°C)'], frame['Dew Point Temp Flag'], frame['Rel Hum (%)'], frame['Rel Hum Flag']
-				del frame['Weather'], frame['Wind Chill'], frame['Wind Chill Flag'], frame['Year'], frame['Month'], frame['Day'], frame['Time']
-				del frame['Stn Press Flag'], frame['Stn Press (kPa)'], frame['Wind Dir Flag'], frame['Temp Flag'], frame['Temp (°C)']
-				#print(frame)
-			except KeyError as e:
-				# This is a text file DF. Get it into the same format as the Env.Can. df
-				print(e)
-				wind_speeds = frame.loc[((frame['Data Type'] == '070') | (frame['Data Type'] == '076'))]
-				wind_speeds = wind_speeds.rename(columns = {'Data' : 'Wind Spd (km/h)'})
-				wind_directions = frame.loc[((frame['Data Type'] == '156') | (frame['Data Type'] == '069'))]
-				wind_directions = wind_directions.rename(columns = {'Data' : 'Wind Dir (10s deg)'})
-				del wind_directions['Data Type'], wind_directions['climate_id']
-				del wind_speeds['Data Type'], wind_speeds['climate_id']
-				text_file_df = wind_speeds.join(wind_directions, how = 'inner', lsuffix = '_l')
-				frame = text_file_df
-				frame = frame[['Wind Dir (10s deg)','Wind Spd (km/h)']]
-				#print(frame)
-			frames.append((filename, frame))
-			progress_bar(index + 1, len(filenames))
-		else:
-			# The Halibut_Bank_Buoy_46146 and Sentry_Shoal_Buoy_46131 files are already formatted correctly, so simply append them
-			frames.append((filename, frame))
-	print("\nDone\n")
-	return frames
+# Returns the points of a grid such as SWAN_GRID, latitude first, in the order generate_list_of_coords() returns them
+def generate_grid_coords(grid = SWAN_GRID):
+	return generate_list_of_coords(grid['start_lat'], grid['start_lon'], grid['end_lat'], grid['end_lon'], grid['resolution'])
 
 # Generate the needed plot for given stations
 def plot_graphs(list_of_frames, argv, measurement_type):
-	print("\nPlotting graph...")
+	logger.info("Plotting graph...")
 	frames_to_plot = []
+	# Every frame is loaded in the normalized format, so the measurement type only selects the column to plot
+	column = SPEED_COLUMN if measurement_type == '076' else DIRECTION_COLUMN
 	for filename, frame in list_of_frames:
-		dates = []
-		# Convert all the string representations of the date to Python date objects
-		for item in frame.index:
-			# Try to assign a datetime object to item unless it already is a datetime object
-			try:
-				item = dt.datetime.strptime(item, '%Y-%m-%d %H:%M')
-			except TypeError as e:
-				pass
-			dates.append(item)
-		frame.index = dates
-
-		try:
-			# If the file was scraped from the text file, try to get only the data type that you want
-			# The Env. Can. Tables will not have these attributes, hence the try except statement
-			frame = frame.loc[frame['Data Type'] == measurement_type]
-			# Rename the 'Data' column in the frame to the appropriate data label
-			if(measurement_type == '076'):
-				frame.rename(columns = {'Data':'Wind Spd (km/h)'}, inplace = True)
-			elif(measurement_type == '156'):
-				frame.rename(columns = {'Data':'Wind Dir (10s deg)'}, inplace = True)
-		except KeyError as e:
-			continue
-
+		frame = frame[[column]]
 		if(len(frame) == 0):
-			print("One of the provided dataframes is empty. Please check the files that you have input into the program.")
+			logger.error("One of the provided dataframes is empty. Please check the files that you have input into the program.")
 			sys.exit(0)
 
 		frames_to_plot.append(frame)
 
+	import matplotlib.pyplot as plt
 	fig, ax = plt.subplots()
 	count = 1
 	for index, item in enumerate(frames_to_plot):
@@ -457,11 +348,13 @@ def plot_graphs(list_of_frames, argv, measurement_type):
 # and selects the rows that contain the time requested by the calling function.
 def create_time_frame(dataframes, time):
 
-	print("\n\nGetting a time frame for %s ...\n" % (time))
+	logger.info("Getting a time frame for %s ...", time)
 	#print(dataframes)
 
 	time_data = []
 	temp_frames = []
+	# The frames carry a datetime64 index, so look the time up as a Timestamp rather than a string
+	timestamp = pd.Timestamp(time)
 	# Iterate through the dataframes tuples to find rows that have that time as the key
 	for item in dataframes:
 
@@ -471,38 +364,21 @@ def create_time_frame(dataframes, time):
 		# Try to find a data point for the time for each frame
 		try:
 			# Assign a new frame to the resulting rows
-			temp_frame = frame.loc[time]
+			temp_frame = frame.loc[timestamp]
 			temp_frames.append((filename,temp_frame))
 		except KeyError as e:
 			#print(e)
-			print("There is no data in %s.hdf for the provided time." % (filename))
+			logger.warning("There is no data in %s.hdf for the provided time.", filename)
 			pass
 	#print("Temp frames")
 	#print(temp_frames)
-	print("\nParsing for required data...")
+	logger.info("Parsing for required data...")
 	for name, frame in temp_frames:
-		#print("File name: %s" % (name))
-		#print(frame)
-		try:
-			wind_direction = frame.iat[1, 2]
-			wind_speed = frame.iat[0, 2]
-			#print(wind_speed, wind_direction)
-			time_data.append((name, wind_speed, wind_direction))
-			#print('\n')
-			continue
-		except TypeError as e:
-			pass
-			#print(e)
-		try:
-			wind_direction = frame.iloc[0]
-			wind_speed = frame.iloc[1]
-			#print(wind_speed, wind_direction)
-			time_data.append((name, wind_speed, wind_direction))
-			#print('\n')
-		except TypeError as e:
-			pass
-			#print(e)
-	print("\nDone")
+		# A station reporting the same hour twice returns a frame rather than a single row, keep the first reading
+		if(isinstance(frame, pd.DataFrame)):
+			frame = frame.iloc[0]
+		time_data.append((name, frame[SPEED_COLUMN], frame[DIRECTION_COLUMN]))
+	logger.info("Done")
 	return time_data
 
 # This function gets the station coordinates for the files passed into the program
@@ -511,7 +387,7 @@ def create_time_frame(dataframes, time):
 # Performance could later be improved by using a dictionary
 def get_station_coords(dataframes):
 
-	print("\nGetting coordinates for stations...\n")
+	logger.info("Getting coordinates for stations...")
 	available_stations = []
 	stations_with_coords = []
 	for filename, frame in dataframes:
@@ -530,7 +406,7 @@ def get_station_coords(dataframes):
 	for index, station in enumerate(station_names):
 		if(station in available_stations):
 			stations_with_coords.append((station, lats[index], lons[index]))
-		progress_bar(index, len(station_names))
+		profiling.progress_bar(index + 1, len(station_names))
 
 	return stations_with_coords
 
@@ -538,7 +414,8 @@ def get_station_coords(dataframes):
 # projection can then be passed to other functions which can populate it with data
 def create_projection():
 
-	print("Creating a projection centered on southern Vancouver Island ...")
+	from mpl_toolkits.basemap import Basemap
+	logger.info("Creating a projection centered on southern Vancouver Island ...")
 	lat0 = np.mean(lats)
 	lon0 = np.mean(lons)
 	# create stereographic Basemap instance, centered around the area of interest
@@ -547,13 +424,14 @@ def create_projection():
 				urcrnrlon = -122.5, urcrnrlat = 50.25,
 				rsphere = 6378100, resolution = 'f',
 				area_thresh = 0.01, epsg = 4326)
-	print("\nDone")
+	logger.info("Done")
 	return projection
 
 # This function takes a list which for each index contains a station name, the lat and the long for that station
 # as the first argument, a list containing the measurments for each station at that time, the time, and a projection object
 def plot_map(station_coords, vector_data, time, projection):
 
+	import matplotlib.pyplot as plt
 	fig = plt.figure()
 	fig = plt.figure(figsize = (11, 8))
 	plt.title('Vancouver Island : Hourly Wind Data by Station for %s' % (time))
@@ -569,7 +447,7 @@ def plot_map(station_coords, vector_data, time, projection):
 	# Populate the vectors and associate each vector with the correct coordinates
 	data = get_data_from_vector(vector_data)
 
-	print("\nAdding barbs and wind vectors to the map ...")
+	logger.info("Adding barbs and wind vectors to the map ...")
 	for index, item in enumerate(data):
 		curr_station = item[0]
 		curr_wind_speed = item[1]
@@ -609,37 +487,76 @@ def plot_map(station_coords, vector_data, time, projection):
 	#plt.show()
 	# Close the figure after having saved it to free RAM space on the current computer running this script
 	plt.close(fig)
-	print("\n")
 
 # The main function handles higher level program logic
 def main(argv):
 
+	if('--hindcast' in argv):
+		# Long time ranges are split into chunks computed by worker processes, see swan_hindcast.py
+		import swan_hindcast
+		return swan_hindcast.main([argument for argument in argv if argument != '--hindcast'])
+	argv = profiling.setup(argv)
+	# --interpolator=<spec> picks another interpolation engine than the default IDW weights, see interpolators.py
+	import interpolators
+	interpolator_spec, argv = interpolators.get_interpolator_argument(argv)
+	# --fill-gaps[=<hours>] fills the short gaps of every station once over the whole archive, see archive_cube.py
+	max_gap, argv = get_fill_gaps_argument(argv)
 	if(len(argv) < 2):
 		print("Please include the filename(s) as program arguments.\nFiles should contain station data in hdf5 format: Station_Name_123456 where the number is the climate or station ID.")
 		print("Filenames should be entered one at a time and be separated by spaces.\n")
 		sys.exit(0)
 	else:
-		print('\n')
 		# Generate a grid of coordinates to overlay on our map for the interpolation
-		points = generate_list_of_coords(48.5, -125.5, 50.3125, -121.9375, 0.0625)
+		points = generate_grid_coords(SWAN_GRID)
 		# Get a list of hour intervals between the start and end times wanted
 		times = generate_list_of_times("2000-12-14 21:00", "2000-12-15 15:00")
 		# Generate the dict of station distances from one another
 		station_distances = generate_distances()
-		# Load the data in to the program from the hdf5 files
-		dataframes = load_files(argv[1:])
-		# Create a projection for the area of interest
-		projection = create_projection()
+		# The interpolation weights only depend on the grid and the station locations, so compute them once for every hour.
+		# The other engines work out their weights once for each set of reporting stations instead
+		with profiling.stage('generate_idw_weights') as current:
+			if(interpolator_spec is None):
+				weights = generate_idw_weights(points)
+				current.count(points = weights.size)
+			else:
+				weights = interpolators.create_interpolator(points, interpolator_spec)
+				current.count(points = weights['point_distances'].size)
+		cube = None
+		if(get_cube_path(argv[1:]) is not None or max_gap is not None):
+			# Slice the hours straight out of a memory mapped archive cube instead of loading every station file.
+			# Gap filling builds a cube of the station files, then reads each hour from it rather than from the frames
+			header, cube = open_stations(argv[1:])
+			dataframes = [(filename, None) for filename in header['stations']]
+		else:
+			# Load the data in to the program from the hdf5 files
+			dataframes = load_files(argv[1:])
+		if(max_gap is not None):
+			with profiling.stage('fill_gaps') as current:
+				cube, filled = fill_gaps(cube, header['variables'], max_gap)
+				current.count(rows = header['hours'], points = cube.size)
+			logger.info("Filled %d values in gaps of up to %d hours", filled.sum(), max_gap)
 		# Get the station coordinates for the files passed into the program
 		coordinates = get_station_coords(dataframes)
 
 		for time in times:
 			# Get the data from the frames pertaining to certain time wanted
-			vector_data = create_time_frame(dataframes, time)
+			with profiling.stage('create_time_frame') as current:
+				if(cube is not None):
+					vector_data = get_vector_data(header, cube, time)
+				else:
+					vector_data = create_time_frame(dataframes, time)
+				current.count(rows = len(vector_data))
 			# Write the inteprpolated wind data to a text file for SWAN
-			generate_SWAN_input(points, vector_data, time)
+			with profiling.stage('generate_SWAN_input') as current:
+				swan_size = profiling.file_size("swan_input_data")
+				generate_SWAN_input(points, vector_data, time, weights)
+				current.count(points = len(points), bytes_written = profiling.file_size("swan_input_data") - swan_size)
+			# The maps need a projection of the area of interest. Basemap and matplotlib are slow to import, so the projection is
+			# commented out with the maps: uncomment it along with them, it is created on the first hour and reused for the others
+			#if(time == times[0]):
+			#	projection = create_projection()
 			# Generate a map by getting the inverse distance weighed interpolation of the data based on known values
-			#idw_interpolation(points, vector_data, time, projection)
+			#idw_interpolation(points, vector_data, time, projection, weights)
 			# Generate a map with the known wind values at each station
 			#plot_map(coordinates, vector_data, time, projection)
 
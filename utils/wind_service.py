@@ -0,0 +1,239 @@
+# A long running wind field query service.
+# Loads the station data, the interpolation weights and (on the first map request) the Basemap projection once,
+# then answers requests for single hours or ranges of hours over a local HTTP port or a Unix socket,
+# instead of starting a fresh wind_analysis.py process that reloads everything for every request.
+#
+# Usage example e.g.
+#
+#   python3.6 wind_service.py --port 8642 strait_of_georgia.cube
+#   python3.6 wind_service.py --socket /tmp/wind_service.sock Ballenas_Island_1020590 Comox_A_1021830
+#   python3.6 wind_service.py --archive strait_of_georgia.cube
+#
+# With --archive the /field and /swan requests are answered from the field archive of field_archive.py,
+# and the hours that are not in it yet are interpolated once and stored.
+#
+# Requests (times are YYYY-MM-DD hh:mm, end is optional and inclusive):
+#
+#   GET /stations?time=2000-12-14 21:00&end=2000-12-15 03:00    station readings for each hour (JSON)
+#   GET /field?time=2000-12-14 21:00                            interpolated speed, direction and X/Y components on the SWAN grid (JSON)
+#   GET /swan?time=2000-12-14 21:00&end=2000-12-15 03:00        SWAN input blocks for each hour (plain text)
+#   GET /map?time=2000-12-14 21:00                              renders the station map to the results folder and returns its path (JSON)
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+import argparse, json, logging, os, sys, threading
+import profiling
+import wind_analysis
+import field_archive
+from archive_cube import open_stations, get_vector_data, get_cube_position
+from station_loader import SPEED_COLUMN, DIRECTION_COLUMN
+
+logger = logging.getLogger(__name__)
+
+# Everything the service keeps warm between requests
+warm_state = {}
+# Matplotlib and Basemap are not thread safe, so map requests are rendered one at a time
+map_lock = threading.Lock()
+
+# Loads the station cube and precomputes the SWAN grid and its interpolation weights.
+# filenames is either a single .cube file or a list of processed station files.
+# archive is the path of the field archive, '' for the default path, or None to interpolate every request
+def load_state(filenames, max_hours, archive = None):
+
+	warm_state['archive'] = None
+	if(archive is not None):
+		# The archive loads the stations and computes the weights itself, here up front as the service answers the other requests from them too
+		warm_state['archive'] = field_archive.load_archive_stations(field_archive.open_field_archive(filenames, wind_analysis.SWAN_GRID, archive or None))
+		header, cube = warm_state['archive']['header'], warm_state['archive']['cube']
+		points, weights = warm_state['archive']['points'], warm_state['archive']['weights']
+	else:
+		header, cube = open_stations(filenames)
+	if(warm_state['archive'] is None):
+		points = wind_analysis.generate_grid_coords(wind_analysis.SWAN_GRID)
+		weights = wind_analysis.generate_idw_weights(points)
+	warm_state['header'] = header
+	warm_state['cube'] = cube
+	warm_state['points'] = points
+	warm_state['weights'] = weights
+	warm_state['station_coords'] = wind_analysis.get_station_coords([(filename, None) for filename in header['stations']])
+	warm_state['projection'] = None
+	warm_state['max_hours'] = max_hours
+	logger.info("Serving %d stations over %d hours starting %s", len(header['stations']), header['hours'], header['time_origin'])
+
+# Returns the list of hours between time and end (inclusive) in the YYYY-MM-DD hh:mm format used by wind_analysis.py
+def get_requested_times(query):
+
+	if('time' not in query):
+		raise ValueError("A time parameter is required.")
+	start = pd.Timestamp(query['time'][0]).strftime('%Y-%m-%d %H:%M')
+	end = pd.Timestamp(query.get('end', query['time'])[0]).strftime('%Y-%m-%d %H:%M')
+	times = wind_analysis.generate_list_of_times(start, end)
+	if(len(times) == 0):
+		raise ValueError("The end time is before the start time.")
+	if(len(times) > warm_state['max_hours']):
+		raise ValueError("At most %d hours can be requested at once." % (warm_state['max_hours']))
+	return times
+
+# Replaces NaNs with None so the values can be written as JSON
+def to_json_list(values):
+	return [None if np.isnan(value) else value for value in np.asarray(values, dtype = float).tolist()]
+
+# Returns the station readings for each requested hour
+def query_stations(times):
+
+	header, cube = warm_state['header'], warm_state['cube']
+	speed_index = header['variables'].index(SPEED_COLUMN)
+	direction_index = header['variables'].index(DIRECTION_COLUMN)
+	hours = []
+	for time in times:
+		position = get_cube_position(header, time)
+		if(position < 0 or position >= header['hours']):
+			hours.append({'time': time, 'speed': None, 'direction': None})
+			continue
+		hours.append({'time': time, 'speed': to_json_list(cube[position, :, speed_index]),
+			'direction': to_json_list(cube[position, :, direction_index])})
+	return {'stations': header['stations'], 'variables': header['variables'], 'hours': hours}
+
+# Returns the field of one hour from its X and Y components. The components are rounded to the 0.01 knots of the SWAN input,
+# as the field archive stores them, and the speed and direction (from 0 to 36 in 10s of degrees) are worked out from the rounded
+# components, so a field is the same whether it was interpolated for the request or read from the archive. Points that are not covered get 0
+def get_field_hour(time, x_components, y_components, covered):
+	x_components = np.where(covered, np.round(x_components, 2), 0)
+	y_components = np.where(covered, np.round(y_components, 2), 0)
+	speeds, directions = wind_analysis.get_speeds_and_directions(x_components, y_components)
+	return {'time': time, 'speed': np.where(covered, speeds, 0).tolist(), 'direction': np.where(covered, directions, 0).tolist(),
+		'wind_x': x_components.tolist(), 'wind_y': y_components.tolist()}
+
+# Returns the interpolated field on the SWAN grid for each requested hour
+def query_field(times):
+
+	points = np.asarray(warm_state['points'])
+	if(warm_state['archive'] is not None):
+		return query_archived_field(times, points)
+	hours = []
+	for time in times:
+		vector_data = get_vector_data(warm_state['header'], warm_state['cube'], time)
+		hours.append(get_field_hour(time, *wind_analysis.interpolate_wind_components(warm_state['weights'], vector_data)))
+	return {'lats': points[:, 0].tolist(), 'lons': points[:, 1].tolist(), 'hours': hours}
+
+# Returns the field of each requested hour from the field archive, where the points that are not covered are NaN
+def query_archived_field(times, points):
+
+	fields_times, lats, lons, u, v, computed = field_archive.query_fields(warm_state['archive'], times[0], times[-1])
+	hours = []
+	for index, time in enumerate(times):
+		x_components, y_components = u[index].reshape(-1).astype(float), v[index].reshape(-1).astype(float)
+		hours.append(get_field_hour(time, np.nan_to_num(x_components), np.nan_to_num(y_components), ~np.isnan(x_components)))
+	return {'lats': points[:, 0].tolist(), 'lons': points[:, 1].tolist(), 'hours': hours}
+
+# Returns the SWAN input text for the requested hours, in the same format wind_analysis.py appends to swan_input_data
+def query_swan(times):
+
+	if(warm_state['archive'] is not None):
+		return field_archive.query_swan(warm_state['archive'], times[0], times[-1])
+	blocks = []
+	for time in times:
+		vector_data = get_vector_data(warm_state['header'], warm_state['cube'], time)
+		x_components, y_components, covered = wind_analysis.interpolate_wind_components(warm_state['weights'], vector_data)
+		blocks.append(wind_analysis.format_SWAN_block(warm_state['points'], x_components, y_components, covered, time))
+	return '\n'.join(blocks)
+
+# Renders the station map for a single hour to the results folder, creating the projection on the first call
+def query_map(times):
+
+	if(len(times) != 1):
+		raise ValueError("Maps are rendered one hour at a time.")
+	with map_lock:
+		if(warm_state['projection'] is None):
+			warm_state['projection'] = wind_analysis.create_projection()
+		vector_data = get_vector_data(warm_state['header'], warm_state['cube'], times[0])
+		wind_analysis.plot_map(warm_state['station_coords'], vector_data, times[0], warm_state['projection'])
+	root_dir = os.path.abspath(os.path.join(__file__ ,"../.."))
+	return {'time': times[0], 'path': root_dir + "/results/wind_by_station_" + times[0] + '.svg'}
+
+QUERIES = {'/stations': query_stations, '/field': query_field, '/swan': query_swan, '/map': query_map}
+
+# Answers GET requests by dispatching on the path to one of the query functions
+class WindRequestHandler(BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		if(url.path not in QUERIES):
+			self.send_reply(404, 'application/json', json.dumps({'error': "Unknown request %s" % (url.path)}))
+			return
+		try:
+			with profiling.stage('query ' + url.path) as current:
+				times = get_requested_times(parse_qs(url.query))
+				result = QUERIES[url.path](times)
+				current.count(rows = len(times), points = len(times) * len(warm_state['points']))
+		except ValueError as e:
+			self.send_reply(400, 'application/json', json.dumps({'error': str(e)}))
+			return
+		# Any other failure, e.g. a time pandas cannot read or an unreadable archive, still gets a reply
+		except Exception as e:
+			logger.exception("Failed to answer %s", self.path)
+			self.send_reply(500, 'application/json', json.dumps({'error': "%s: %s" % (type(e).__name__, e)}))
+			return
+		if(isinstance(result, str)):
+			self.send_reply(200, 'text/plain', result)
+		else:
+			self.send_reply(200, 'application/json', json.dumps(result))
+
+	def send_reply(self, status, content_type, body):
+		body = body.encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	# Unix socket clients have no address, so log them under the socket name
+	def address_string(self):
+		return self.client_address[0] if self.client_address else 'unix'
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+	daemon_threads = True
+
+# The main function handles higher level program logic
+def main(argv):
+
+	argv = profiling.setup(argv)
+	parser = argparse.ArgumentParser(description = "Serve wind fields, SWAN blocks and station readings from warm caches.")
+	parser.add_argument('filenames', nargs = '+', help = "a .cube file or processed station files in data/processed")
+	parser.add_argument('--port', type = int, default = 8642, help = "local HTTP port to listen on")
+	parser.add_argument('--socket', help = "listen on this Unix socket instead of a port")
+	parser.add_argument('--max-hours', type = int, default = 24 * 31, help = "largest range of hours a single request may ask for")
+	parser.add_argument('--archive', action = 'store_true', help = "serve fields from the field archive")
+	parser.add_argument('--archive-path', default = None, help = "path of the field archive, defaults to data/processed/wind_fields.h5")
+	args = parser.parse_args(argv[1:])
+
+	with profiling.stage('load_state'):
+		load_state(args.filenames, args.max_hours, (args.archive_path or '') if args.archive else None)
+	if(args.socket):
+		if(os.path.exists(args.socket)):
+			os.remove(args.socket)
+		server = ThreadingUnixHTTPServer(args.socket, WindRequestHandler)
+		logger.info("Listening on %s", args.socket)
+	else:
+		server = ThreadingHTTPServer(('127.0.0.1', args.port), WindRequestHandler)
+		logger.info("Listening on http://127.0.0.1:%d", args.port)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		if(args.socket and os.path.exists(args.socket)):
+			os.remove(args.socket)
+		if(warm_state['archive'] is not None):
+			field_archive.close_field_archive(warm_state['archive'])
+	sys.exit(0)
+
+if __name__ == "__main__":
+	main(sys.argv)
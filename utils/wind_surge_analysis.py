@@ -17,68 +17,21 @@ June 22nd 2018
 @author: Henri De Boever
 '''
 
-import matplotlib.pyplot as plt
-from scipy.signal import find_peaks
-import datetime as dt
+from multiprocessing import Pool
 import numpy as np
 import pandas as pd
+import argparse, itertools, logging
 import sys ,os, shutil
 import os.path as path
+import profiling
+from station_loader import load_files, load_wind_frame, load_slev_csv
 
-# A helper function to display progress bar while the frames are being read in
-def progress_bar(value, endvalue, bar_length = 25):
-	percent = float(value) / endvalue
-	arrow = '-' * int(round(percent * bar_length)-1) + '>'
-	spaces = ' ' * (bar_length - len(arrow))
-	sys.stdout.write("\rPercent: [{0}] {1}%".format(arrow + spaces, int(round(percent * 100))))
-	sys.stdout.flush()
-
-# Loads an list of HDF5 files into memory. Takes a list of filenames provided by the user,
-# and returns a list of data frames which is passed onto other functions for further processing
-def load_files(filenames):
-
-	# Set this option to see more columns when printing pandas df for debugging purposes
-	pd.set_option('display.expand_frame_repr', False)
-
-	print("\nLoading data files into the program ...\n")
-	root_dir = path.abspath(path.join(__file__ ,"../.."))
-	relative_path = root_dir + "/data/processed/"
-	frames = []
-	for index, filename in enumerate(filenames):
-		# Search for the files in the data/processed directory
-		temp_path = relative_path + filename
-
-		# Add logic here to handle the read .hdf5, or the read .csv based on file extension
-		if(not temp_path.endswith('.csv')):
-			frame = pd.read_hdf(temp_path, filename)
-			# Get rid of the columns that we will not be using in this analysis
-			try:
-				del frame['Wind Spd Flag'], frame['Visibility (km)'], frame['Visibility Flag'], frame['Hmdx'], frame['Hmdx Flag']
-				del frame['Dew Point Temp (°C)'], frame['Dew Point Temp Flag'], frame['Rel Hum (%)'], frame['Rel Hum Flag']
-				del frame['Weather'], frame['Wind Chill'], frame['Wind Chill Flag'], frame['Year'], frame['Month'], frame['Day'], frame['Time']
-				del frame['Stn Press Flag'], frame['Stn Press (kPa)'], frame['Wind Dir Flag'], frame['Temp Flag'], frame['Temp (°C)']
-			except KeyError as e:
-				#print(e)
-				pass
-		elif(temp_path.endswith('.csv')):
-			frame = pd.read_csv(temp_path, filename, delimiter = ',', header = None, names = ['Date/Time', 'SLEV', 'N/A'])
-			frame['Date/Time'] = pd.to_datetime(frame['Date/Time']).dt.strftime('%Y-%m-%d %H:%M')
-			frame = frame.set_index('Date/Time')
-			try:
-				frame['SLEV'] =  pd.to_numeric(frame['SLEV'], errors='coerce')
-			except:
-				pass
-			#print(frame.dtypes)
-			del frame['N/A']
-		frames.append((filename, frame))
-		progress_bar(index + 1, len(filenames))
-	print("\nDone\n")
-	return frames
+logger = logging.getLogger(__name__)
 
 # This function takes a list of 2 dataframes as an argument and performs an inner join by matching the dataframe indices
 def join_dataframes(dataframes):
 
-	print('\nJoining dataframes...')
+	logger.info('Joining dataframes...')
 	df1 = dataframes[0][1]
 	df2 = dataframes[1][1]
 	df1.index.names = ['Date/Time']
@@ -86,111 +39,257 @@ def join_dataframes(dataframes):
 	# perform an inner join by default
 	merged_df = df1.join(df2, how = 'inner')
 
-	# Non Text File DF
-	try:
-		merged_df = merged_df.loc[(merged_df['Wind Dir (10s deg)'] >= 0) & (merged_df['Wind Dir (10s deg)'] <= 36)]
-		merged_df['SLEV'] =  merged_df['SLEV'] * 100
-	except KeyError as e:
-		pass
-		#print(e)
-	# Text File DF, handle the different formatting
-	try:
-		# Get the text file into the same format as the env. can. dataframes
-		wind_speeds = merged_df.loc[((merged_df['Data Type'] == '070') | (merged_df['Data Type'] == '076'))]
-		wind_speeds = wind_speeds.rename(columns = {'Data' : 'Wind Spd (km/h)'})
-		# Change the values here to get winds only from a certain direction
-		wind_directions = merged_df.loc[((merged_df['Data Type'] == '156') | (merged_df['Data Type'] == '069')) & ((merged_df['Data'] >= 0) & (merged_df['Data'] <= 36))]
-		wind_directions = wind_directions.rename(columns = {'Data' : 'Wind Dir (10s deg)'})
-		del wind_directions['Data Type'], wind_directions['climate_id']
-		del wind_speeds['Data Type'], wind_speeds['climate_id']
-		merged__text_file_df = wind_speeds.join(wind_directions, how = 'inner', lsuffix = '_l')
-		merged__text_file_df['SLEV'] = merged__text_file_df['SLEV'] * 100
-		del merged__text_file_df['SLEV_l']
-		#print(merged__text_file_df)
-		return merged__text_file_df
-	except KeyError as e:
-		pass
-		#print(e)
+	# Every station frame is loaded in the normalized format, so text file stations need no special handling here
+	# Change the values here to get winds only from a certain direction
+	merged_df = merged_df.loc[(merged_df['Wind Dir (10s deg)'] >= 0) & (merged_df['Wind Dir (10s deg)'] <= 36)].copy()
+	merged_df['SLEV'] = merged_df['SLEV'] * 100
 	return merged_df
 
+# Returns the start and end (exclusive) index of every run of consecutive values above threshold.
+# The runs are found in a single pass by differencing the boolean exceedance mask, NaNs never exceed the threshold
+def runs_above_threshold(values, threshold):
+	above = np.asarray(values, dtype = float) > threshold
+	edges = np.diff(above.astype(np.int8), prepend = 0, append = 0)
+	return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
 # Helper function called by plot_windspeed_slev()
-# A terribly commented threshold window finding function
+# For each index in index_list, returns the start and end (exclusive) of the run above threshold that contains it.
+# All the runs are computed once, so overlapping peaks never rescan the same samples, and a run starting at
+# index 0 stops there instead of wrapping around to the end of the series.
+# An index that is not itself above threshold gets a window containing only that index
 def indices_of_window_above_threshold(index_list, values, threshold):
 
-	windows = []
-	for index in index_list:
-		window = []
-		index2 = index
-		# Step forward while the value is greater than threshold.
-		while values[index2] > threshold:
-			window.append(index2)
-			index2 += 1
-		# Reset the the pointer to one behind the index, and step backwards while value is greater than threshold.
-		index2 = index - 1
-		while values[index2] > threshold:
-			window.append(index2)
-			index2 -= 1
-		# Record the indices in the window
-		windows.append(window)
-	# Return a list of windows
-	return windows
+	index_list = np.asarray(index_list, dtype = int)
+	starts, ends = runs_above_threshold(values, threshold)
+	if(len(starts) == 0):
+		return index_list.copy(), index_list + 1
+	# The run that could contain each index is the last one starting at or before it
+	runs = np.clip(np.searchsorted(starts, index_list, side = 'right') - 1, 0, None)
+	inside = (starts[runs] <= index_list) & (index_list < ends[runs])
+	return np.where(inside, starts[runs], index_list), np.where(inside, ends[runs], index_list + 1)
 
 # Helper function called by plot_windspeed_slev()
-# For each index in a window above threshold, find the max wind value in the other series
-def find_max_per_window(index_window_list, values, dates):
+# For each window [start, end) found above threshold, find the max value in the other series, ignoring NaNs.
+# Returns the window maxima, the dates of the maxima and their indices. Windows shared by several peaks are only reduced once
+def find_max_per_window(window_starts, window_ends, values, dates):
+
+	values = np.asarray(values, dtype = float)
+	if(len(window_starts) == 0):
+		return np.array([]), np.asarray(dates)[[]], np.array([], dtype = int)
+	windows, inverse = np.unique(np.stack([window_starts, window_ends], axis = 1), axis = 0, return_inverse = True)
+	inverse = inverse.reshape(-1)
+	lengths = windows[:, 1] - windows[:, 0]
+	# Lay every window out back to back so each one is a contiguous segment for reduceat
+	offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+	positions = np.repeat(windows[:, 0] - offsets, lengths) + np.arange(lengths.sum())
+	window_values = values[positions]
+	window_max = np.fmax.reduceat(window_values, offsets)
+	# The first sample equal to the maximum gives the date of the window maximum, all NaN windows keep their start
+	at_max = window_values == np.repeat(window_max, lengths)
+	window_index = np.minimum.reduceat(np.where(at_max, positions, len(values)), offsets)
+	window_index = np.where(window_index == len(values), windows[:, 0], window_index)
+	return window_max[inverse], np.asarray(dates)[window_index[inverse]], window_index[inverse]
+
+# Builds a sparse table for range maximum queries over values, ignoring NaNs.
+# Level k holds the maximum of every run of 2**k samples, levels are only built up to max_length samples
+def build_range_max_table(values, max_length):
+	table = [np.asarray(values, dtype = float)]
+	span = 1
+	while(span * 2 <= max_length):
+		previous = table[-1]
+		table.append(np.fmax(previous[:-span], previous[span:]))
+		span *= 2
+	return table
+
+# Returns the maximum of values[lo:hi] for every pair of bounds using two overlapping lookups in the sparse table.
+# Empty or all NaN ranges return NaN
+def query_range_max(table, lo, hi):
+	lengths = hi - lo
+	maxima = np.full(len(lo), np.nan)
+	valid = lengths > 0
+	levels = np.floor(np.log2(lengths[valid])).astype(int)
+	lo, hi = lo[valid], hi[valid]
+	result = np.full(len(lo), np.nan)
+	for level in np.unique(levels):
+		rows = levels == level
+		span = 1 << level
+		result[rows] = np.fmax(table[level][lo[rows]], table[level][hi[rows] - span])
+	maxima[valid] = result
+	return maxima
+
+# Returns the indices of the peaks of series1 found with scipy's find_peaks, NaNs are treated as 0 as in plot_windspeed_slev()
+def find_series_peaks(series1, height, distance):
+	from scipy.signal import find_peaks
+	peak_indices, _ = find_peaks(series1.fillna(0).to_numpy(dtype = float), height = height, distance = distance)
+	return peak_indices
+
+# Returns the start and end (exclusive) positions in the sorted index of series2 of the window of +/- window_hours around each time
+def get_window_bounds(times, series2, window_hours):
+	window = pd.Timedelta(hours = window_hours)
+	lo = series2.index.searchsorted(times - window, side = 'left')
+	hi = series2.index.searchsorted(times + window, side = 'right')
+	return lo, hi
+
+# Finds the peaks of series1, then the maximum of series2 within +/- window_hours of each peak, ignoring NaNs.
+# Both series must be indexed by datetime stamps. Peaks with no valid series2 value in their window are dropped.
+# Returns 3 arrays of size 1xN: the datetime stamps of the peaks, the peak values of series1 and the windowed maxima of series2.
+# The windows are resolved with searchsorted on the sorted index and a sparse table range maximum, so there is no per peak loop
+def peak_window_maxima(series1, series2, height, distance, window_hours):
+	return sweep_peak_window_maxima(series1, series2, height, distance, [window_hours])[window_hours]
+
+# Same as peak_window_maxima() for several window sizes at once, e.g. range(1, 73).
+# The peaks and the range maximum table are computed once and shared by every window size.
+# Returns a dict mapping each window size to its 3 arrays
+def sweep_peak_window_maxima(series1, series2, height, distance, window_hours_list):
+
+	series1 = series1.sort_index()
+	series2 = series2.sort_index()
+	peak_indices = find_series_peaks(series1, height, distance)
+	peak_times = series1.index[peak_indices]
+	peak_values = series1.to_numpy(dtype = float)[peak_indices]
+
+	bounds = {}
+	for window_hours in window_hours_list:
+		bounds[window_hours] = get_window_bounds(peak_times, series2, window_hours)
+	longest = max([1] + [int((hi - lo).max()) for lo, hi in bounds.values() if len(lo)])
+	table = build_range_max_table(series2.to_numpy(dtype = float), longest)
+
+	results = {}
+	for window_hours, (lo, hi) in bounds.items():
+		window_maxima = query_range_max(table, lo, hi)
+		valid = ~np.isnan(window_maxima)
+		results[window_hours] = (np.asarray(peak_times[valid]), peak_values[valid], window_maxima[valid])
+	return results
+
+# Finds the wind speed and storm surge peaks of a joined frame, and the maximum surge within the window over
+# wind_threshold around each wind speed peak. Returns a dict of the arrays used by the plots and the batch summary
+def correlate_windspeed_slev(df, wind_threshold, tide_threshold, time_frame):
+
+	from scipy.signal import find_peaks
+	# Replace NaNs with zeros otherwise find-peaks function call will not work
+	wind_speeds = df['Wind Spd (km/h)'].fillna(0).to_numpy(dtype = float)
+	slevs = df['SLEV'].to_numpy(dtype = float)
+	dates = df.index
 
-	second_series_peaks = []
-	for window in index_window_list:
-		curr_values = []
-		for index in window:
-			curr_values.append((values[index], dates[index], index))
-		second_series_peaks.append(max(curr_values, key = lambda x:x[0]))
-	return second_series_peaks
+	# Underscore is used to ignore unwanted return values while unpacking objects
+	peak_wind_indices, _  = find_peaks(wind_speeds, height = wind_threshold, distance = time_frame)
+	peak_slev_indices, _  = find_peaks(slevs, height = tide_threshold, distance = time_frame)
+
+	window_starts, window_ends = indices_of_window_above_threshold(peak_wind_indices, wind_speeds, wind_threshold)
+	window_max, window_dates, _ = find_max_per_window(window_starts, window_ends, slevs, dates)
+
+	return {
+		'wind_speeds': wind_speeds,
+		'slevs': slevs,
+		'dates': dates,
+		'peak_wind_speeds': wind_speeds[peak_wind_indices],
+		'peak_wind_dates': dates[peak_wind_indices],
+		'peak_slevs': slevs[peak_slev_indices],
+		'peak_slev_dates': dates[peak_slev_indices],
+		'window_max': window_max,
+		'window_dates': window_dates,
+	}
+
+# Returns the slope and intercept of the line of best fit of the peak wind speeds over the window surge maxima,
+# and their correlation coefficient. Windows without any surge reading are left out, NaNs are returned with fewer than 2 points
+def fit_windspeed_slev(window_max, peak_wind_speeds):
+
+	valid = ~np.isnan(window_max)
+	x, y = window_max[valid], peak_wind_speeds[valid]
+	if(len(x) < 2 or np.all(x == x[0])):
+		return np.nan, np.nan, np.nan
+	slope, intercept = np.polyfit(x, y, 1)
+	return slope, intercept, np.corrcoef(x, y)[0, 1]
+
+# Returns the sums over every lag from -max_lag to max_lag of a[t] * b[t + lag], computed with FFTs of the zero padded series
+def lagged_sums(a_spectrum, b_spectrum, size, max_lag):
+	from scipy.fft import irfft
+	sums = irfft(np.conj(a_spectrum) * b_spectrum, size)
+	return np.concatenate((sums[size - max_lag:], sums[:max_lag + 1]))
+
+# Returns the Pearson correlation between x[t] and y[t + lag] for every lag from -max_lag to max_lag hours,
+# using only the pairs where both values are valid, and the number of valid pairs at each lag.
+# x and y are hourly arrays of the same length with NaNs where there is no reading. Positive lags mean y follows x.
+# The masked sums of every lag are obtained with FFTs, so the cost does not grow with the number of lags
+def lagged_cross_correlation(x, y, max_lag, min_pairs = 3):
+
+	from scipy.fft import rfft, next_fast_len
+	x_valid, y_valid = ~np.isnan(x), ~np.isnan(y)
+	# Centring first keeps the sums small, which avoids cancellation when they are combined
+	x = np.where(x_valid, x - np.nanmean(x), 0) if x_valid.any() else np.zeros(len(x))
+	y = np.where(y_valid, y - np.nanmean(y), 0) if y_valid.any() else np.zeros(len(y))
+	size = next_fast_len(len(x) + max_lag)
+	spectra = [rfft(series, size) for series in (x_valid.astype(float), x, x * x, y_valid.astype(float), y, y * y)]
+	x_mask, x_sum, x_squares, y_mask, y_sum, y_squares = spectra
+
+	pairs = np.rint(lagged_sums(x_mask, y_mask, size, max_lag))
+	sum_x = lagged_sums(x_sum, y_mask, size, max_lag)
+	sum_y = lagged_sums(x_mask, y_sum, size, max_lag)
+	sum_xx = lagged_sums(x_squares, y_mask, size, max_lag)
+	sum_yy = lagged_sums(x_mask, y_squares, size, max_lag)
+	sum_xy = lagged_sums(x_sum, y_sum, size, max_lag)
+
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		covariance = pairs * sum_xy - sum_x * sum_y
+		variance = (pairs * sum_xx - sum_x ** 2) * (pairs * sum_yy - sum_y ** 2)
+		correlation = covariance / np.sqrt(np.clip(variance, 0, None))
+	correlation[(pairs < min_pairs) | ~np.isfinite(correlation)] = np.nan
+	return np.arange(-max_lag, max_lag + 1), np.clip(correlation, -1, 1), pairs.astype(int)
+
+# Parses a wind direction sector given as 'start-end' in tens of degrees, e.g. '9-18'. Sectors may wrap through north, e.g. '32-4'
+def parse_sector(sector):
+	start, end = sector.split('-')
+	return int(start), int(end)
+
+# Returns True for the directions that fall inside the sector, both ends included
+def in_sector(directions, sector):
+	start, end = sector
+	if(start <= end):
+		return (directions >= start) & (directions <= end)
+	return (directions >= start) | (directions <= end)
+
+# Computes the lagged cross-correlation of wind speed and storm surge over a joined frame for lags up to +/- max_lag hours.
+# The frame is put on a regular hourly grid first so lags are in hours, and missing hours are masked out.
+# With sectors, the wind speeds of each sector are correlated on their own, with the other hours masked out.
+# Returns a dict mapping 'all' or each sector name to the lags, correlations and pair counts
+def cross_correlate_windspeed_slev(df, max_lag, sectors = None):
+
+	hours = pd.date_range(df.index.min().floor('h'), df.index.max(), freq = 'h')
+	df = df[~df.index.duplicated(keep = 'first')].reindex(hours)
+	wind_speeds = df['Wind Spd (km/h)'].to_numpy(dtype = float)
+	slevs = df['SLEV'].to_numpy(dtype = float)
+
+	results = {'all': lagged_cross_correlation(wind_speeds, slevs, max_lag)}
+	directions = df['Wind Dir (10s deg)'].to_numpy(dtype = float)
+	for sector in (sectors or []):
+		sector_speeds = np.where(in_sector(directions, parse_sector(sector)), wind_speeds, np.nan)
+		results[sector] = lagged_cross_correlation(sector_speeds, slevs, max_lag)
+	return results
 
 def plot_windspeed_slev(df, filename, wind_threshold, tide_threshold, time_frame):
 
+	import matplotlib.pyplot as plt
 	# Allows ouy to print entire numpy array
-	np.set_printoptions(threshold='nan')
-	print("\nGenerating plots for %s and assembled_tides.csv..." % (filename))
+	np.set_printoptions(threshold = sys.maxsize)
+	logger.info("Generating plots for %s and assembled_tides.csv...", filename)
 
-	#Convert all the string objects in Date/Time index to datetime objects
-	dates = [dt.datetime.strptime(string, '%Y-%m-%d %H:%M') for string in df.index]
-	df.index = dates
 	if(len(df) == 0):
-		print("The dataframe is empty. Nothing to show here.")
+		logger.warning("The dataframe is empty. Nothing to show here.")
 		sys.exit(0)
 	try:
 		df.rename(columns = {'Data':'Wind Spd (km/h)'}, inplace = True)
 	except KeyError as e:
-		pass
-		print(e)
-
-	# Replace NaNs with zeros otherwise find-peaks function call will not work
-	wind_speeds = df['Wind Spd (km/h)'].tolist()
-	slevs = df['SLEV'].tolist()
-	dates = df.index.tolist()
-	for n, i in enumerate(wind_speeds):
-		if (np.isnan(i)):
-			wind_speeds[n] = 0
-
-	# Underscore is used to ignore unwanted return values while unpacking objects
-	peak_wind_indices, _  = find_peaks(wind_speeds, height = wind_threshold, distance = time_frame)
-	peak_slev_indices, _  = find_peaks(slevs, height = tide_threshold, distance = time_frame)
+		logger.debug("%s", e)
 
-	# Map the peak indices to the values and dates for wind speeds
-	peak_wind_speeds = [wind_speeds[index] for index in peak_wind_indices]
-	peak_wind_dates = [dates[index] for index in peak_wind_indices]
-
-	# Map the peak indices to the values and dates for storm surges
-	peak_slevs = [slevs[index] for index in peak_slev_indices]
-	peak_slev_dates = [dates[index] for index in peak_slev_indices]
+	results = correlate_windspeed_slev(df, wind_threshold, tide_threshold, time_frame)
+	wind_speeds, slevs, dates = results['wind_speeds'], results['slevs'], results['dates']
+	peak_wind_speeds, peak_wind_dates = results['peak_wind_speeds'], results['peak_wind_dates']
+	peak_slevs, peak_slev_dates = results['peak_slevs'], results['peak_slev_dates']
 
 	# Wind speed peaks for surge window-----------------------------------------------------------------
 
-	# index_windows = indices_of_window_above_threshold(peak_slev_indices.tolist(), slevs, tide_threshold)
-	# peaks_in_window = find_max_per_window(index_windows, wind_speeds, dates)
-	# window_max = [peaks_in_window[index][0] for index, item in enumerate(peaks_in_window)]
-	# window_dates = [peaks_in_window[index][1] for index, item in enumerate(peaks_in_window)]
+	# window_starts, window_ends = indices_of_window_above_threshold(peak_slev_indices, slevs, tide_threshold)
+	# window_max, window_dates, _ = find_max_per_window(window_starts, window_ends, wind_speeds, dates)
 	#
 	# # Use a masked array to suppress slev values that are below threshold, only used for plotting
 	# slevs_masked = np.ma.masked_less(slevs, tide_threshold)
@@ -214,20 +313,32 @@ def plot_windspeed_slev(df, filename, wind_threshold, tide_threshold, time_frame
 
 	# # Surge peaks for wind speed window-----------------------------------------------------------------------
 
-	index_windows = indices_of_window_above_threshold(peak_wind_indices.tolist(), wind_speeds, wind_threshold)
-	peaks_in_window = find_max_per_window(index_windows, slevs, dates)
-	window_max = [peaks_in_window[index][0] for index, item in enumerate(peaks_in_window)]
-	window_dates = [peaks_in_window[index][1] for index, item in enumerate(peaks_in_window)]
+	draw_windspeed_slev(df, results, filename, wind_threshold, time_frame, plt.show)
+
+	#-----------------------------------------------------------------------------------------------------------
+
+	print('The number of peaks over windspeed threshold is: %s' % str(len(peak_wind_speeds)))
+	print('The number of peaks over storm surge threshold is: %s' % str(len(peak_slevs)))
+
+# Draws the scatter plot of peak wind speeds over window surge maxima and the time series plot.
+# finish_figure is called after each figure, plt.show for interactive sessions or a function saving the figure in batch mode
+def draw_windspeed_slev(df, results, filename, wind_threshold, time_frame, finish_figure):
+
+	import matplotlib.pyplot as plt
+	window_max, window_dates, peak_wind_speeds = results['window_max'], results['window_dates'], results['peak_wind_speeds']
+	valid = ~np.isnan(window_max)
 
 	# Use a masked array to suppress values that are below threshold, only used for plotting
-	wind_speeds_masked = np.ma.masked_less(wind_speeds, wind_threshold)
+	wind_speeds_masked = np.ma.masked_less(results['wind_speeds'], wind_threshold)
 	plt.scatter(window_max, peak_wind_speeds)
 	plt.xlabel('Max Surge (cm) Per Window over Threshold')
 	plt.ylabel('Max Wind Speed (km/h) per Window over Threshold')
 	plt.title("Max window wind speed over max surge for window over %dkm/h\nfor %s" % (wind_threshold, filename))
 	# Line of best fit
-	plt.plot(np.unique(window_max), np.poly1d(np.polyfit(window_max, peak_wind_speeds, 1))(np.unique(window_max)), color = 'r')
-	plt.show()
+	slope, intercept, _ = fit_windspeed_slev(window_max, peak_wind_speeds)
+	if(not np.isnan(slope)):
+		plt.plot(np.unique(window_max[valid]), np.poly1d([slope, intercept])(np.unique(window_max[valid])), color = 'r')
+	finish_figure()
 
 	plt.scatter(window_dates, window_max, color = 'k')
 	#plt.scatter(peak_wind_dates, peak_wind_speeds, color = 'r')
@@ -236,30 +347,168 @@ def plot_windspeed_slev(df, filename, wind_threshold, tide_threshold, time_frame
 	plt.plot(df.index, wind_speeds_masked, 'r', linewidth = 2)
 	plt.title("Surge Peaks for %d Hour Periods Over %dkm/h Wind Speed Windows\nfor %s" % (time_frame, wind_threshold, filename))
 	plt.legend(bbox_to_anchor=(0.5, -0.1), loc = 8, ncol = 2, mode = "expand", borderaxespad = 0.)
-	plt.show()
+	finish_figure()
 
-	#-----------------------------------------------------------------------------------------------------------
+# Returns the directory the batch summary and figures are written to
+def get_results_directory():
+	root_dir = path.abspath(path.join(__file__ ,"../.."))
+	return root_dir + "/results/"
 
-	print('The number of peaks over windspeed threshold is: %s' % str(len(peak_wind_speeds)))
-	print('The number of peaks over storm surge threshold is: %s' % str(len(peak_slevs)))
+# Batch worker, runs every threshold combination for a single (wind station, tide gauge) pair.
+# The pair is loaded and joined once, and one summary row is returned per combination
+def analyze_pair(task):
+
+	wind_filename, gauge_filename, combinations, save_figures = task
+	rows = []
+	try:
+		df = join_dataframes([(wind_filename, load_wind_frame(wind_filename)), (gauge_filename, load_slev_csv(gauge_filename))])
+	except (OSError, KeyError, ValueError) as e:
+		logger.warning("Skipping %s and %s: %s", wind_filename, gauge_filename, e)
+		return rows
+
+	for wind_threshold, tide_threshold, time_frame in combinations:
+		row = {'wind_station': wind_filename, 'tide_gauge': gauge_filename, 'wind_threshold': wind_threshold,
+			'tide_threshold': tide_threshold, 'time_frame': time_frame, 'hours': len(df)}
+		if(len(df) == 0):
+			rows.append(dict(row, wind_peaks = 0, surge_peaks = 0, windows = 0, slope = np.nan, intercept = np.nan, correlation = np.nan))
+			continue
+		results = correlate_windspeed_slev(df, wind_threshold, tide_threshold, time_frame)
+		slope, intercept, correlation = fit_windspeed_slev(results['window_max'], results['peak_wind_speeds'])
+		rows.append(dict(row, wind_peaks = len(results['peak_wind_speeds']), surge_peaks = len(results['peak_slevs']),
+			windows = int(np.count_nonzero(~np.isnan(results['window_max']))), slope = slope, intercept = intercept, correlation = correlation))
+
+		if(save_figures):
+			name = "%s_%s_%g_%g_%d" % (wind_filename, path.splitext(gauge_filename)[0], wind_threshold, tide_threshold, time_frame)
+			figure_names = iter(['scatter', 'series'])
+			import matplotlib.pyplot as plt
+			def save_figure():
+				plt.savefig(get_results_directory() + "wind_surge_%s_%s.svg" % (name, next(figure_names)), bbox_inches = 'tight')
+				plt.close()
+			draw_windspeed_slev(df, results, wind_filename, wind_threshold, time_frame, save_figure)
+	return rows
+
+# Runs every (wind station, tide gauge) pair over the grid of thresholds in a process pool without any interactive plots,
+# and writes one summary table with a row per pair and threshold combination to the results folder
+def run_batch(wind_filenames, gauge_filenames, wind_thresholds, tide_thresholds, time_frames, output, processes, save_figures):
+
+	# Figures are only ever written to file in batch mode. matplotlib is not loaded at all when no figures are asked for
+	if(save_figures):
+		import matplotlib.pyplot as plt
+		plt.switch_backend('Agg')
+	# find_peaks is slow to import, loading it before the pool starts lets every forked worker share it
+	from scipy.signal import find_peaks
+	combinations = list(itertools.product(wind_thresholds, tide_thresholds, time_frames))
+	tasks = [(wind_filename, gauge_filename, combinations, save_figures) for wind_filename in wind_filenames for gauge_filename in gauge_filenames]
+	logger.info("Running %d station and gauge pairs over %d threshold combinations ...", len(tasks), len(combinations))
+
+	rows = []
+	with profiling.stage('batch_pairs') as current, Pool(processes) as pool:
+		for index, pair_rows in enumerate(pool.imap_unordered(analyze_pair, tasks)):
+			rows.extend(pair_rows)
+			current.count(rows = len(pair_rows))
+			profiling.progress_bar(index + 1, len(tasks))
+
+	columns = ['wind_station', 'tide_gauge', 'wind_threshold', 'tide_threshold', 'time_frame', 'hours',
+		'wind_peaks', 'surge_peaks', 'windows', 'slope', 'intercept', 'correlation']
+	summary = pd.DataFrame(rows, columns = columns)
+	summary = summary.sort_values(['wind_station', 'tide_gauge', 'wind_threshold', 'tide_threshold', 'time_frame']).reset_index(drop = True)
+	summary.to_csv(get_results_directory() + output, index = False)
+	logger.info("Wrote %d rows to %s", len(summary), get_results_directory() + output)
+	return summary
+
+# Batch worker, computes the lagged cross-correlation of a single (wind station, tide gauge) pair for every sector.
+# Returns one row per pair, sector and lag
+def cross_correlate_pair(task):
+
+	wind_filename, gauge_filename, max_lag, sectors = task
+	try:
+		df = join_dataframes([(wind_filename, load_wind_frame(wind_filename)), (gauge_filename, load_slev_csv(gauge_filename))])
+	except (OSError, KeyError, ValueError) as e:
+		logger.warning("Skipping %s and %s: %s", wind_filename, gauge_filename, e)
+		return []
+	if(len(df) == 0):
+		return []
+	rows = []
+	for sector, (lags, correlations, pairs) in cross_correlate_windspeed_slev(df, max_lag, sectors).items():
+		rows.append(pd.DataFrame({'wind_station': wind_filename, 'tide_gauge': gauge_filename, 'sector': sector,
+			'lag_hours': lags, 'correlation': correlations, 'pairs': pairs}))
+	return rows
+
+# Runs the lagged cross-correlation of every (wind station, tide gauge) pair in a process pool and writes every lag
+# to one table, and the lag with the strongest correlation of each pair and sector to a summary table
+def run_cross_correlation_batch(wind_filenames, gauge_filenames, max_lag, sectors, output, processes):
+
+	tasks = [(wind_filename, gauge_filename, max_lag, sectors) for wind_filename in wind_filenames for gauge_filename in gauge_filenames]
+	logger.info("Cross-correlating %d station and gauge pairs for lags up to %d hours ...", len(tasks), max_lag)
+
+	frames = []
+	with profiling.stage('cross_correlate_pairs') as current, Pool(processes) as pool:
+		for index, pair_frames in enumerate(pool.imap_unordered(cross_correlate_pair, tasks)):
+			frames.extend(pair_frames)
+			current.count(points = sum(len(frame) for frame in pair_frames))
+			profiling.progress_bar(index + 1, len(tasks))
+	if(len(frames) == 0):
+		logger.warning("No pair had any hours in common. Nothing to write.")
+		return None
+
+	curves = pd.concat(frames, ignore_index = True).sort_values(['wind_station', 'tide_gauge', 'sector', 'lag_hours']).reset_index(drop = True)
+	strongest = curves.dropna(subset = ['correlation'])
+	strongest = strongest.loc[strongest.groupby(['wind_station', 'tide_gauge', 'sector'])['correlation'].idxmax()].reset_index(drop = True)
+	curves.to_csv(get_results_directory() + output, index = False)
+	strongest.to_csv(get_results_directory() + path.splitext(output)[0] + '_summary.csv', index = False)
+	logger.info("Wrote %d lags to %s", len(curves), get_results_directory() + output)
+	return strongest
+
+# Parses the arguments of the headless batch mode
+def batch_main(argv):
+
+	parser = argparse.ArgumentParser(description = "Correlate wind speed and storm surge peaks for every station and tide gauge pair.")
+	parser.add_argument('--batch', action = 'store_true', help = "run headless over every pair and threshold combination")
+	parser.add_argument('--wind', nargs = '+', required = True, help = "processed wind station files in data/processed")
+	parser.add_argument('--gauges', nargs = '+', required = True, help = "sea level .csv files in data/processed")
+	parser.add_argument('--wind-thresholds', nargs = '+', type = float, default = [43.2], help = "wind speed peak thresholds (km/h)")
+	parser.add_argument('--tide-thresholds', nargs = '+', type = float, default = [45], help = "storm surge peak thresholds (cm)")
+	parser.add_argument('--time-frames', nargs = '+', type = int, default = [1], help = "minimum hours between peaks")
+	parser.add_argument('--processes', type = int, default = None, help = "number of worker processes, defaults to the number of CPUs")
+	parser.add_argument('--output', default = 'wind_surge_summary.csv', help = "name of the summary table written to the results folder")
+	parser.add_argument('--figures', action = 'store_true', help = "also save the figures of every combination to the results folder")
+	parser.add_argument('--xcorr', action = 'store_true', help = "compute the lagged cross-correlation of each pair instead of the threshold summary")
+	parser.add_argument('--max-lag-days', type = float, default = 3, help = "largest lag of the cross-correlation (days)")
+	parser.add_argument('--sectors', nargs = '+', default = None, help = "wind direction sectors in tens of degrees to correlate separately, e.g. 0-9 9-18 32-4")
+	parser.add_argument('--xcorr-output', default = 'wind_surge_xcorr.csv', help = "name of the cross-correlation table written to the results folder")
+	args = parser.parse_args(argv[1:])
+
+	if(args.xcorr):
+		run_cross_correlation_batch(args.wind, args.gauges, int(round(args.max_lag_days * 24)), args.sectors, args.xcorr_output, args.processes)
+		return
+	run_batch(args.wind, args.gauges, args.wind_thresholds, args.tide_thresholds, args.time_frames,
+		args.output, args.processes, args.figures)
 
 # The main function handles higher level program logic
 def main(argv):
 
-	if(len(argv) < 3):
+	argv = profiling.setup(argv)
+	if('--batch' in argv):
+		batch_main(argv)
+		sys.exit(0)
+	elif(len(argv) < 3):
 		print("Include a wind .hdf data file, and a sea level .csv data file.")
-		print("Filenames should be separated by spaces.\n")
+		print("Filenames should be separated by spaces.")
+		print("Or run every pair headless: --batch --wind STATION ... --gauges GAUGE.csv ... [--wind-thresholds ...] [--tide-thresholds ...]\n")
 		sys.exit(0)
 	else:
 
-		print('\n')
 		# Load the data in to the program from the hdf files
 		dataframes = load_files(argv[1:])
 
-		#print(dataframes)
-		dataframe = join_dataframes(dataframes)
+		logger.debug("%s", dataframes)
+		with profiling.stage('join_dataframes') as current:
+			dataframe = join_dataframes(dataframes)
+			current.count(rows = len(dataframe))
 		# data source, data source, (km/h), (cm), (hours)
-		plot_windspeed_slev(dataframe, argv[1], 43.2, 45, 1)
+		with profiling.stage('plot_windspeed_slev') as current:
+			plot_windspeed_slev(dataframe, argv[1], 43.2, 45, 1)
+			current.count(rows = len(dataframe))
 
 		sys.exit(0)
 